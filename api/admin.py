@@ -1,9 +1,26 @@
 # api/admin.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select
 from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import datetime
+import codecs
+import csv
+import io
+import json
+import time
 import models, schemas, database
 from api.users import get_current_user
+from search import product_index
+from cache import product_cache, ai_response_cache
+from passwords import password_executor
+from api import ai
+from recommender import item_similarity, personal_recommendations
+import provisioning
 
 router = APIRouter(
     prefix="/admin",
@@ -19,13 +36,7 @@ def get_current_admin(current_user: models.User = Depends(get_current_user)):
         )
     return current_user
 
-@router.post("/products", response_model=schemas.Product, status_code=status.HTTP_201_CREATED)
-def create_product(
-    product: schemas.ProductCreate, 
-    db: Session = Depends(database.get_db),
-    admin_user: models.User = Depends(get_current_admin)
-):
-    # --- 修复逻辑开始 ---
+def _get_default_seller(db: Session) -> models.Seller:
     # 1. 尝试获取第一个存在的商家
     seller = db.query(models.Seller).first()
     
@@ -35,14 +46,26 @@ def create_product(
         db.add(seller)
         db.commit()
         db.refresh(seller)
+    return seller
+
+@router.post("/products", response_model=schemas.Product, status_code=status.HTTP_201_CREATED)
+def create_product(
+    product: schemas.ProductCreate, 
+    db: Session = Depends(database.get_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    # --- 修复逻辑开始 ---
+    seller = _get_default_seller(db)
     
-    # 3. 使用获取到的有效 seller_id
+    # 使用获取到的有效 seller_id
     new_product = models.Product(**product.dict(), seller_id=seller.id) 
     # --- 修复逻辑结束 ---
 
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
+    product_index.add(new_product)
+    product_cache.invalidate_product(new_product.id)
     return new_product
 
 @router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -58,4 +81,314 @@ def delete_product(
         
     product_query.delete(synchronize_session=False)
     db.commit()
+    product_index.remove(product_id)
+    product_cache.invalidate_product(product_id)
     return
+
+@router.get("/cache/stats", summary="商品缓存命中统计")
+def get_cache_stats(admin_user: models.User = Depends(get_current_admin)):
+    """返回商品缓存的容量、命中/未命中/淘汰次数，用于调整缓存大小和 TTL。"""
+    return product_cache.stats()
+
+@router.get("/ai/cache/stats", summary="AI 回答缓存命中统计")
+def get_ai_cache_stats(admin_user: models.User = Depends(get_current_admin)):
+    """AI 助手回答缓存的命中/未命中次数，以及内存层和磁盘层各自的容量与淘汰情况。"""
+    return ai_response_cache.stats()
+
+@router.get("/ai/upstream/stats", summary="AI 上游调用并发状态")
+def get_ai_upstream_stats(admin_user: models.User = Depends(get_current_admin)):
+    """AI 上游调用的在途数、排队深度、被拒（429）和排队超时（503）次数，以及合并到在途调用的请求数。"""
+    return ai.upstream_stats()
+
+@router.get("/recommendations/stats", summary="推荐系统状态")
+def get_recommendation_stats(admin_user: models.User = Depends(get_current_admin)):
+    """相似商品表的规模和待合并的收藏变化数，以及个性化推荐缓存的命中情况和活跃用户数。"""
+    return {"similarity": item_similarity.stats(), "personal": personal_recommendations.stats()}
+
+@router.post("/users/bulk", response_model=schemas.UserProvisionReport, summary="批量开通用户")
+def provision_users(
+    batch: schemas.UserProvisionBatch,
+    db: Session = Depends(database.get_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    """
+    一次开通一批用户（例如企业客户入驻）。已存在的用户名和批内重复的用户名会跳过并在报告中列出；
+    密码在多进程中并行哈希，用户按批次写入。命令行版本见 provisioning.py。
+    """
+    return provisioning.provision_users(db, [user.model_dump() for user in batch.users])
+
+@router.get("/login/stats", summary="登录线程池状态")
+def get_login_executor_stats(admin_user: models.User = Depends(get_current_admin)):
+    """密码哈希专用线程池的排队深度、执行中数量、拒绝次数和排队等待时间。"""
+    return password_executor.stats()
+
+@router.get("/db/pool", summary="数据库连接池状态")
+def get_db_pool_status(admin_user: models.User = Depends(get_current_admin)):
+    """
+    返回连接池的实时状态：已借出、空闲、溢出连接数，取连接的等待时间分布和超时次数。
+    等待时间 p95 持续升高或出现超时，说明 DB_POOL_SIZE / DB_MAX_OVERFLOW 偏小或存在慢查询占着连接。
+    """
+    return database.pool_status(database.engine)
+
+
+# --- 商品导出 ---
+
+# 导出的列；只查询这些列，避免为每行构造 ORM 对象
+EXPORT_COLUMNS = ("id", "name", "price", "description", "seller_id", "image_url", "favorites_count", "updated_at")
+# 每批从数据库游标取多少行，同时也是每次写出到响应流的行数
+EXPORT_BATCH_SIZE = 1000
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def format_ndjson(rows) -> str:
+    return "".join(
+        json.dumps({column: _export_value(value) for column, value in zip(EXPORT_COLUMNS, row)}, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+def format_csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_export_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+def export_statement(seller_id: Optional[int], updated_since: Optional[datetime]):
+    """导出用的查询；同步与异步路由共用。"""
+    stmt = select(*(getattr(models.Product, column) for column in EXPORT_COLUMNS))
+    if seller_id is not None:
+        stmt = stmt.filter(models.Product.seller_id == seller_id)
+    if updated_since is not None:
+        stmt = stmt.filter(models.Product.updated_at >= updated_since)
+    # yield_per 会启用 stream_results：MySQL 下使用服务端游标，不会把结果集一次性读进内存
+    return stmt.order_by(models.Product.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+def export_response(chunks, format: str) -> StreamingResponse:
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+def _export_chunks(partitions, format: str):
+    """每批行格式化成一个字符串写出，CSV 先写表头。"""
+    formatter = format_csv if format == "csv" else format_ndjson
+    if format == "csv":
+        yield format_csv([EXPORT_COLUMNS])
+    for rows in partitions:
+        yield formatter(rows)
+
+@router.get("/products/export", summary="流式导出商品数据")
+def export_products(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="导出格式: 'ndjson' 或 'csv'"),
+    seller_id: Optional[int] = Query(None, description="只导出某个商家的商品"),
+    updated_since: Optional[datetime] = Query(None, description="只导出该时间之后修改过的商品"),
+    db: Session = Depends(database.get_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    """
+    供比价、分析等下游任务拉取全量商品。
+    使用服务端游标分批读取并边读边写出响应，内存占用与商品总数无关。
+    """
+    result = db.execute(export_statement(seller_id, updated_since))
+    return export_response(_export_chunks(result.partitions(), format), format)
+
+
+# --- 商品批量导入 ---
+
+# 每个分块一起校验、一次多行 INSERT、一个事务
+IMPORT_CHUNK_SIZE = 1000
+# 错误报告最多保留的条数，避免整份文件都出错时报告本身过大
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+async def _iter_lines(request: Request):
+    """边接收请求体边按行切分，不把整个上传文件读进内存。"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def _ndjson_records(request: Request):
+    """逐行产出 (行号, 记录, 解析错误)。"""
+    row = 0
+    async for line in _iter_lines(request):
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row, None, f"JSON 解析失败: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield row, None, "每行必须是一个 JSON 对象"
+            continue
+        yield row, record, None
+
+async def _csv_records(request: Request):
+    """第一行为表头；引号内允许换行。逐条产出 (行号, 记录, 解析错误)。"""
+    header = None
+    row = 0
+    record_lines = []
+    async for line in _iter_lines(request):
+        record_lines.append(line)
+        text = "\n".join(record_lines)
+        if text.count('"') % 2:
+            continue  # 引号尚未闭合，说明换行在字段内部，记录还没结束
+        record_lines = []
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, None, f"列数为 {len(values)}，与表头的 {len(header)} 列不一致"
+            continue
+        # 空单元格视为未填写，交给 schema 决定是否必填
+        yield row, {name: (value if value != "" else None) for name, value in zip(header, values)}, None
+    if record_lines:
+        yield row + 1, None, "CSV 引号未闭合"
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()
+    )
+
+# 写入后需要加进搜索索引的列
+_INDEXED_COLUMNS = (models.Product.id, models.Product.name, models.Product.price, models.Product.description)
+
+def _insert_products(db: Session, rows: list, seller_id: int) -> list:
+    """
+    多行 INSERT，返回新商品的 (id, name, price, description)，供增量更新搜索索引。
+    支持 executemany + RETURNING 的数据库（SQLite、PostgreSQL、MariaDB）直接取回；
+    MySQL 不支持，按写入前的最大 id 取回该商家 id 更大的商品（并发写入的其他商品也会被取回，重复加入索引无害）。
+    """
+    if db.get_bind().dialect.insert_executemany_returning:
+        return db.execute(insert(models.Product).returning(*_INDEXED_COLUMNS), rows).all()
+    floor = db.scalar(select(func.max(models.Product.id))) or 0
+    db.execute(insert(models.Product), rows)
+    return db.execute(
+        select(*_INDEXED_COLUMNS).where(models.Product.seller_id == seller_id, models.Product.id > floor)
+    ).all()
+
+def _import_chunk(db: Session, chunk: list, seller_id: int):
+    """
+    校验一个分块并批量写入。返回 (成功行数, [(行号, 错误), ...])。
+    合法的行通过一次 executemany 写入（SQLAlchemy 会合并成多行 INSERT），整块一个事务。
+    提交后把新商品增量加入搜索索引，而不是清空索引、让下一次搜索在请求路径上全量重建。
+    """
+    rows = []
+    row_numbers = []
+    errors = []
+    for row, record in chunk:
+        try:
+            product = schemas.ProductCreate.model_validate(record)
+        except ValidationError as e:
+            errors.append((row, _format_validation_error(e)))
+            continue
+        rows.append({**product.model_dump(), "seller_id": seller_id})
+        row_numbers.append(row)
+    if not rows:
+        return 0, errors
+    try:
+        inserted = _insert_products(db, rows, seller_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        message = f"数据库写入失败: {type(e).__name__}"
+        errors.extend((row, message) for row in row_numbers)
+        return 0, errors
+    product_index.add_many(inserted)
+    return len(rows), errors
+
+def _resolve_import_seller(db: Session, seller_id: Optional[int]) -> int:
+    if seller_id is None:
+        return _get_default_seller(db).id
+    if db.query(models.Seller.id).filter(models.Seller.id == seller_id).first() is None:
+        raise HTTPException(status_code=404, detail=f"Seller with id {seller_id} not found")
+    return seller_id
+
+async def run_import(request: Request, format: str, call) -> schemas.ProductImportReport:
+    """
+    批量导入的主流程，同步与异步路由共用。
+    call(fn, *args) 负责在合适的上下文里执行同步数据库函数 fn(db, *args)：
+    同步路由放进线程池，异步路由通过 AsyncSession.run_sync 执行。
+    """
+    started = time.perf_counter()
+    records = _csv_records(request) if format == "csv" else _ndjson_records(request)
+
+    total_rows = 0
+    imported = 0
+    failed = 0
+    errors: List[schemas.ImportRowError] = []
+    truncated = False
+
+    def record_errors(row_errors):
+        nonlocal failed, truncated
+        failed += len(row_errors)
+        for row, message in row_errors:
+            if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                errors.append(schemas.ImportRowError(row=row, error=message))
+            else:
+                truncated = True
+
+    chunk = []
+    async for row, record, error in records:
+        total_rows += 1
+        if error:
+            record_errors([(row, error)])
+            continue
+        chunk.append((row, record))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            count, row_errors = await call(_import_chunk, chunk)
+            imported += count
+            record_errors(row_errors)
+            chunk = []
+    if chunk:
+        count, row_errors = await call(_import_chunk, chunk)
+        imported += count
+        record_errors(row_errors)
+
+    if imported:
+        product_cache.invalidate_lists()
+
+    elapsed = time.perf_counter() - started
+    return schemas.ProductImportReport(
+        total_rows=total_rows,
+        imported=imported,
+        failed=failed,
+        errors=sorted(errors, key=lambda e: e.row),
+        errors_truncated=truncated,
+        elapsed_seconds=round(elapsed, 4),
+        rows_per_second=round(total_rows / elapsed, 1) if elapsed > 0 else 0.0,
+    )
+
+@router.post("/products/import", response_model=schemas.ProductImportReport, summary="批量导入商品")
+async def import_products(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="上传格式: 'ndjson' 或 'csv'（首行为表头）"),
+    seller_id: Optional[int] = Query(None, description="导入到哪个商家，默认与单个创建接口相同"),
+    db: Session = Depends(database.get_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    """
+    以流的方式接收供应商商品文件（请求体直接是文件内容），
+    按分块校验并批量写入，返回逐行错误报告和吞吐统计。
+    某一块写入失败只影响该块，之前已提交的块保持有效。
+    """
+    seller_id = await run_in_threadpool(_resolve_import_seller, db, seller_id)
+
+    # 校验和写库都是同步阻塞操作，放到线程池里，不占用事件循环
+    async def call(fn, chunk):
+        return await run_in_threadpool(fn, db, chunk, seller_id)
+
+    return await run_import(request, format, call)
@@ -1,13 +1,31 @@
 # api/ai.py (Updated to use the OpenAI library)
 
+import asyncio
+import hashlib
+import json
 import os
-from fastapi import APIRouter, HTTPException
+import time
+import unicodedata
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
 import openai  # 1. Import the openai library
 
-# Define the request body model (remains the same)
+from cache import ai_response_cache, MISSING
+from database import get_db
+from metrics import Counter, Gauge, Histogram
+from search import product_index
+
+# Define the request body model
 class Question(BaseModel):
     query: str
+    # stream=true 时以 Server-Sent Events 逐段返回回答，首字节不必等整段回答生成完
+    stream: bool = False
 
 # Create a new router (remains the same)
 router = APIRouter(
@@ -17,51 +35,418 @@ router = APIRouter(
 
 # Get the API Key from environment variables (do NOT hardcode secrets)
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+# 任何兼容 OpenAI 接口的服务都可以，本地开发和测试时可指向假的服务
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+# 单次调用的超时时间（秒）；流式调用中指相邻两段之间的最长间隔
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "60"))
+# 连接失败、429、5xx 时客户端自动重试的次数
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+# 每个 worker 同时进行的上游调用数上限、排队数上限，以及排队的最长等待时间（秒）
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "32"))
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "5"))
+# 每次提问最多注入提示词的相关商品数
+AI_CONTEXT_PRODUCTS = int(os.getenv("AI_CONTEXT_PRODUCTS", "5"))
+
+SYSTEM_PROMPT = "你是一个名为'京西网'的电商平台的智能导购助手。请友好、简洁地回答用户关于商品的咨询。"
+CONTEXT_PROMPT = "以下是本站与用户问题相关的商品（编号、名称、价格、简介）。涉及商品和价格时只依据这些信息回答，列表中没有的商品请如实说明：\n"
+# 系统提示词的版本：改了提示词，旧回答自动不再命中缓存
+PROMPT_VERSION = hashlib.sha256((SYSTEM_PROMPT + CONTEXT_PROMPT).encode("utf-8")).hexdigest()[:12]
+# 回答是否来自缓存，通过响应头告知（便于排查和统计）
+CACHE_HEADER = "X-AI-Cache"
+
+# 2. 使用异步客户端：等待模型回答时不占用事件循环，同一 worker 上的其他请求照常处理。
+# 客户端内部维护 HTTP 连接池，全进程共用一个，避免每次提问都重新建立 TLS 连接。
+# 连接池绑定在创建它的事件循环上，因此按事件循环懒创建（生产环境每个 worker 只有一个事件循环）。
+_client: Optional[openai.AsyncOpenAI] = None
+_client_loop = None
+
+
+def get_client() -> Optional[openai.AsyncOpenAI]:
+    global _client, _client_loop
+    if not DEEPSEEK_API_KEY:
+        return None  # 保持 None，以便在缺少密钥时返回 500 错误并提示配置问题
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = openai.AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL,
+                                     timeout=AI_TIMEOUT, max_retries=AI_MAX_RETRIES)
+        _client_loop = loop
+    return _client
+
+
+def configure_client(api_key: Optional[str], base_url: Optional[str] = None):
+    """替换密钥和服务地址（测试中指向假的 OpenAI 兼容服务），下次调用时重新创建客户端。"""
+    global DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, _client, _client_loop
+    DEEPSEEK_API_KEY = api_key
+    if base_url:
+        DEEPSEEK_BASE_URL = base_url
+    _client = _client_loop = None
+
+
+async def close_client():
+    """应用关闭时释放连接池。"""
+    global _client, _client_loop
+    if _client is not None:
+        await _client.close()
+    _client = _client_loop = None
+
+
+# --- 回答缓存 ---
+# 同一个问题的不同写法（全角/半角、大小写、标点、空格）归一成同一个键，
+# 例如 "有什么耳机推荐？"、"有什么 耳机推荐" 和 "有什么耳机推荐" 命中同一条缓存。
+
+# 去掉的字符类别：标点（P*）、空白分隔符（Z*）、表情等其他符号（So）和修饰符号（Sk）；
+# 数学符号和货币符号（如 <、¥）可能改变问题的含义，保留
+_DROPPED_CATEGORIES = ("P", "Z", "So", "Sk")
+
+
+def _is_cjk(char: str) -> bool:
+    return unicodedata.east_asian_width(char) in ("W", "F")
+
+
+def normalize_query(query: str) -> str:
+    # NFKC 把全角字母数字和标点折叠成半角，再统一小写
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = "".join(" " if ch.isspace() or unicodedata.category(ch).startswith(_DROPPED_CATEGORIES) else ch for ch in text)
+    words = text.split()
+    if not words:
+        return ""
+    # 中文词之间的空格不改变含义，去掉；两个英文/数字词之间保留一个空格
+    normalized = words[0]
+    for word in words[1:]:
+        if not (_is_cjk(normalized[-1]) or _is_cjk(word[0])):
+            normalized += " "
+        normalized += word
+    return normalized
+
+
+def cache_key(query: str, context: str = "") -> Optional[str]:
+    """
+    缓存键：提示词版本 + 模型 + 商品上下文指纹 + 归一化后的问题；问题只有标点空白时不缓存。
+    相关商品增删或改价后上下文变了，同一个问题自然不再命中旧回答。
+    """
+    normalized = normalize_query(query)
+    if not normalized:
+        return None
+    fingerprint = hashlib.sha256(context.encode("utf-8")).hexdigest()[:12] if context else "-"
+    return f"{PROMPT_VERSION}:{DEEPSEEK_MODEL}:{fingerprint}:{normalized}"
+
+
+# --- 商品检索 ---
+# 把整个商品目录塞进提示词既慢又贵，且随商品数增长。这里复用商品搜索的 BM25 索引（随商品增删增量更新），
+# 每次只取与问题最相关的 AI_CONTEXT_PRODUCTS 件商品的摘要放进提示词，提示词长度与目录大小无关。
+
+def retrieve_context(query: str, limit: int = None) -> str:
+    """返回注入提示词的商品上下文；没有相关商品时返回空串。"""
+    hits = product_index.search(query, limit or AI_CONTEXT_PRODUCTS)
+    if not hits:
+        return ""
+    lines = []
+    for product in product_index.summaries([product_id for product_id, _ in hits]):
+        line = f"- #{product['id']} {product['name']}，¥{product['price']:.2f}"
+        if product["description"]:
+            line += f"，{product['description']}"
+        lines.append(line)
+    return CONTEXT_PROMPT + "\n".join(lines)
+
+
+def _messages(query: str, context: str = "") -> list:
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system", "content": context})
+    messages.append({"role": "user", "content": query})
+    return messages
+
+
+def _http_error(e: Exception) -> HTTPException:
+    # 并发限制器抛出的 429/503 原样返回
+    if isinstance(e, HTTPException):
+        return e
+    # The OpenAI library raises its own specific error types, which is great for error handling
+    if isinstance(e, openai.APIConnectionError):
+        print(f"无法连接到 DeepSeek API: {e.__cause__}")
+        return HTTPException(status_code=503, detail="无法连接到AI服务，请检查网络连接。")
+    if isinstance(e, openai.APIStatusError):
+        print(f"DeepSeek API 返回错误状态码: {e.status_code} - {e.response}")
+        return HTTPException(status_code=e.status_code, detail="AI服务返回错误。")
+    print(f"与AI服务交互时发生未知错误: {e}")
+    return HTTPException(status_code=500, detail="AI服务内部错误。")
+
+
+# --- 上游并发限制 ---
+# 活动上线时同一秒内涌入大量提问，若每个都直接打到模型服务，会被服务商限流，
+# 等待中的请求也会在 worker 里越积越多。这里限制同时进行的上游调用数，并给排队设上限：
+# 排队已满直接返回 429，排队超时返回 503，都带 Retry-After，让前端稍后重试。
+
+class UpstreamLimiter:
+    """最多 max_concurrent 个上游调用同时进行，最多 max_queue 个排队，排队超过 timeout 秒放弃。"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # 信号量绑定在事件循环上，与客户端一样按事件循环懒创建
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self.queue_depth = Gauge()
+        self.in_flight = Gauge()
+        self.rejected = Counter()
+        self.timeouts = Counter()
+        self.wait_seconds = Histogram()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self):
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.queue_depth.value >= self.max_queue:
+            self.rejected.inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="AI助手繁忙，请稍后再试。",
+                headers={"Retry-After": "1"},
+            )
+        self.queue_depth.inc()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI助手繁忙，请稍后再试。",
+                headers={"Retry-After": str(max(1, round(self.timeout)))},
+            )
+        finally:
+            self.queue_depth.dec()
+            self.wait_seconds.observe(time.perf_counter() - started)
+        self.in_flight.inc()
+        try:
+            yield
+        finally:
+            self.in_flight.dec()
+            semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.timeout,
+            "queue_depth": int(self.queue_depth.value),
+            "in_flight": int(self.in_flight.value),
+            "rejected": int(self.rejected.value),
+            "timeouts": int(self.timeouts.value),
+            "wait_seconds": self.wait_seconds.snapshot(),
+        }
+
+
+upstream_limiter = UpstreamLimiter(AI_MAX_CONCURRENCY, AI_MAX_QUEUE, AI_QUEUE_TIMEOUT)
 
-# 2. Create an OpenAI client that is configured to connect to DeepSeek's API
-# This is the core of the change. We are telling the official OpenAI library
-# to send its requests to a different server (base_url).
-if DEEPSEEK_API_KEY:
-    client = openai.OpenAI(
-        api_key=DEEPSEEK_API_KEY,
-        base_url="https://api.deepseek.com/v1"
+
+# --- 相同问题合并（single-flight）---
+# 缓存只能挡住已经回答过的问题；同一个问题在第一份回答返回之前又来了几百次时，
+# 后来的请求不再各自调用上游，而是跟随正在进行的那次调用，拿到同一份回答。
+
+class _Flight:
+    """
+    一次在途的上游调用。回答片段依次追加到 parts，跟随者各自从头读取，因此中途加入的流式请求也能拿到完整回答。
+    上游调用在独立的任务中执行，发起它的请求断开不影响其他跟随者；所有跟随者都离开后才取消上游调用。
+    """
+
+    def __init__(self, key: Optional[str]):
+        self.key = key
+        self.parts = []
+        self.error: Optional[Exception] = None
+        self.done = False
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+        # 拿到上游响应头（或出错）时置位，流式请求据此决定返回 200 还是错误状态码
+        self.started = asyncio.Event()
+        self._changed = asyncio.Condition()
+
+    async def push(self, part: str):
+        async with self._changed:
+            self.parts.append(part)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[Exception] = None):
+        async with self._changed:
+            self.error = error
+            self.done = True
+            self.started.set()
+            self._changed.notify_all()
+
+    async def follow(self):
+        """依次产出回答片段；上游出错时抛出同一个异常。"""
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.parts) or self.done)
+                new_parts = self.parts[index:]
+                finished = self.done
+            index += len(new_parts)
+            for part in new_parts:
+                yield part
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+    def leave(self):
+        self.followers -= 1
+        if self.followers == 0 and not self.done and self.task is not None:
+            # 先摘掉，之后再来的同一问题发起新的调用，不会跟随一个已被取消的调用
+            if _flights.get(self.key) is self:
+                del _flights[self.key]
+            self.task.cancel()
+
+
+# 缓存键 -> 在途调用；只在一个事件循环里读写，不需要加锁
+_flights = {}
+coalesced_requests = Counter()
+
+
+async def _fly(flight: _Flight, messages: list, stream: bool):
+    key = flight.key
+    try:
+        async with upstream_limiter.slot():
+            # 3. await 异步客户端；流式调用在拿到上游响应头后即返回
+            chat_completion = await get_client().chat.completions.create(
+                model=DEEPSEEK_MODEL,  # Specify the DeepSeek model
+                messages=messages,
+                stream=stream,
+            )
+            flight.started.set()
+            if stream:
+                try:
+                    async for chunk in chat_completion:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            await flight.push(chunk.choices[0].delta.content)
+                finally:
+                    await chat_completion.close()
+            else:
+                # 4. Extract the reply just like you would with an OpenAI response
+                await flight.push((chat_completion.choices[0].message.content or "").strip())
+        # 完整收到回答后写入缓存；出错或被取消的不完整回答不缓存
+        reply = "".join(flight.parts).strip()
+        if key and reply:
+            await ai_response_cache.aset(key, reply)
+        await flight.finish()
+    except Exception as e:
+        await flight.finish(e)
+    finally:
+        if key and _flights.get(key) is flight:
+            del _flights[key]
+
+
+def _join_flight(key: Optional[str], question: Question, context: str):
+    """加入同一问题正在进行的上游调用，没有则发起一个；返回 (flight, 是否为跟随者)。"""
+    flight = _flights.get(key) if key else None
+    following = flight is not None
+    if following:
+        coalesced_requests.inc()
+    else:
+        flight = _Flight(key)
+        flight.task = asyncio.create_task(_fly(flight, _messages(question.query, context), question.stream))
+        if key:
+            _flights[key] = flight
+    flight.followers += 1
+    return flight, following
+
+
+def upstream_stats() -> dict:
+    return {**upstream_limiter.stats(), "pending_questions": len(_flights),
+            "coalesced_requests": int(coalesced_requests.value)}
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _relay(flight: _Flight):
+    """
+    把回答片段转成 SSE：每段回答一个 data 事件，结束时发送 done 事件。
+    响应头已经发出后再出错就无法改状态码了，只能发送 error 事件告知前端。
+    客户端断开时生成器被取消，finally 中离开在途调用；没有其他跟随者时关闭上游连接，不再继续消耗模型额度。
+    """
+    try:
+        async for content in flight.follow():
+            yield _sse({"content": content})
+        yield _sse({}, event="done")
+    except Exception as e:
+        yield _sse({"detail": _http_error(e).detail}, event="error")
+    finally:
+        flight.leave()
+
+
+async def _replay(reply: str):
+    """缓存命中的流式请求：整段回答作为一个 data 事件发出。"""
+    yield _sse({"content": reply})
+    yield _sse({}, event="done")
+
+
+def _event_stream(body, cache_status: str) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        # 禁止反向代理（如 nginx）缓冲，否则片段会攒到一起才发给浏览器
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", CACHE_HEADER: cache_status},
     )
-else:
-    client = None  # 保持 None，以便在缺少密钥时返回 500 错误并提示配置问题
+
 
 # Create our core API endpoint
 @router.post("/chat")
-async def chat_with_deepseek(question: Question):
+async def chat_with_deepseek(question: Question, response: Response, db: Session = Depends(get_db)):
     """
     Receives a user's question and uses the OpenAI library to get a reply from the DeepSeek API.
+    stream=true 时返回 text/event-stream：`data: {"content": "..."}` 逐段推送，以 `event: done` 结束。
+    常见问题的回答会被缓存（见 normalize_query），响应头 X-AI-Cache 为 hit 或 miss；
+    与正在回答中的问题相同时共用同一次上游调用，X-AI-Cache 为 coalesced。
+    上游调用数超过 AI_MAX_CONCURRENCY 时排队，队列已满返回 429，排队超时返回 503。
+    提示词中附带与问题最相关的几件商品（见 retrieve_context），模型可以据此回答真实的商品和价格。
     """
-    if not client:
+    if not product_index.built:
+        # 正常由 main.py 启动时构建；只有索引被清空（如批量导入）后第一次提问才会在这里重建
+        await run_in_threadpool(product_index.ensure_built, db)
+    context = retrieve_context(question.query)
+    key = cache_key(question.query, context)
+    cached = await ai_response_cache.aget(key) if key else MISSING
+    if cached is not MISSING:
+        if question.stream:
+            return _event_stream(_replay(cached), "hit")
+        response.headers[CACHE_HEADER] = "hit"
+        return {"reply": cached}
+
+    if not get_client():
         raise HTTPException(status_code=500, detail="DeepSeek API Key 未配置")
 
-    try:
-        # 3. Use the familiar client.chat.completions.create method
-        # The structure of this call is identical to how you would call OpenAI's GPT-4.
-        chat_completion = client.chat.completions.create(
-            model="deepseek-chat",  # Specify the DeepSeek model
-            messages=[
-                {"role": "system", "content": "你是一个名为'京西网'的电商平台的智能导购助手。请友好、简洁地回答用户关于商品的咨询。"},
-                {"role": "user", "content": question.query}
-            ]
-        )
-        
-        # 4. Extract the reply just like you would with an OpenAI response
-        ai_reply = chat_completion.choices[0].message.content
-        
-        return {"reply": ai_reply.strip()}
+    flight, following = _join_flight(key, question, context)
+    cache_status = "coalesced" if following else "miss"
 
-    # The OpenAI library raises its own specific error types, which is great for error handling
-    except openai.APIConnectionError as e:
-        print(f"无法连接到 DeepSeek API: {e.__cause__}")
-        raise HTTPException(status_code=503, detail="无法连接到AI服务，请检查网络连接。")
-    except openai.APIStatusError as e:
-        print(f"DeepSeek API 返回错误状态码: {e.status_code} - {e.response}")
-        raise HTTPException(status_code=e.status_code, detail="AI服务返回错误。")
-    except Exception as e:
-        print(f"与AI服务交互时发生未知错误: {e}")
-        raise HTTPException(status_code=500, detail="AI服务内部错误。")
+    if question.stream:
+        try:
+            await flight.started.wait()
+        except BaseException:
+            flight.leave()
+            raise
+        # 开始推送前出错（排队被拒、连接失败、状态码错误），仍然返回对应的 HTTP 错误
+        if flight.error is not None and not flight.parts:
+            flight.leave()
+            raise _http_error(flight.error)
+        return _event_stream(_relay(flight), cache_status)
 
+    try:
+        ai_reply = "".join([part async for part in flight.follow()]).strip()
+    except Exception as e:
+        raise _http_error(e)
+    finally:
+        flight.leave()
+    response.headers[CACHE_HEADER] = cache_status
+    return {"reply": ai_reply}
@@ -0,0 +1,3 @@
+# api/aio
+# 基于 AsyncSession 的异步路由，与 api/ 下的同步路由路径、参数、响应完全一致。
+# main.py 根据 DB_MODE 选择挂载哪一套；排序、过滤、鉴权、缓存等逻辑与同步版共用。
@@ -0,0 +1,139 @@
+# api/aio/admin.py
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import datetime
+
+import models, schemas
+from database import get_async_db, get_async_engine, pool_status
+from api.aio.users import get_current_user
+from api.admin import (
+    EXPORT_COLUMNS, _get_default_seller, _resolve_import_seller,
+    export_statement, export_response, format_csv, format_ndjson, run_import,
+)
+from search import product_index
+from cache import product_cache, ai_response_cache
+from passwords import password_executor
+from api import ai
+from recommender import item_similarity, personal_recommendations
+import provisioning
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+async def get_current_admin(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="需要管理员权限"
+        )
+    return current_user
+
+@router.post("/products", response_model=schemas.Product, status_code=status.HTTP_201_CREATED)
+async def create_product(
+    product: schemas.ProductCreate,
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    seller = await db.run_sync(_get_default_seller)
+    new_product = models.Product(**product.dict(), seller_id=seller.id)
+
+    db.add(new_product)
+    await db.commit()
+    await db.refresh(new_product)
+    product_index.add(new_product)
+    product_cache.invalidate_product(new_product.id)
+    return new_product
+
+@router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_product(
+    product_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    exists = await db.scalar(select(models.Product.id).filter(models.Product.id == product_id))
+    if exists is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+
+    await db.execute(
+        delete(models.Product).filter(models.Product.id == product_id).execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    product_index.remove(product_id)
+    product_cache.invalidate_product(product_id)
+    return
+
+@router.get("/cache/stats", summary="商品缓存命中统计")
+async def get_cache_stats(admin_user: models.User = Depends(get_current_admin)):
+    return product_cache.stats()
+
+@router.get("/ai/cache/stats", summary="AI 回答缓存命中统计")
+async def get_ai_cache_stats(admin_user: models.User = Depends(get_current_admin)):
+    return ai_response_cache.stats()
+
+@router.get("/ai/upstream/stats", summary="AI 上游调用并发状态")
+async def get_ai_upstream_stats(admin_user: models.User = Depends(get_current_admin)):
+    return ai.upstream_stats()
+
+@router.get("/recommendations/stats", summary="推荐系统状态")
+async def get_recommendation_stats(admin_user: models.User = Depends(get_current_admin)):
+    return {"similarity": item_similarity.stats(), "personal": personal_recommendations.stats()}
+
+@router.post("/users/bulk", response_model=schemas.UserProvisionReport, summary="批量开通用户")
+async def provision_users(
+    batch: schemas.UserProvisionBatch,
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    return await provisioning.provision_users_async(db, [user.model_dump() for user in batch.users])
+
+@router.get("/login/stats", summary="登录线程池状态")
+async def get_login_executor_stats(admin_user: models.User = Depends(get_current_admin)):
+    return password_executor.stats()
+
+@router.get("/db/pool", summary="数据库连接池状态")
+async def get_db_pool_status(admin_user: models.User = Depends(get_current_admin)):
+    return pool_status(get_async_engine().sync_engine)
+
+# --- 商品导出 ---
+
+async def _export_chunks(partitions, format: str):
+    formatter = format_csv if format == "csv" else format_ndjson
+    if format == "csv":
+        yield format_csv([EXPORT_COLUMNS])
+    async for rows in partitions:
+        yield formatter(rows)
+
+@router.get("/products/export", summary="流式导出商品数据")
+async def export_products(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="导出格式: 'ndjson' 或 'csv'"),
+    seller_id: Optional[int] = Query(None, description="只导出某个商家的商品"),
+    updated_since: Optional[datetime] = Query(None, description="只导出该时间之后修改过的商品"),
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    """与同步版相同，使用 AsyncSession.stream 的服务端游标分批读取。"""
+    result = await db.stream(export_statement(seller_id, updated_since))
+    return export_response(_export_chunks(result.partitions(), format), format)
+
+# --- 商品批量导入 ---
+
+@router.post("/products/import", response_model=schemas.ProductImportReport, summary="批量导入商品")
+async def import_products(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="上传格式: 'ndjson' 或 'csv'（首行为表头）"),
+    seller_id: Optional[int] = Query(None, description="导入到哪个商家，默认与单个创建接口相同"),
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: models.User = Depends(get_current_admin)
+):
+    """与同步版相同；每个分块的校验和写入通过 run_sync 在异步会话的连接上执行。"""
+    seller_id = await db.run_sync(_resolve_import_seller, seller_id)
+
+    async def call(fn, chunk):
+        return await db.run_sync(fn, chunk, seller_id)
+
+    return await run_import(request, format, call)
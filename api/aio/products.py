@@ -0,0 +1,202 @@
+# api/aio/products.py
+
+from fastapi import APIRouter, Query, HTTPException, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, insert, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from typing import List, Optional
+
+import models
+import schemas
+from database import get_async_db, get_sync_session_factory
+from api.aio.users import get_current_user
+from api.products import (
+    resolve_sort, sort_key_getter, filter_products,
+    comment_page_statement, comment_count_statement, increment_comment_count, write_comment_page,
+    comment_likes_statement, like_exists_statement, live_likes,
+)
+from likes import like_buffer
+from pagination import page_query, split_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from search import product_index
+from cache import product_cache, MISSING
+from etag import etag_for, not_modified, set_etag
+
+router = APIRouter(
+    prefix="/products",
+    tags=["Products"],
+)
+
+@router.get("/", response_model=List[schemas.Product], summary="查询商品列表")
+async def get_products(
+    request: Request,
+    response: Response,
+    sort_by: Optional[str] = Query(
+        None,
+        description="排序方式: 'price_asc'('price,id')、'price_desc'('-price,-id')、'newest' 或 'popularity'",
+    ),
+    min_price: Optional[float] = Query(None, description="最低价格（含）"),
+    max_price: Optional[float] = Query(None, description="最高价格（含）"),
+    seller_id: Optional[int] = Query(None, description="只看某个商家的商品"),
+    name_prefix: Optional[str] = Query(None, max_length=100, description="商品名称前缀"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """与同步版 api.products.get_products 行为一致：过滤、排序、游标分页、列表缓存和 ETag。"""
+    etag = etag_for("products")
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+    set_etag(response, etag)
+
+    sort_by, keys = resolve_sort(sort_by)
+
+    cache_key = (sort_by, min_price, max_price, seller_id, name_prefix, limit, cursor)
+    cached = product_cache.get_list(cache_key)
+    if cached is not MISSING:
+        products, next_cursor = cached
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return products
+    generation = product_cache.generation
+
+    stmt = filter_products(select(models.Product), min_price, max_price, seller_id, name_prefix)
+    rows = (await db.scalars(page_query(stmt, keys, cursor, limit))).all()
+    products, next_cursor = split_page(rows, limit, sort_key_getter(keys))
+    products = [schemas.Product.model_validate(p).model_dump() for p in products]
+    product_cache.set_list(cache_key, (products, next_cursor), generation)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return products
+
+# 注意：/search 必须声明在 /{product_id} 之前，否则会被当成商品 id 解析
+@router.get("/search", response_model=List[schemas.Product], summary="搜索商品")
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=100, description="搜索关键词，支持中文部分匹配"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="返回数量"),
+    db: AsyncSession = Depends(get_async_db),
+    session_factory: sessionmaker = Depends(get_sync_session_factory)
+):
+    """在商品名称和描述中全文搜索，按 BM25 相关度排序。"""
+    if not product_index.built:
+        # 全量查询 + 切词是 CPU 密集的，放到线程池用同步会话构建；run_sync 仍在事件循环线程上执行
+        await run_in_threadpool(product_index.ensure_built_with, session_factory)
+    hits = product_index.search(q, limit)
+    if not hits:
+        return []
+    ids = [product_id for product_id, _ in hits]
+    result = await db.scalars(select(models.Product).filter(models.Product.id.in_(ids)))
+    products = {p.id: p for p in result.all()}
+    return [products[product_id] for product_id in ids if product_id in products]
+
+@router.get("/{product_id}", response_model=schemas.Product, summary="查询商品详情")
+async def get_product_details(product_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    etag = etag_for("products")
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+    set_etag(response, etag)
+
+    cached = product_cache.get_product(product_id)
+    if cached is not MISSING:
+        return cached
+    generation = product_cache.generation
+
+    product = await db.get(models.Product, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    data = schemas.Product.model_validate(product).model_dump()
+    product_cache.set_product(product_id, data, generation)
+    return data
+
+@router.post("/", response_model=schemas.Product, status_code=201, summary="商家发布商品")
+async def publish_product(product: schemas.ProductCreate, seller_id: int, db: AsyncSession = Depends(get_async_db)):
+    seller = await db.get(models.Seller, seller_id)
+    if not seller:
+        raise HTTPException(status_code=404, detail=f"Seller with id {seller_id} not found")
+
+    new_product = models.Product(**product.dict(), seller_id=seller_id)
+
+    db.add(new_product)
+    await db.commit()
+    await db.refresh(new_product)
+    product_index.add(new_product)
+    product_cache.invalidate_product(new_product.id)
+
+    return new_product
+
+# --- 评论相关API ---
+
+@router.get("/{product_id}/comments", response_model=List[schemas.Comment], summary="获取商品评论")
+async def get_product_comments(
+    product_id: int,
+    request: Request,
+    response: Response,
+    sort_by: str = Query("newest", description="排序方式: 'newest' 或 'likes'"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    etag = etag_for("comments", "comment_likes")
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+    set_etag(response, etag)
+
+    stmt, keys = comment_page_statement(product_id, sort_by, cursor, limit)
+    rows = (await db.execute(stmt)).all()
+    total = await db.scalar(comment_count_statement(product_id))
+    return write_comment_page(response, rows, keys, limit, total)
+
+@router.post("/{product_id}/comments", response_model=schemas.Comment, status_code=201, summary="为商品添加评论")
+async def add_comment_to_product(product_id: int, comment: schemas.CommentCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    product = await db.get(models.Product, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    new_comment = models.Comment(
+        **comment.dict(),
+        product_id=product_id,
+        user_id=current_user.id
+    )
+    db.add(new_comment)
+    await db.execute(increment_comment_count(product_id))
+    await db.commit()
+    await db.refresh(new_comment)
+
+    new_comment.username = current_user.username
+    return new_comment
+
+# --- 评论点赞 ---
+
+@router.post("/{product_id}/comments/{comment_id}/like", status_code=201, summary="点赞评论")
+async def like_comment(product_id: int, comment_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    stored = await db.scalar(comment_likes_statement(product_id, comment_id))
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    if (await db.execute(like_exists_statement(current_user.id, comment_id))).first():
+        raise HTTPException(status_code=400, detail="Comment already liked")
+    try:
+        await db.execute(insert(models.comment_likes).values(user_id=current_user.id, comment_id=comment_id))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Comment already liked")
+    like_buffer.add(comment_id, 1)
+    return live_likes(comment_id, stored)
+
+@router.delete("/{product_id}/comments/{comment_id}/like", summary="取消点赞")
+async def unlike_comment(product_id: int, comment_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    stored = await db.scalar(comment_likes_statement(product_id, comment_id))
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    result = await db.execute(
+        delete(models.comment_likes).filter(
+            models.comment_likes.c.user_id == current_user.id, models.comment_likes.c.comment_id == comment_id
+        )
+    )
+    await db.commit()
+    if result.rowcount:
+        like_buffer.add(comment_id, -1)
+    return live_likes(comment_id, stored)
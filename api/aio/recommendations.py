@@ -0,0 +1,66 @@
+# api/aio/recommendations.py
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from typing import List, Optional
+
+import schemas
+import models
+from database import get_async_db, get_sync_session_factory
+from api.aio.users import get_optional_user
+from favorites import product_exists
+from recommender import (
+    item_similarity, personal_recommendations, SIMILAR_TOP_N, PERSONAL_TOP_N,
+)
+from api.recommendations import order_by_ids
+
+router = APIRouter(
+    prefix="/recommendations",
+    tags=["Recommendations"],
+)
+
+@router.get("/", response_model=List[schemas.Product], summary="获取智能推荐商品")
+async def get_recommendations(
+    limit: int = Query(10, ge=1, le=PERSONAL_TOP_N, description="返回数量"),
+    db: AsyncSession = Depends(get_async_db),
+    session_factory: sessionmaker = Depends(get_sync_session_factory),
+    current_user: Optional[models.User] = Depends(get_optional_user)
+):
+    """与同步版相同：登录用户返回个性化推荐，未登录返回热门商品。"""
+    if current_user is None:
+        result = await db.scalars(
+            select(models.Product)
+            .order_by(models.Product.favorites_count.desc(), models.Product.id.desc())
+            .limit(limit)
+        )
+        return result.all()
+    if not item_similarity.built:
+        await run_in_threadpool(item_similarity.ensure_built_with, session_factory)
+    ids = (await personal_recommendations.get_async(db, current_user.id))[:limit]
+    if not ids:
+        return []
+    products = await db.scalars(select(models.Product).filter(models.Product.id.in_(ids)))
+    return order_by_ids(products.all(), ids)
+
+
+@router.get("/similar/{product_id}", response_model=List[schemas.Product], summary="相似商品（收藏了它的人还收藏了）")
+async def get_similar_products(
+    product_id: int,
+    limit: int = Query(10, ge=1, le=SIMILAR_TOP_N, description="返回数量"),
+    db: AsyncSession = Depends(get_async_db),
+    session_factory: sessionmaker = Depends(get_sync_session_factory)
+):
+    """与同步版相同：从预先算好的相似度表中取一行。"""
+    if not item_similarity.built:
+        # 全量构建 XᵀX 是 CPU 密集计算，放到线程池用同步会话执行；run_sync 仍在事件循环线程上
+        await run_in_threadpool(item_similarity.ensure_built_with, session_factory)
+    ids = [pid for pid, _ in item_similarity.similar(product_id, limit)]
+    if not ids:
+        if not await db.run_sync(product_exists, product_id):
+            raise HTTPException(status_code=404, detail="Product not found")
+        return []
+    products = await db.scalars(select(models.Product).filter(models.Product.id.in_(ids)))
+    return order_by_ids(products.all(), ids)
@@ -0,0 +1,28 @@
+# api/aio/sellers.py
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import schemas
+from database import get_async_db
+
+router = APIRouter(
+    prefix="/sellers",
+    tags=["Sellers"],
+)
+
+@router.post("/", response_model=schemas.Seller, status_code=201, summary="创建商家")
+async def create_seller(seller: schemas.SellerCreate, db: AsyncSession = Depends(get_async_db)):
+    new_seller = models.Seller(**seller.dict())
+    db.add(new_seller)
+    await db.commit()
+    await db.refresh(new_seller)
+    return new_seller
+
+@router.get("/{seller_id}", response_model=schemas.Seller, summary="获取商家信息")
+async def get_seller(seller_id: int, db: AsyncSession = Depends(get_async_db)):
+    seller = await db.get(models.Seller, seller_id)
+    if not seller:
+        raise HTTPException(status_code=404, detail="Seller not found")
+    return seller
@@ -0,0 +1,112 @@
+# api/aio/users.py
+
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+import models
+import schemas
+from database import get_async_db
+import favorites
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from api.users import (
+    oauth2_scheme, optional_oauth2_scheme, decode_access_token, cached_principal, cache_principal, read_credentials,
+    get_password_hash, verify_password, login_response,
+)
+import passwords
+
+router = APIRouter(prefix="/users", tags=["Users"])
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    user_id = decode_access_token(token)
+    principal, generation = cached_principal(user_id)
+    if principal is not None:
+        return principal
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    cache_principal(user, generation)
+    return user
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    if token is None:
+        return None
+    return await get_current_user(token, db)
+
+# --- 路由定义 ---
+
+@router.post("/register", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(models.User).filter(models.User.username == user.username))
+    if db_user:
+        raise HTTPException(status_code=400, detail="Username already registered")
+
+    # bcrypt 是 CPU 密集操作，放到专用线程池里，避免阻塞事件循环
+    hashed_password = await passwords.password_executor.run(get_password_hash, user.password)
+    new_user = models.User(username=user.username, hashed_password=hashed_password.decode('utf-8'))
+
+    db.add(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    return new_user
+
+@router.post("/login")
+async def login(request: Request, db: AsyncSession = Depends(get_async_db)):
+    username, password = await read_credentials(request)
+
+    # 查用户走异步会话，只有 bcrypt 计算放到专用线程池
+    user = await db.scalar(select(models.User).filter(models.User.username == username))
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    hashed_password_bytes = user.hashed_password.encode('utf-8')
+    if not await passwords.password_executor.run(verify_password, password, hashed_password_bytes):
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    if passwords.needs_rehash(user.hashed_password):
+        user.hashed_password = (await passwords.password_executor.run(get_password_hash, password)).decode('utf-8')
+        await db.commit()
+
+    return login_response(user.id, user.role)
+
+# 收藏的读写复用 favorites 模块的集合式实现，通过 run_sync 在异步会话的连接上执行
+
+@router.post("/favorites/batch", response_model=schemas.FavoriteBatchAddResult, summary="批量添加收藏")
+async def add_favorites_batch(batch: schemas.FavoriteBatch, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    return await db.run_sync(favorites.add_favorites, current_user.id, batch.product_ids)
+
+@router.post("/favorites/batch/remove", response_model=schemas.FavoriteBatchRemoveResult, summary="批量删除收藏")
+async def remove_favorites_batch(batch: schemas.FavoriteBatch, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    return await db.run_sync(favorites.remove_favorites, current_user.id, batch.product_ids)
+
+@router.post("/favorites/{product_id}", status_code=status.HTTP_201_CREATED, summary="添加收藏")
+async def add_favorite(product_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    if not await db.run_sync(favorites.product_exists, product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    if not await db.run_sync(favorites.add_favorite, current_user.id, product_id):
+        raise HTTPException(status_code=400, detail="Product already in favorites")
+    return {"status": "success", "message": "Favorite added"}
+
+@router.get("/favorites", response_model=List[schemas.Product], summary="获取用户的收藏列表")
+async def get_favorites(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    products, next_cursor = await db.run_sync(favorites.list_favorites, current_user.id, cursor, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return products
+
+@router.get("/favorites/{product_id}", response_model=schemas.FavoriteStatus, summary="是否已收藏")
+async def get_favorite_status(product_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    return {"product_id": product_id, "favorited": await db.run_sync(favorites.is_favorite, current_user.id, product_id)}
+
+@router.delete("/favorites/{product_id}", status_code=status.HTTP_204_NO_CONTENT, summary="删除收藏")
+async def remove_favorite(product_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    if not await db.run_sync(favorites.remove_favorite, current_user.id, product_id) and not await db.run_sync(favorites.product_exists, product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    return
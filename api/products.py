@@ -1,7 +1,9 @@
 # api/products.py
 
-from fastapi import APIRouter, Query, HTTPException, Depends
+from fastapi import APIRouter, Query, HTTPException, Depends, Request, Response
 from api.users import get_current_user
+from sqlalchemy import select, insert, delete, update, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
@@ -9,42 +11,157 @@ from typing import List, Optional
 import models
 import schemas
 from database import get_db
+from pagination import (
+    paginate, page_query, split_page,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER,
+)
+from search import product_index
+from cache import product_cache, MISSING
+from etag import etag_for, not_modified, set_etag
+from likes import like_buffer
 
 router = APIRouter(
     prefix="/products",
     tags=["Products"],
 )
 
+# 各排序方式对应的排序键，最后一个键必须是唯一的 id，保证排序稳定、游标可续。
+# 每种排序在 models.Product 中都有对应的联合索引（带 seller_id 前缀的版本用于按商家过滤）。
+# id 自增，因此 "newest" 直接按 id 倒序即可，不需要额外的时间列索引。
+SORT_KEYS = {
+    None: [(models.Product.id, False)],
+    "price_asc": [(models.Product.price, False), (models.Product.id, False)],
+    "price_desc": [(models.Product.price, True), (models.Product.id, True)],
+    "newest": [(models.Product.id, True)],
+    "popularity": [(models.Product.favorites_count, True), (models.Product.id, True)],
+}
+
+# 多键写法的别名
+SORT_ALIASES = {
+    "price,id": "price_asc",
+    "-price,-id": "price_desc",
+}
+
+def resolve_sort(sort_by: Optional[str]):
+    """把 sort_by 规范化并返回 (排序名, 排序键)，不支持的排序方式返回 400。"""
+    sort_by = SORT_ALIASES.get(sort_by, sort_by)
+    if sort_by not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort_by: {sort_by}")
+    return sort_by, SORT_KEYS[sort_by]
+
+def sort_key_getter(keys):
+    return lambda p: [getattr(p, column.key) for column, _ in keys]
+
+def filter_products(query, min_price=None, max_price=None, seller_id=None, name_prefix=None):
+    """商品列表的过滤条件；同步的 Query 与异步路由用的 select() 都适用。"""
+    if min_price is not None:
+        query = query.filter(models.Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(models.Product.price <= max_price)
+    if seller_id is not None:
+        query = query.filter(models.Product.seller_id == seller_id)
+    if name_prefix:
+        # autoescape 转义 % 和 _，保证是前缀匹配（可走 name 索引），而不是任意通配
+        query = query.filter(models.Product.name.startswith(name_prefix, autoescape=True))
+    return query
+
 @router.get("/", response_model=List[schemas.Product], summary="查询商品列表")
 def get_products(
-    sort_by: Optional[str] = Query(None, description="按价格排序: 'price_asc' 或 'price_desc'"),
+    request: Request,
+    response: Response,
+    sort_by: Optional[str] = Query(
+        None,
+        description="排序方式: 'price_asc'('price,id')、'price_desc'('-price,-id')、'newest' 或 'popularity'",
+    ),
+    min_price: Optional[float] = Query(None, description="最低价格（含）"),
+    max_price: Optional[float] = Query(None, description="最高价格（含）"),
+    seller_id: Optional[int] = Query(None, description="只看某个商家的商品"),
+    name_prefix: Optional[str] = Query(None, max_length=100, description="商品名称前缀"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
     db: Session = Depends(get_db)  # 注入数据库会话
 ):
     """
-    从数据库获取所有商品列表。
-    - 支持按价格升序或降序排序。
+    从数据库分页获取商品列表。
+    - 支持按价格区间、商家、名称前缀过滤。
+    - 支持按价格升序/降序、最新上架、收藏热度排序，同值时按 id 保证顺序稳定。
+    - 使用游标分页：若还有下一页，响应头 `X-Next-Cursor` 中会给出游标，
+      带上 `cursor` 参数再次请求即可获取下一页。
+    - 支持 ETag：商品表没有写入时，带 If-None-Match 的请求直接返回 304。
     """
+    etag = etag_for("products")
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+    set_etag(response, etag)
+
+    sort_by, keys = resolve_sort(sort_by)
+
+    # 先查列表快照缓存；商品增删会使所有快照失效。
+    # 收藏数变化不会使快照失效，按热度排序的结果最多滞后一个缓存 TTL。
+    cache_key = (sort_by, min_price, max_price, seller_id, name_prefix, limit, cursor)
+    cached = product_cache.get_list(cache_key)
+    if cached is not MISSING:
+        products, next_cursor = cached
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return products
+    generation = product_cache.generation
+
     query = db.query(models.Product) # 创建查询对象
-    
-    if sort_by == 'price_asc':
-        query = query.order_by(models.Product.price.asc())
-    elif sort_by == 'price_desc':
-        query = query.order_by(models.Product.price.desc())
-        
-    products = query.all()
+    query = filter_products(query, min_price, max_price, seller_id, name_prefix)
+    products, next_cursor = paginate(query, keys, cursor, limit, key_of=sort_key_getter(keys))
+    products = [schemas.Product.model_validate(p).model_dump() for p in products]
+    product_cache.set_list(cache_key, (products, next_cursor), generation)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return products
 
+# 注意：/search 必须声明在 /{product_id} 之前，否则会被当成商品 id 解析
+@router.get("/search", response_model=List[schemas.Product], summary="搜索商品")
+def search_products(
+    q: str = Query(..., min_length=1, max_length=100, description="搜索关键词，支持中文部分匹配"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="返回数量"),
+    db: Session = Depends(get_db)
+):
+    """
+    在商品名称和描述中全文搜索，按 BM25 相关度排序。
+    检索走进程内倒排索引，数据库只按主键取回命中的商品。
+    """
+    product_index.ensure_built(db)
+    hits = product_index.search(q, limit)
+    if not hits:
+        return []
+    ids = [product_id for product_id, _ in hits]
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(ids)).all()}
+    # 保持相关度顺序；索引与数据库短暂不一致时跳过已不存在的商品
+    return [products[product_id] for product_id in ids if product_id in products]
+
 @router.get("/{product_id}", response_model=schemas.Product, summary="查询商品详情")
-def get_product_details(product_id: int, db: Session = Depends(get_db)):
+def get_product_details(product_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """
     从数据库获取单个商品的详细信息。
+    支持 ETag：商品表没有写入时，带 If-None-Match 的请求直接返回 304。
     """
+    etag = etag_for("products")
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+    set_etag(response, etag)
+
+    cached = product_cache.get_product(product_id)
+    if cached is not MISSING:
+        return cached
+    generation = product_cache.generation
+
     # 使用数据库查询替代字典查找
     product = db.query(models.Product).filter(models.Product.id == product_id).first()
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    data = schemas.Product.model_validate(product).model_dump()
+    product_cache.set_product(product_id, data, generation)
+    return data
 
 @router.post("/", response_model=schemas.Product, status_code=201, summary="商家发布商品")
 def publish_product(product: schemas.ProductCreate, seller_id: int, db: Session = Depends(get_db)):
@@ -62,28 +179,91 @@ def publish_product(product: schemas.ProductCreate, seller_id: int, db: Session
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
+    product_index.add(new_product)
+    product_cache.invalidate_product(new_product.id)
     
     return new_product
 
 # --- 评论相关API (从sellers.py移动至此更符合RESTful风格) ---
 
-@router.get("/{product_id}/comments", response_model=List[schemas.Comment], summary="获取商品评论")
-def get_product_comments(product_id: int, db: Session = Depends(get_db)):
-    comments = db.query(models.Comment).filter(models.Comment.product_id == product_id).all()
-    
-    # 修复点：将 ORM 对象转换为 Schema 并填充 username
+# 评论排序方式，与商品列表一样最后一个键是唯一的 id；models.Comment 上有对应的联合索引
+COMMENT_SORT_KEYS = {
+    "newest": [(models.Comment.id, True)],
+    "likes": [(models.Comment.likes, True), (models.Comment.id, True)],
+}
+
+def comment_page_statement(product_id: int, sort_by: str, cursor: Optional[str], limit: int):
+    """
+    评论列表的查询：一次外连接带出用户名，只选响应需要的列，不构造 ORM 对象。
+    同步与异步路由共用，返回 (语句, 排序键)。
+    """
+    if sort_by not in COMMENT_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort_by: {sort_by}")
+    keys = COMMENT_SORT_KEYS[sort_by]
+    stmt = (
+        select(
+            models.Comment.id,
+            models.Comment.content,
+            models.Comment.likes,
+            models.Comment.user_id,
+            models.Comment.product_id,
+            func.coalesce(models.User.username, "匿名用户").label("username"),
+        )
+        .outerjoin(models.User, models.Comment.user_id == models.User.id)
+        .filter(models.Comment.product_id == product_id)
+    )
+    return page_query(stmt, keys, cursor, limit), keys
+
+def comment_count_statement(product_id: int):
+    return select(models.Product.comment_count).filter(models.Product.id == product_id)
+
+def increment_comment_count(product_id: int):
+    return (
+        update(models.Product)
+        .filter(models.Product.id == product_id)
+        .values(comment_count=models.Product.comment_count + 1)
+    )
+
+def write_comment_page(response: Response, rows, keys, limit: int, total: Optional[int]):
+    comments, next_cursor = split_page(rows, limit, sort_key_getter(keys))
+    response.headers[TOTAL_COUNT_HEADER] = str(total or 0)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     result = []
-    for c in comments:
-        # Pydantic v2 使用 model_validate, v1 使用 from_orm
-        c_schema = schemas.Comment.from_orm(c) 
-        if c.user:
-            c_schema.username = c.user.username
-        else:
-            c_schema.username = "匿名用户"
-        result.append(c_schema)
-        
+    for row in comments:
+        data = row._asdict()
+        # 叠加尚未写回数据库的点赞增量（按点赞数排序仍以已写回的值为准）
+        data["likes"] += like_buffer.pending(data["id"])
+        result.append(data)
     return result
 
+@router.get("/{product_id}/comments", response_model=List[schemas.Comment], summary="获取商品评论")
+def get_product_comments(
+    product_id: int,
+    request: Request,
+    response: Response,
+    sort_by: str = Query("newest", description="排序方式: 'newest' 或 'likes'"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: Session = Depends(get_db)
+):
+    """
+    分页获取商品评论，支持按最新或点赞数排序。
+    评论总数通过响应头 `X-Total-Count` 返回（读商品上维护的计数，不做 COUNT(*)），
+    下一页游标通过响应头 `X-Next-Cursor` 返回。
+    """
+    # 点赞先进缓冲区、稍后才写回 comments 表，因此 comment_likes 表的版本号也要算进 ETag
+    etag = etag_for("comments", "comment_likes")
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+    set_etag(response, etag)
+
+    stmt, keys = comment_page_statement(product_id, sort_by, cursor, limit)
+    rows = db.execute(stmt).all()
+    total = db.execute(comment_count_statement(product_id)).scalar()
+    return write_comment_page(response, rows, keys, limit, total)
+
 @router.post("/{product_id}/comments", response_model=schemas.Comment, status_code=201, summary="为商品添加评论")
 def add_comment_to_product(product_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     # 检查商品是否存在
@@ -96,6 +276,8 @@ def add_comment_to_product(product_id: int, comment: schemas.CommentCreate, db:
         user_id=current_user.id
     )
     db.add(new_comment)
+    # 评论数在数据库端原子加一，与评论在同一个事务里提交
+    db.execute(increment_comment_count(product_id))
     db.commit()
     db.refresh(new_comment)
     
@@ -105,4 +287,52 @@ def add_comment_to_product(product_id: int, comment: schemas.CommentCreate, db:
     # 这样 Pydantic 在序列化 response_model 时就能读到 username 了。
     new_comment.username = current_user.username
     # --- 修复点结束 ---
-    return new_comment
\ No newline at end of file
+    return new_comment
+
+# --- 评论点赞 ---
+# 点赞关系直接写 comment_likes 表（主键保证不重复），点赞计数的增量交给 likes.like_buffer 合并写回
+
+def comment_likes_statement(product_id: int, comment_id: int):
+    return select(models.Comment.likes).filter(
+        models.Comment.id == comment_id, models.Comment.product_id == product_id
+    )
+
+def like_exists_statement(user_id: int, comment_id: int):
+    return select(models.comment_likes.c.comment_id).filter(
+        models.comment_likes.c.user_id == user_id, models.comment_likes.c.comment_id == comment_id
+    )
+
+def live_likes(comment_id: int, stored: Optional[int]) -> dict:
+    return {"status": "success", "likes": (stored or 0) + like_buffer.pending(comment_id)}
+
+@router.post("/{product_id}/comments/{comment_id}/like", status_code=201, summary="点赞评论")
+def like_comment(product_id: int, comment_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    stored = db.execute(comment_likes_statement(product_id, comment_id)).scalar()
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    if db.execute(like_exists_statement(current_user.id, comment_id)).first():
+        raise HTTPException(status_code=400, detail="Comment already liked")
+    try:
+        db.execute(insert(models.comment_likes).values(user_id=current_user.id, comment_id=comment_id))
+        db.commit()
+    except IntegrityError:
+        # 同一用户的并发重复点赞，由主键约束兜底
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Comment already liked")
+    like_buffer.add(comment_id, 1)
+    return live_likes(comment_id, stored)
+
+@router.delete("/{product_id}/comments/{comment_id}/like", summary="取消点赞")
+def unlike_comment(product_id: int, comment_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    stored = db.execute(comment_likes_statement(product_id, comment_id)).scalar()
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    result = db.execute(
+        delete(models.comment_likes).filter(
+            models.comment_likes.c.user_id == current_user.id, models.comment_likes.c.comment_id == comment_id
+        )
+    )
+    db.commit()
+    if result.rowcount:
+        like_buffer.add(comment_id, -1)
+    return live_likes(comment_id, stored)
@@ -1,12 +1,18 @@
 # api/recommendations.py
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 import schemas
 import models
 from database import get_db
+from api.users import optional_oauth2_scheme, get_current_user
+from favorites import product_exists
+from recommender import (
+    item_similarity, personal_recommendations, SIMILAR_TOP_N, PERSONAL_TOP_N,
+)
 
 router = APIRouter(
     prefix="/recommendations",
@@ -14,13 +20,51 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.Product], summary="获取智能推荐商品")
-def get_recommendations(db: Session = Depends(get_db)):
+def get_recommendations(
+    limit: int = Query(10, ge=1, le=PERSONAL_TOP_N, description="返回数量"),
+    db: Session = Depends(get_db),
+    token: Optional[str] = Depends(optional_oauth2_scheme)
+):
+    """
+    登录用户：根据其收藏和评论过的商品，按相似商品加权打分的个性化推荐，不含已收藏的商品（见 recommender.py）。
+    推荐列表按用户缓存，收藏变化时失效，活跃用户由后台批处理定期重算，请求时通常只需读缓存。
+    未登录：按收藏数返回热门商品。
+    """
+    if token is None:
+        # 匿名请求直接取商品行，一条 SQL 走 ix_products_popularity；
+        # 令牌在函数体内校验而不是另设依赖，匿名请求省去一层依赖解析
+        return db.execute(
+            select(models.Product)
+            .order_by(models.Product.favorites_count.desc(), models.Product.id.desc())
+            .limit(limit)
+        ).scalars().all()
+    current_user = get_current_user(token, db)
+    item_similarity.ensure_built(db)
+    ids = personal_recommendations.get(db, current_user.id)[:limit]
+    if not ids:
+        return []
+    return order_by_ids(db.query(models.Product).filter(models.Product.id.in_(ids)).all(), ids)
+
+
+def order_by_ids(products: List[models.Product], ids: List[int]) -> List[models.Product]:
+    """按 ids 的顺序排列查询结果，已删除的商品跳过。"""
+    by_id = {product.id: product for product in products}
+    return [by_id[i] for i in ids if i in by_id]
+
+@router.get("/similar/{product_id}", response_model=List[schemas.Product], summary="相似商品（收藏了它的人还收藏了）")
+def get_similar_products(
+    product_id: int,
+    limit: int = Query(10, ge=1, le=SIMILAR_TOP_N, description="返回数量"),
+    db: Session = Depends(get_db)
+):
     """
-    模拟大模型推荐功能。
-    在真实场景中，这里会调用一个复杂的推荐服务。
-    
-    此处为模拟实现，从数据库中随机获取或按某种简单逻辑（如最新）返回最多10件商品。
+    按共同收藏计算的余弦相似度降序返回相似商品（见 recommender.py）。
+    相似度表预先算好、按商品 id 直接取一行；收藏变化由后台任务增量合并，通常一秒内生效。
     """
-    # 简单地从数据库中取出前10件商品作为推荐
-    recommended_products = db.query(models.Product).limit(10).all()
-    return recommended_products
+    item_similarity.ensure_built(db)
+    ids = [pid for pid, _ in item_similarity.similar(product_id, limit)]
+    if not ids:
+        if not product_exists(db, product_id):
+            raise HTTPException(status_code=404, detail="Product not found")
+        return []
+    return order_by_ids(db.query(models.Product).filter(models.Product.id.in_(ids)).all(), ids)
@@ -1,12 +1,15 @@
 # api/users.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
 from sqlalchemy.orm import Session
-from typing import List
-import bcrypt
+from typing import List, Optional
 import models
+import passwords
 import schemas
 from database import get_db
+import favorites
+from cache import principal_cache, MISSING
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
 
 # --- JWT 相关导入 ---
 from jose import jwt, JWTError
@@ -22,16 +25,16 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/login")
+# 登录可选的接口（如推荐）使用：未携带令牌时不报 401，依赖返回 None
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/login", auto_error=False)
 
 # --- 辅助函数 ---
 def get_password_hash(password: str) -> bytes:
-    password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password_bytes, salt)
+    # 成本因子由环境变量 BCRYPT_ROUNDS 配置，见 passwords.py
+    return passwords.hash_password(password)
 
 def verify_password(plain_password: str, hashed_password: bytes) -> bool:
-    plain_password_bytes = plain_password.encode('utf-8')
-    return bcrypt.checkpw(plain_password_bytes, hashed_password)
+    return passwords.check_password(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -40,15 +43,42 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_access_token(token: str) -> int:
+    """校验 JWT 并返回其中的用户 id，无效时返回 401。校验结果按原始令牌缓存到令牌过期为止。"""
+    cached = principal_cache.get_token(token)
+    if cached is not MISSING:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = int(payload.get("sub"))
-    except (JWTError, ValueError):
+    except (JWTError, ValueError, TypeError):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    principal_cache.set_token(token, user_id, payload.get("exp"))
+    return user_id
+
+def cached_principal(user_id: int):
+    """
+    从用户缓存取当前用户。返回 (用户对象或 None, 代数)；未命中时调用方查库后用 cache_principal 写回。
+    返回的是不挂在任何会话上的 models.User，只带 id、username、role，路由里只用到这几个字段。
+    """
+    generation = principal_cache.generation
+    data = principal_cache.get_user(user_id)
+    if data is MISSING:
+        return None, generation
+    return models.User(**data), generation
+
+def cache_principal(user: models.User, generation: int):
+    principal_cache.set_user(user.id, {"id": user.id, "username": user.username, "role": user.role}, generation)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user_id = decode_access_token(token)
+    principal, generation = cached_principal(user_id)
+    if principal is not None:
+        return principal
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    cache_principal(user, generation)
     return user
 
 # --- 路由定义 ---
@@ -67,8 +97,8 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db.refresh(new_user)
     return new_user
 
-@router.post("/login")
-async def login(request: Request, db: Session = Depends(get_db)):
+async def read_credentials(request: Request):
+    """登录接口同时接受 JSON 和表单两种提交方式，返回 (用户名, 密码)。"""
     username = None
     password = None
     try:
@@ -90,45 +120,77 @@ async def login(request: Request, db: Session = Depends(get_db)):
 
     if not username or not password:
         raise HTTPException(status_code=400, detail="username and password required")
-
+    return username, password
+
+def authenticate(db: Session, username: str, password: str):
+    """
+    查用户并校验密码，成功时返回 (用户 id, 角色)，失败返回 None。
+    存储的哈希成本与当前配置不一致时，顺便用明文密码按新成本重新哈希（只有登录时才拿得到明文）。
+    整个函数在 password_executor 中执行，不占用事件循环。
+    """
     user = db.query(models.User).filter(models.User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid username or password")
+    if not user or not verify_password(password, user.hashed_password.encode('utf-8')):
+        return None
+    if passwords.needs_rehash(user.hashed_password):
+        user.hashed_password = get_password_hash(password).decode('utf-8')
+        db.commit()
+    return user.id, user.role
 
-    hashed_password_bytes = user.hashed_password.encode('utf-8')
-    if not verify_password(password, hashed_password_bytes):
-        raise HTTPException(status_code=401, detail="Invalid username or password")
+def login_response(user_id: int, role: str) -> dict:
+    access_token = create_access_token({"sub": str(user_id), "role": role})
+    return {"access_token": access_token, "token_type": "bearer", "user_id": user_id, "role": role}
 
-    access_token = create_access_token({"sub": str(user.id), "role": user.role})
-    return {"access_token": access_token, "token_type": "bearer", "user_id": user.id, "role": user.role}
+@router.post("/login")
+async def login(request: Request, db: Session = Depends(get_db)):
+    username, password = await read_credentials(request)
+
+    # 同步的数据库查询和 bcrypt 校验都放到专用线程池，登录高峰时不会卡住其他请求；线程池排满时返回 503
+    result = await passwords.password_executor.run(authenticate, db, username, password)
+    if result is None:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    return login_response(*result)
 
 # --- 修复重点：移除路径中的 {user_id} ---
+# 收藏的读写都交给 favorites 模块，直接操作 user_favorites 关联表，不加载 current_user.favorite_products
+
+# 注意：/favorites/batch 必须声明在 /favorites/{product_id} 之前
+@router.post("/favorites/batch", response_model=schemas.FavoriteBatchAddResult, summary="批量添加收藏")
+def add_favorites_batch(batch: schemas.FavoriteBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    return favorites.add_favorites(db, current_user.id, batch.product_ids)
+
+@router.post("/favorites/batch/remove", response_model=schemas.FavoriteBatchRemoveResult, summary="批量删除收藏")
+def remove_favorites_batch(batch: schemas.FavoriteBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    return favorites.remove_favorites(db, current_user.id, batch.product_ids)
 
 @router.post("/favorites/{product_id}", status_code=status.HTTP_201_CREATED, summary="添加收藏")
 def add_favorite(product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
+    if not favorites.product_exists(db, product_id):
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    if product in current_user.favorite_products:
+    if not favorites.add_favorite(db, current_user.id, product_id):
         raise HTTPException(status_code=400, detail="Product already in favorites")
-    
-    current_user.favorite_products.append(product)
-    db.commit()
     return {"status": "success", "message": "Favorite added"}
 
 @router.get("/favorites", response_model=List[schemas.Product], summary="获取用户的收藏列表")
-def get_favorites(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    # 直接返回当前登录用户的收藏
-    return current_user.favorite_products
+def get_favorites(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """分页返回当前用户收藏的商品（按商品 id 倒序，与收藏时间无关），下一页游标见响应头 X-Next-Cursor。"""
+    products, next_cursor = favorites.list_favorites(db, current_user.id, cursor, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return products
+
+@router.get("/favorites/{product_id}", response_model=schemas.FavoriteStatus, summary="是否已收藏")
+def get_favorite_status(product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    return {"product_id": product_id, "favorited": favorites.is_favorite(db, current_user.id, product_id)}
 
 @router.delete("/favorites/{product_id}", status_code=status.HTTP_204_NO_CONTENT, summary="删除收藏")
 def remove_favorite(product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
+    # 只有确实没删到行时才需要区分 "商品不存在" 和 "本来就没收藏"
+    if not favorites.remove_favorite(db, current_user.id, product_id) and not favorites.product_exists(db, product_id):
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    if product in current_user.favorite_products:
-        current_user.favorite_products.remove(product)
-        db.commit()
     return
@@ -0,0 +1,2 @@
+# benchmarks
+# 接口基准测试，运行方式见 benchmarks/bench.py 开头的说明。
@@ -0,0 +1,466 @@
+# benchmarks/bench.py
+# 接口基准测试：先用 seed.generate 生成指定规模的数据，再在进程内以不同并发度压测各路由，
+# 统计每个场景的 p50/p95/p99 延迟、吞吐量和每个请求的 SQL 条数，写成 JSON；
+# 与保存的基线比较，超出阈值即以非零状态退出，可直接用作 CI 的性能门禁。
+#
+#   python -m benchmarks.bench                                   # 默认规模，与 benchmarks/baseline.json 比较
+#   python -m benchmarks.bench --users 1e5 --products 5e4 --comments 1e6 --concurrency 1,16,64
+#   python -m benchmarks.bench --save-baseline                   # 把本次结果写入基线
+#   DATABASE_URL=mysql+pymysql://... python -m benchmarks.bench --database-url "$DATABASE_URL"
+#
+# 请求经 httpx 的 ASGITransport 直接送进应用，不经过网络和 uvicorn，测到的是 "路由 + 数据库" 的耗时。
+# 基线按 "数据库类型 + 数据规模 + 并发度" 分组保存，只有同一组的结果才会互相比较。
+# 单次计时受机器负载影响很大：每个场景重复测 --repeat 次取中位数；延迟和吞吐量只在低并发（--latency-concurrency）下比较，
+# 且变慢的绝对值要超过 --latency-floor 毫秒才算退化（几毫秒的接口在共享机器上前后两次相差 1~2ms 很常见）；
+# 高并发下协程调度和 GIL 争抢的抖动远大于阈值，只比较与负载无关的每请求 SQL 条数和错误率。
+# 注意：会清空目标数据库中的业务表（--skip-seed 复用已有数据时除外）。
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import sessionmaker
+
+import models
+import seed
+from cache import MemoryLRUBackend, configure_product_cache, product_cache, principal_cache
+from database import create_db_engine, get_db
+from likes import like_buffer
+from search import product_index
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# 默认阈值：p95 延迟变慢或吞吐量下降超过 25% 视为退化
+DEFAULT_THRESHOLD = 0.25
+# 每个请求的 SQL 条数与数据规模无关，允许的增量用绝对值
+DEFAULT_QUERY_THRESHOLD = 0.5
+# 错误率允许的增量
+ERROR_RATE_TOLERANCE = 0.01
+# 每个场景重复计时的次数，取各项指标的中位数
+DEFAULT_REPEAT = 3
+# 不超过该并发度时才比较延迟和吞吐量
+DEFAULT_LATENCY_CONCURRENCY = 1
+# 延迟（以及按 1 / 吞吐量 折算的每请求耗时）至少变慢这么多毫秒才算退化，低于它视为机器抖动
+DEFAULT_LATENCY_FLOOR_MS = 3.0
+
+BENCH_USERS = 20
+
+
+class QueryCounter:
+    """统计引擎上执行的 SQL 条数（每个场景开始前清零）。"""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+
+
+class Scenario:
+    """
+    一个压测场景。build(rng, ctx) 返回一次请求的 (方法, 路径, httpx 关键字参数)；
+    ok 为视为成功的状态码；weight 用来缩减单次很慢的场景（如登录）的请求数。
+    """
+
+    def __init__(self, name: str, build: Callable, ok: Sequence[int] = (200,), weight: float = 1.0):
+        self.name = name
+        self.build = build
+        self.ok = frozenset(ok)
+        self.weight = weight
+
+
+def _auth(token: str) -> dict:
+    return {"headers": {"Authorization": f"Bearer {token}"}}
+
+
+def _product_list(sort_by: Optional[str]):
+    def build(rng, ctx):
+        params = {"limit": 20}
+        if sort_by:
+            params["sort_by"] = sort_by
+        # 一半请求按商家过滤，避免所有请求都命中同一个列表快照
+        if ctx["sellers"] and rng.random() < 0.5:
+            params["seller_id"] = rng.randint(1, ctx["sellers"])
+        return "GET", "/api/products/", {"params": params}
+    return build
+
+
+def _product_detail(rng, ctx):
+    return "GET", f"/api/products/{ctx['products'].sample()}", {}
+
+
+def _comments(sort_by: str):
+    def build(rng, ctx):
+        return "GET", f"/api/products/{ctx['products'].sample()}/comments", {"params": {"sort_by": sort_by, "limit": 20}}
+    return build
+
+
+def _favorites_list(rng, ctx):
+    return "GET", "/api/users/favorites", _auth(rng.choice(ctx["tokens"]))
+
+
+def _favorite_add(rng, ctx):
+    return "POST", f"/api/users/favorites/{ctx['products'].sample()}", _auth(rng.choice(ctx["tokens"]))
+
+
+def _login(rng, ctx):
+    username, password = rng.choice(ctx["credentials"])
+    return "POST", "/api/users/login", {"data": {"username": username, "password": password}}
+
+
+def _recommendations(rng, ctx):
+    return "GET", "/api/recommendations/", {}
+
+
+def _admin_create_product(rng, ctx):
+    body = {"name": f"基准商品 {rng.getrandbits(32)}", "price": round(rng.uniform(1, 1000), 2), "description": "benchmark"}
+    return "POST", "/api/admin/products", {"json": body, **_auth(ctx["admin_token"])}
+
+
+SCENARIOS = [
+    Scenario("products_default", _product_list(None)),
+    Scenario("products_price_asc", _product_list("price_asc")),
+    Scenario("products_price_desc", _product_list("price_desc")),
+    Scenario("products_newest", _product_list("newest")),
+    Scenario("products_popularity", _product_list("popularity")),
+    Scenario("product_detail", _product_detail),
+    Scenario("comments_newest", _comments("newest")),
+    Scenario("comments_likes", _comments("likes")),
+    Scenario("favorites_list", _favorites_list),
+    # 重复收藏返回 400，属于正常结果
+    Scenario("favorites_add", _favorite_add, ok=(201, 400)),
+    # bcrypt 每次校验都要几百毫秒，请求数按比例缩减
+    Scenario("login", _login, weight=0.1),
+    Scenario("recommendations", _recommendations),
+    Scenario("admin_create_product", _admin_create_product, ok=(201,)),
+]
+
+
+def build_app(session_factory) -> FastAPI:
+    """只挂载被压测的路由，get_db 换成压测数据库的会话。"""
+    from api import users, products, sellers, recommendations, admin
+
+    app = FastAPI()
+    for module in (users, products, sellers, recommendations, admin):
+        app.include_router(module.router, prefix="/api")
+
+    def _get_bench_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = _get_bench_db
+    return app
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法求分位数；输入必须已排序。"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float, queries: int) -> dict:
+    latencies = sorted(latencies)
+    requests = len(latencies)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / requests * 1000, 3) if requests else 0.0,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed > 0 else 0.0,
+        "queries_per_request": round(queries / requests, 3) if requests else 0.0,
+    }
+
+
+def median_stats(samples: List[dict]) -> dict:
+    """多次重复的结果合并为一份：各项指标取中位数，错误数和错误率取最大值。"""
+    merged = {key: round(statistics.median(sample[key] for sample in samples), 3) for key in samples[0]}
+    merged["errors"] = max(sample["errors"] for sample in samples)
+    merged["error_rate"] = max(sample["error_rate"] for sample in samples)
+    merged["requests"] = samples[0]["requests"]
+    merged["repeat"] = len(samples)
+    return merged
+
+
+async def _drive(client: httpx.AsyncClient, scenario: Scenario, ctx: dict, requests: int,
+                 concurrency: int, rng: random.Random):
+    """以固定并发度发出 requests 个请求，返回 (每个请求的耗时列表, 失败数, 总耗时)。"""
+    # 请求参数预先生成，随机数不在计时范围内，也不受协程调度顺序影响
+    planned = [scenario.build(rng, ctx) for _ in range(requests)]
+    indexes = itertools.count()
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            if index >= requests:
+                return
+            method, url, kwargs = planned[index]
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                ok = response.status_code in scenario.ok
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def _reset_process_state(session_factory):
+    product_cache.clear()
+    principal_cache.clear()
+    like_buffer.clear()
+    db = session_factory()
+    try:
+        product_index.rebuild(db)
+    finally:
+        db.close()
+
+
+async def _login_tokens(client: httpx.AsyncClient, credentials) -> List[str]:
+    tokens = []
+    for username, password in credentials:
+        response = await client.post("/api/users/login", data={"username": username, "password": password})
+        response.raise_for_status()
+        tokens.append(response.json()["access_token"])
+    return tokens
+
+
+async def run_benchmarks(engine, scenarios: Sequence[Scenario], concurrency_levels: Sequence[int],
+                         requests: int, warmup: int, zipf_s: float = 1.1, seed_value: int = 42,
+                         repeat: int = 1, log: Callable[[str], None] = print) -> Dict[int, Dict[str, dict]]:
+    """对已有数据的库逐个场景、逐个并发度压测，每个场景计时 repeat 次取中位数，返回 {并发度: {场景名: 指标}}。"""
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    counter = QueryCounter(engine)
+    app = build_app(session_factory)
+
+    with engine.connect() as conn:
+        n_users = conn.scalar(select(func.count()).select_from(models.User).where(models.User.username.like("user%")))
+        n_products = conn.scalar(select(func.max(models.Product.id)))
+        n_sellers = conn.scalar(select(func.count()).select_from(models.Seller))
+    rng = random.Random(seed_value)
+    # 压测用户从批量用户中取（密码规则见 seed.py），没有批量用户时用演示账号
+    credentials = [(f"user{i}", f"pass{i % 10}") for i in range(1, min(n_users, BENCH_USERS) + 1)] or [("testuser", "user123")]
+
+    results: Dict[int, Dict[str, dict]] = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        _reset_process_state(session_factory)
+        ctx = {
+            "products": seed.ZipfSampler(n_products, zipf_s, rng),
+            "sellers": n_sellers,
+            "credentials": credentials,
+            "tokens": await _login_tokens(client, credentials),
+            "admin_token": (await _login_tokens(client, [("admin", "admin123")]))[0],
+        }
+        for concurrency in concurrency_levels:
+            results[concurrency] = {}
+            for scenario in scenarios:
+                count = max(concurrency, int(requests * scenario.weight))
+                await _drive(client, scenario, ctx, max(1, int(warmup * scenario.weight)), concurrency, rng)
+                samples = []
+                for _ in range(max(1, repeat)):
+                    like_buffer.flush_with(session_factory)
+                    counter.reset()
+                    latencies, errors, elapsed = await _drive(client, scenario, ctx, count, concurrency, rng)
+                    samples.append(summarize(latencies, errors, elapsed, counter.count))
+                stats = median_stats(samples)
+                results[concurrency][scenario.name] = stats
+                log(f"  c={concurrency:<3} {scenario.name:<22} p50 {stats['p50_ms']:>8.2f}ms  p95 {stats['p95_ms']:>8.2f}ms  "
+                    f"p99 {stats['p99_ms']:>8.2f}ms  {stats['throughput_rps']:>8.1f} req/s  "
+                    f"{stats['queries_per_request']:>5.2f} q/req  errors {stats['errors']}")
+    event.remove(engine, "before_cursor_execute", counter._on_execute)
+    return results
+
+
+# --- 基线与退化判断 ---
+
+def config_key(dialect: str, users: int, products: int, comments: int, favorites_per_user: float, concurrency: int,
+               cache: bool = True) -> str:
+    key = f"{dialect}-u{users}-p{products}-c{comments}-f{favorites_per_user:g}-x{concurrency}"
+    return key if cache else f"{key}-nocache"
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"runs": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, baseline: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict], threshold: float = DEFAULT_THRESHOLD,
+            query_threshold: float = DEFAULT_QUERY_THRESHOLD, latency: bool = True,
+            floor_ms: float = DEFAULT_LATENCY_FLOOR_MS) -> List[str]:
+    """
+    比较同一配置下的两次结果，返回退化描述列表（为空表示通过）。基线中没有的场景不比较。
+    p95 延迟和吞吐量要同时超过相对阈值 threshold 和绝对值 floor_ms 才算退化；
+    latency=False 时不比较这两项，只比较每请求 SQL 条数和错误率。
+    """
+    regressions = []
+    for name, now in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if (latency and base["p95_ms"] > 0 and now["p95_ms"] > base["p95_ms"] * (1 + threshold)
+                and now["p95_ms"] - base["p95_ms"] > floor_ms):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {now['p95_ms']}ms")
+        if (latency and base["throughput_rps"] > 0 and now["throughput_rps"] < base["throughput_rps"] * (1 - threshold)
+                and 1000 / max(now["throughput_rps"], 1e-9) - 1000 / base["throughput_rps"] > floor_ms):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {now['throughput_rps']} req/s")
+        if now["queries_per_request"] > base["queries_per_request"] + query_threshold:
+            regressions.append(f"{name}: queries/request {base['queries_per_request']} -> {now['queries_per_request']}")
+        if now["error_rate"] > base["error_rate"] + ERROR_RATE_TOLERANCE:
+            regressions.append(f"{name}: error rate {base['error_rate']} -> {now['error_rate']}")
+    return regressions
+
+
+def _concurrency_list(value: str) -> List[int]:
+    levels = [int(v) for v in value.split(",") if v.strip()]
+    if not levels or min(levels) < 1:
+        raise argparse.ArgumentTypeError("concurrency must be a comma separated list of positive integers")
+    return levels
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="接口基准测试与性能退化门禁")
+    parser.add_argument("--database-url", default=None, help="压测数据库 URL，默认在临时目录新建 SQLite 文件")
+    parser.add_argument("--skip-seed", action="store_true", help="不生成数据，直接压测库中已有的数据")
+    parser.add_argument("--users", type=seed._count, default=2000, help="批量用户数")
+    parser.add_argument("--products", type=seed._count, default=1000, help="商品数")
+    parser.add_argument("--comments", type=seed._count, default=20000, help="评论数")
+    parser.add_argument("--favorites-per-user", type=float, default=10, help="每个用户平均收藏数")
+    parser.add_argument("--concurrency", type=_concurrency_list, default=[1, 16], help="并发度列表，例如 1,16,64")
+    parser.add_argument("--requests", type=int, default=500, help="每个场景每个并发度的请求数")
+    parser.add_argument("--warmup", type=int, default=50, help="每个场景正式计时前的预热请求数")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每个场景重复计时的次数，指标取中位数")
+    parser.add_argument("--no-cache", action="store_true", help="关闭商品读缓存，测数据库查询路径")
+    parser.add_argument("--scenarios", default=None, help="只跑这些场景（逗号分隔），默认全部")
+    parser.add_argument("--output", default=None, help="把本次结果写入该 JSON 文件")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="用本次结果更新基线，而不是与之比较")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="p95 延迟/吞吐量允许的相对退化")
+    parser.add_argument("--query-threshold", type=float, default=DEFAULT_QUERY_THRESHOLD, help="每请求 SQL 条数允许的增量")
+    parser.add_argument("--latency-concurrency", type=int, default=DEFAULT_LATENCY_CONCURRENCY,
+                        help="只在不超过该并发度时比较延迟和吞吐量，更高并发只比较 SQL 条数和错误率")
+    parser.add_argument("--latency-floor", type=float, default=DEFAULT_LATENCY_FLOOR_MS,
+                        help="延迟至少变慢多少毫秒才算退化，低于它视为机器抖动")
+    args = parser.parse_args(argv)
+
+    scenarios = SCENARIOS
+    if args.scenarios:
+        wanted = {name.strip() for name in args.scenarios.split(",")}
+        unknown = wanted - {s.name for s in SCENARIOS}
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [s for s in SCENARIOS if s.name in wanted]
+
+    workdir = None
+    url = args.database_url
+    if url is None:
+        workdir = tempfile.TemporaryDirectory(prefix="bench-")
+        url = f"sqlite:///{os.path.join(workdir.name, 'bench.db')}"
+
+    if not args.skip_seed:
+        # 生成数据用单独的引擎：seed 对 SQLite 关闭了同步刷盘，不能影响压测时的写入耗时
+        loader_engine = create_db_engine(url)
+        if loader_engine.dialect.name == "sqlite":
+            seed._tune_sqlite(loader_engine)
+        try:
+            seed.generate(loader_engine, users=args.users, products=max(1, args.products), comments=args.comments,
+                          favorites_per_user=args.favorites_per_user)
+        finally:
+            loader_engine.dispose()
+
+    if args.no_cache:
+        # 容量为 0 的后端写入即淘汰，相当于关闭缓存
+        configure_product_cache(MemoryLRUBackend(maxsize=0))
+
+    engine = create_db_engine(url)
+    try:
+        print(f"开始压测：{engine.dialect.name}，并发度 {args.concurrency}，每场景 {args.requests} 个请求")
+        results = asyncio.run(run_benchmarks(engine, scenarios, args.concurrency, args.requests, args.warmup,
+                                             repeat=args.repeat))
+        dialect = engine.dialect.name
+    finally:
+        engine.dispose()
+        if workdir:
+            workdir.cleanup()
+
+    keys = {
+        concurrency: config_key(dialect, args.users, args.products, args.comments, args.favorites_per_user,
+                                concurrency, cache=not args.no_cache)
+        for concurrency in results
+    }
+    runs = {keys[concurrency]: stats for concurrency, stats in results.items()}
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "runs": runs,
+    }
+    if args.output:
+        save_baseline(args.output, report)
+
+    baseline = load_baseline(args.baseline)
+    if args.save_baseline:
+        baseline.setdefault("runs", {}).update(runs)
+        baseline["environment"] = report["environment"]
+        save_baseline(args.baseline, baseline)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+
+    failed = False
+    for concurrency, key in keys.items():
+        stats = runs[key]
+        if key not in baseline.get("runs", {}):
+            print(f"[{key}] 基线中没有该配置，跳过比较（可用 --save-baseline 记录）")
+            continue
+        regressions = compare(stats, baseline["runs"][key], args.threshold, args.query_threshold,
+                              latency=concurrency <= args.latency_concurrency, floor_ms=args.latency_floor)
+        for line in regressions:
+            print(f"[{key}] 退化: {line}")
+        failed = failed or bool(regressions)
+    print("存在性能退化" if failed else "未发现性能退化")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+# cache.py
+# 进程内缓存。CacheBackend 定义了缓存后端需要实现的接口，默认使用带 TTL 的 LRU 内存后端；
+# 多实例部署时可以换成 Redis 等共享后端，只需实现同样的 get/set/delete/clear/stats。
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# get 未命中时的返回值（缓存的值本身可能是 None，因此不能用 None 表示未命中）
+MISSING = object()
+
+
+class CacheBackend:
+    """缓存后端接口。"""
+
+    def get(self, key: Hashable) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: Hashable):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MemoryLRUBackend(CacheBackend):
+    """
+    有容量上限的 LRU 缓存，每个条目带过期时间。
+    超出容量时淘汰最久未访问的条目；过期条目在下次访问时惰性删除。
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    磁盘缓存：单个 sqlite3 文件，进程重启后条目仍在。
+    过期时间按墙钟时间保存（重启后单调时钟不可比），过期条目在访问时惰性删除；
+    超出容量时按最近访问时间淘汰最旧的条目。值以 JSON 保存，只适合可 JSON 序列化的数据。
+    文件在第一次读写时才打开，导入模块不会在磁盘上留下文件。
+    条目数只在打开文件时 COUNT 一次，之后随增删维护，写入时不必全表计数；
+    多个进程共用同一文件时这个计数只是本进程看到的近似值，淘汰后按实际删除行数校正。
+    读写都是同步的磁盘 IO，异步代码中应放到线程池执行（见 AIResponseCache.aget/aset）。
+    """
+
+    def __init__(self, path: str, maxsize: int = 100000, ttl: Optional[float] = None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # 只在持有 self._lock 时访问
+        if self._connection is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed_at ON cache_entries (accessed_at)")
+            self._size = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+            self._connection = conn
+        return self._connection
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return MISSING
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._size -= self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,)).rowcount
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        row = (json.dumps(value, ensure_ascii=False), now + ttl if ttl else None, now, key)
+        with self._lock:
+            # 先按主键 UPDATE，不存在时再 INSERT，由此得知条目数是否增加
+            updated = self._conn.execute(
+                "UPDATE cache_entries SET value = ?, expires_at = ?, accessed_at = ? WHERE key = ?", row
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (value, expires_at, accessed_at, key) VALUES (?, ?, ?, ?)", row
+                )
+                self._size += 1
+            overflow = self._size - self.maxsize
+            if overflow > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM cache_entries WHERE key IN "
+                    "(SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?)", (overflow,)
+                ).rowcount
+                self.evictions += evicted
+                if evicted < overflow:
+                    # 其他进程删过条目，计数偏大，重新校正
+                    self._size = self._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+                else:
+                    self._size -= evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._size -= self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,)).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries")
+            self._size = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __len__(self):
+        with self._lock:
+            self._conn  # 第一次访问时打开文件，顺带统计已有条目数
+            return self._size
+
+    def stats(self):
+        size = len(self)
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class ProductCache:
+    """
+    商品读缓存：单个商品详情按 id 缓存，商品列表按查询参数缓存整页快照。
+    列表快照的 key 中带有代数（generation），商品增删时代数加一，
+    旧快照全部失效而无需逐个删除，之后由 LRU 自然淘汰。
+
+    读数据库之前先取当前代数，写回缓存时代数已变化说明期间发生过写操作，
+    此时放弃写回，避免把旧数据重新放进缓存。
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get_product(self, product_id: int):
+        return self.backend.get(("product", product_id))
+
+    def set_product(self, product_id: int, data: dict, generation: int):
+        if generation == self._generation:
+            self.backend.set(("product", product_id), data)
+
+    def get_list(self, params: tuple):
+        return self.backend.get(("list", self._generation, params))
+
+    def set_list(self, params: tuple, data, generation: int):
+        if generation == self._generation:
+            self.backend.set(("list", generation, params), data)
+
+    def invalidate_lists(self):
+        with self._lock:
+            self._generation += 1
+
+    def invalidate_product(self, product_id: int):
+        """单个商品变化时，它所在的列表快照也一并失效。"""
+        self.invalidate_lists()
+        self.backend.delete(("product", product_id))
+
+    def clear(self):
+        self.invalidate_lists()
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "list_generation": self._generation}
+
+
+# 全局单例。容量和过期时间可通过环境变量调整，需要共享缓存时用 configure_product_cache 替换后端
+product_cache = ProductCache(MemoryLRUBackend(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60")),
+))
+
+
+def configure_product_cache(backend: CacheBackend):
+    product_cache.backend = backend
+
+
+class PrincipalCache:
+    """
+    鉴权缓存，让大多数已登录请求不必为鉴权访问数据库：
+    - 令牌缓存：原始 JWT -> 用户 id，省掉重复的签名校验，条目在令牌过期时同时过期；
+    - 用户缓存：用户 id -> {id, username, role}，TTL 较短，用户被修改或删除时立即失效。
+    与 ProductCache 一样用代数防止失效期间的并发读把旧数据写回。
+    """
+
+    def __init__(self, token_backend: CacheBackend, user_backend: CacheBackend):
+        self.tokens = token_backend
+        self.users = user_backend
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get_token(self, token: str):
+        return self.tokens.get(token)
+
+    def set_token(self, token: str, user_id: int, expires_at: Optional[float]):
+        ttl = self.tokens.ttl if isinstance(self.tokens, MemoryLRUBackend) else None
+        if expires_at is not None:
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                return
+            ttl = min(ttl, remaining) if ttl else remaining
+        self.tokens.set(token, user_id, ttl)
+
+    def get_user(self, user_id: int):
+        return self.users.get(user_id)
+
+    def set_user(self, user_id: int, data: dict, generation: int):
+        if generation == self._generation:
+            self.users.set(user_id, data)
+
+    def invalidate_users(self, *user_ids: int):
+        """不传 id 时（例如执行了批量 UPDATE users）清空整个用户缓存。"""
+        with self._lock:
+            self._generation += 1
+        if user_ids:
+            for user_id in user_ids:
+                self.users.delete(user_id)
+        else:
+            self.users.clear()
+
+    def clear(self):
+        self.invalidate_users()
+        self.tokens.clear()
+
+    def stats(self) -> dict:
+        return {"tokens": self.tokens.stats(), "users": self.users.stats()}
+
+
+principal_cache = PrincipalCache(
+    MemoryLRUBackend(
+        maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+    ),
+    MemoryLRUBackend(
+        maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("USER_CACHE_TTL", "30")),
+    ),
+)
+
+
+# --- 用户被修改或删除时，提交后让用户缓存失效 ---
+# 与 etag.py 相同，在提交之后再失效；ALL_USERS 表示执行了无法确定具体用户的批量 UPDATE/DELETE。
+
+ALL_USERS = "*"
+
+def _changed_users(session: Session) -> set:
+    return session.info.setdefault("principal_dirty_users", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    for obj in (*session.dirty, *session.deleted):
+        if getattr(obj, "__tablename__", None) == "users":
+            _changed_users(session).add(obj.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_user_changes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if getattr(table, "name", None) == "users":
+            _changed_users(orm_execute_state.session).add(ALL_USERS)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    users = session.info.pop("principal_dirty_users", None)
+    if not users:
+        return
+    if ALL_USERS in users:
+        principal_cache.invalidate_users()
+    else:
+        principal_cache.invalidate_users(*users)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_users(session):
+    session.info.pop("principal_dirty_users", None)
+
+
+class AIResponseCache:
+    """
+    AI 助手的回答缓存，两级：内存 LRU 在前，命中只需微秒级；磁盘 SQLite 在后，重启后不必重新付费调用上游。
+    磁盘命中时回填内存。disk 为 None 时只用内存。
+    异步路由中使用 aget/aset：内存层直接在事件循环中读写，磁盘层放到线程池，不阻塞其他请求。
+    """
+
+    def __init__(self, memory: CacheBackend, disk: Optional[CacheBackend] = None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is MISSING and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not MISSING:
+                self.memory.set(key, value)
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    async def aget(self, key: str):
+        value = self.memory.get(key)
+        if value is MISSING and self.disk is not None:
+            value = await run_in_threadpool(self.disk.get, key)
+            if value is not MISSING:
+                self.memory.set(key, value)
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    async def aset(self, key: str, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await run_in_threadpool(self.disk.set, key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+
+def _ai_disk_backend(path: str) -> Optional[CacheBackend]:
+    if not path:
+        return None
+    return SQLiteBackend(
+        path,
+        maxsize=int(os.getenv("AI_CACHE_DISK_SIZE", "100000")),
+        ttl=float(os.getenv("AI_CACHE_TTL", "86400")),
+    )
+
+
+# AI_CACHE_PATH 为空字符串时不落盘
+ai_response_cache = AIResponseCache(
+    MemoryLRUBackend(
+        maxsize=int(os.getenv("AI_CACHE_SIZE", "1000")),
+        ttl=float(os.getenv("AI_CACHE_TTL", "86400")),
+    ),
+    _ai_disk_backend(os.getenv("AI_CACHE_PATH", "ai_cache.sqlite3")),
+)
+
+
+def configure_ai_cache_path(path: Optional[str]):
+    """更换（或用 None 关闭）磁盘缓存文件，测试中指向临时目录。"""
+    old = ai_response_cache.disk
+    ai_response_cache.disk = _ai_disk_backend(path) if path else None
+    if isinstance(old, SQLiteBackend):
+        old.close()
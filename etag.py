@@ -0,0 +1,112 @@
+# etag.py
+# 基于 "表版本号" 的 ETag 条件请求。
+# 每张表维护一个进程内版本号，任何提交了写操作的事务都会让涉及的表版本号加一；
+# ETag 由版本号拼出，而不是对序列化后的响应体做哈希，
+# 因此客户端带着 If-None-Match 回来时，不查数据库、不做 Pydantic 序列化就能判断是否返回 304。
+
+import os
+import secrets
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# 进程启动时随机生成，避免重启后版本号从 0 开始与旧 ETag 碰撞
+_BOOT_ID = secrets.token_hex(4)
+
+# 版本号只在本进程内可见：多进程部署时其他 worker 的写入不会让本进程的版本号变化。
+# ETag 中再拼上一个时间窗口编号，使这种跨进程的过期最多持续一个窗口（与商品缓存 TTL 对齐）。
+ETAG_WINDOW_SECONDS = float(os.getenv("ETAG_WINDOW_SECONDS", os.getenv("PRODUCT_CACHE_TTL", "60")))
+
+
+class TableVersions:
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, table: str) -> int:
+        return self._versions.get(table, 0)
+
+    def bump(self, *tables: str):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+table_versions = TableVersions()
+
+
+# --- 通过 Session 事件自动收集每个事务写过的表，提交后再统一加版本号 ---
+# 必须在提交之后加：若在 flush 时就加，并发的读请求可能拿到新版本号却读到未提交的旧数据，
+# 客户端会以新 ETag 缓存旧内容，之后一直收到 304。
+
+def _pending_tables(session: Session) -> set:
+    return session.info.setdefault("etag_dirty_tables", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    tables = _pending_tables(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            tables.add(table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed_tables(orm_execute_state):
+    # query.delete()/update() 以及 session.execute(insert/update/delete) 不经过 flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        name = getattr(table, "name", None)
+        if name:
+            _pending_tables(orm_execute_state.session).add(name)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_tables(session):
+    tables = session.info.pop("etag_dirty_tables", None)
+    if tables:
+        table_versions.bump(*tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_tables(session):
+    session.info.pop("etag_dirty_tables", None)
+
+
+# --- HTTP 辅助函数 ---
+
+def etag_for(*tables: str) -> str:
+    """
+    由相关表的版本号生成强 ETag。
+    ETag 只需在同一 URL 内区分不同版本，因此不必把查询参数或商品 id 编进去。
+    """
+    window = int(time.time() // ETAG_WINDOW_SECONDS) if ETAG_WINDOW_SECONDS > 0 else 0
+    versions = "-".join(str(table_versions.get(t)) for t in tables)
+    return f'"{_BOOT_ID}.{window}.{versions}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match 使用弱比较：忽略 W/ 前缀。
+    # 不处理 "*"：判断资源是否存在需要查库，按未命中处理即可，结果仍然正确
+
+    candidates = (c.strip() for c in if_none_match.split(","))
+    return any((c[2:] if c.startswith("W/") else c) == etag for c in candidates)
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """If-None-Match 命中时返回 304 响应，否则返回 None。"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # 允许浏览器缓存，但每次使用前都要带 If-None-Match 回源确认
+    response.headers["Cache-Control"] = "no-cache"
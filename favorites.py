@@ -0,0 +1,150 @@
+# favorites.py
+# 收藏的集合式读写：所有操作都直接落在 user_favorites 关联表上，按 (user_id, product_id) 主键定位，
+# 从不加载用户的整个收藏集合，因此单次调用的开销与用户收藏了多少商品无关。
+# 函数都接收同步 Session：同步路由直接调用，异步路由通过 AsyncSession.run_sync 调用。
+# 收藏变化提交后通知 recommender：相似商品表在后台增量更新，该用户的个性化推荐缓存失效。
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update, func
+from sqlalchemy.orm import Session
+
+import models
+from pagination import page_query, split_page
+import recommender
+
+_favorites = models.user_favorites
+
+
+def _insert_ignore(db: Session):
+    """
+    已存在的 (user_id, product_id) 直接跳过而不是报主键冲突，按方言生成对应的语法。
+    其他方言直接报错：普通 INSERT 遇到重复收藏会抛 IntegrityError，并发收藏时变成 500。
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        return insert(_favorites).prefix_with("IGNORE")
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(_favorites).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(_favorites).on_conflict_do_nothing()
+    raise NotImplementedError(f"收藏写入不支持数据库方言 {dialect!r}（支持 mysql、sqlite、postgresql）")
+
+
+def _adjust_counts(db: Session, product_ids: List[int], delta: int, expected: int, affected: int):
+    """
+    维护 products.favorites_count。
+    正常情况下实际写入行数等于预期，直接加减；不相等说明有并发请求改了同一批收藏，
+    这时按关联表重新统计这几个商品的计数，保证计数不漂移。
+    """
+    if not product_ids:
+        return
+    if affected == expected:
+        value = models.Product.favorites_count + delta
+    else:
+        value = (
+            select(func.count())
+            .select_from(_favorites)
+            .where(_favorites.c.product_id == models.Product.id)
+            .scalar_subquery()
+        )
+    db.execute(
+        update(models.Product)
+        .where(models.Product.id.in_(product_ids))
+        .values(favorites_count=value)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def product_exists(db: Session, product_id: int) -> bool:
+    return db.execute(select(models.Product.id).where(models.Product.id == product_id)).first() is not None
+
+
+def is_favorite(db: Session, user_id: int, product_id: int) -> bool:
+    return db.execute(
+        select(_favorites.c.product_id).where(
+            _favorites.c.user_id == user_id, _favorites.c.product_id == product_id
+        )
+    ).first() is not None
+
+
+def add_favorite(db: Session, user_id: int, product_id: int) -> bool:
+    """添加收藏并提交，返回是否新增（已收藏时返回 False）。调用方需先确认商品存在。"""
+    result = db.execute(_insert_ignore(db).values(user_id=user_id, product_id=product_id))
+    added = result.rowcount == 1
+    _adjust_counts(db, [product_id] if added else [], 1, 1, result.rowcount)
+    db.commit()
+    if added:
+        recommender.favorites_changed(user_id, [product_id], 1)
+    return added
+
+
+def remove_favorite(db: Session, user_id: int, product_id: int) -> bool:
+    """按主键删除收藏并提交，返回是否确实删除了一行。"""
+    result = db.execute(
+        delete(_favorites).where(_favorites.c.user_id == user_id, _favorites.c.product_id == product_id)
+    )
+    removed = result.rowcount == 1
+    _adjust_counts(db, [product_id] if removed else [], -1, 1, result.rowcount)
+    db.commit()
+    if removed:
+        recommender.favorites_changed(user_id, [product_id], -1)
+    return removed
+
+
+def list_favorites(db: Session, user_id: int, cursor: Optional[str], limit: int) -> Tuple[list, Optional[str]]:
+    """按商品 id 倒序分页列出收藏的商品，走关联表主键 (user_id, product_id) 的范围扫描。"""
+    keys = [(_favorites.c.product_id, True)]
+    stmt = (
+        select(models.Product)
+        .join(_favorites, _favorites.c.product_id == models.Product.id)
+        .where(_favorites.c.user_id == user_id)
+    )
+    rows = db.execute(page_query(stmt, keys, cursor, limit)).scalars().all()
+    return split_page(rows, limit, key_of=lambda p: [p.id])
+
+
+def _existing(db: Session, user_id: int, product_ids: Iterable[int]) -> set:
+    return set(db.execute(
+        select(_favorites.c.product_id).where(
+            _favorites.c.user_id == user_id, _favorites.c.product_id.in_(product_ids)
+        )
+    ).scalars())
+
+
+def add_favorites(db: Session, user_id: int, product_ids: List[int]) -> Dict[str, List[int]]:
+    """批量添加：一次查出存在的商品和已收藏的商品，一条多行 INSERT 写入其余的。"""
+    requested = list(dict.fromkeys(product_ids))
+    found = set(db.execute(select(models.Product.id).where(models.Product.id.in_(requested))).scalars())
+    already = _existing(db, user_id, found) if found else set()
+    to_add = [pid for pid in requested if pid in found and pid not in already]
+    if to_add:
+        result = db.execute(_insert_ignore(db).values([{"user_id": user_id, "product_id": pid} for pid in to_add]))
+        _adjust_counts(db, to_add, 1, len(to_add), result.rowcount)
+        db.commit()
+        recommender.favorites_changed(user_id, to_add, 1)
+    return {
+        "added": to_add,
+        "already_favorited": [pid for pid in requested if pid in already],
+        "not_found": [pid for pid in requested if pid not in found],
+    }
+
+
+def remove_favorites(db: Session, user_id: int, product_ids: List[int]) -> Dict[str, List[int]]:
+    """批量取消：一次查出哪些确实收藏过，一条 DELETE ... IN 删除。"""
+    requested = list(dict.fromkeys(product_ids))
+    existing = _existing(db, user_id, requested)
+    to_remove = [pid for pid in requested if pid in existing]
+    if to_remove:
+        result = db.execute(
+            delete(_favorites).where(_favorites.c.user_id == user_id, _favorites.c.product_id.in_(to_remove))
+        )
+        _adjust_counts(db, to_remove, -1, len(to_remove), result.rowcount)
+        db.commit()
+        recommender.favorites_changed(user_id, to_remove, -1)
+    return {
+        "removed": to_remove,
+        "not_favorited": [pid for pid in requested if pid not in existing],
+    }
@@ -0,0 +1,97 @@
+# likes.py
+# 评论点赞数的写合并缓冲。
+# 热门商品下的同一条评论可能在短时间内被大量点赞，若每次点赞都执行一次
+# UPDATE comments SET likes = likes + 1，所有请求都会争抢同一行的行锁。
+# 这里点赞接口只把增量记在内存里，后台任务每隔一段时间把累计的增量合并成一批 UPDATE 写回；
+# 读评论列表时再把尚未写回的增量叠加上去，计数看起来仍是实时的。
+# 每个进程各自缓冲、各自写回，写回的是增量而不是绝对值，因此多 worker 部署也不会互相覆盖。
+# 进程崩溃时尚未写回的增量会丢失；点赞关系 comment_likes 是准确的，
+# 停止应用后执行 python seed.py --recompute-counters 按它重算 comments.likes。
+
+import asyncio
+import os
+import threading
+from typing import Callable, Dict
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+import models
+
+# 写回间隔（毫秒）
+LIKE_FLUSH_INTERVAL_MS = int(os.getenv("LIKE_FLUSH_INTERVAL_MS", "500"))
+
+_comments = models.Comment.__table__
+
+
+class LikeBuffer:
+    def __init__(self):
+        self._deltas: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, comment_id: int, delta: int):
+        with self._lock:
+            value = self._deltas.get(comment_id, 0) + delta
+            if value:
+                self._deltas[comment_id] = value
+            else:
+                self._deltas.pop(comment_id, None)
+
+    def pending(self, comment_id: int) -> int:
+        return self._deltas.get(comment_id, 0)
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def clear(self):
+        with self._lock:
+            self._deltas.clear()
+
+    def flush(self, db: Session) -> int:
+        """
+        把累计的增量一次性写回数据库，返回写回的评论条数。
+        先整体换出缓冲区再写库，写库期间的新点赞进入新的缓冲区；写库失败时把增量加回去，下次重试。
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        if not deltas:
+            return 0
+        stmt = (
+            update(_comments)
+            .where(_comments.c.id == bindparam("comment_id"))
+            .values(likes=_comments.c.likes + bindparam("delta"))
+        )
+        try:
+            # executemany：一条语句、一次往返写回整批
+            db.execute(stmt, [{"comment_id": cid, "delta": delta} for cid, delta in deltas.items()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            for comment_id, delta in deltas.items():
+                self.add(comment_id, delta)
+            raise
+        return len(deltas)
+
+    def flush_with(self, session_factory: Callable[[], Session]) -> int:
+        db = session_factory()
+        try:
+            return self.flush(db)
+        finally:
+            db.close()
+
+    async def run(self, session_factory: Callable[[], Session], interval_ms: int = LIKE_FLUSH_INTERVAL_MS):
+        """后台写回循环，由 main.py 在启动时创建任务，关闭时取消后再做最后一次写回。"""
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            if not self._deltas:
+                continue
+            try:
+                await run_in_threadpool(self.flush_with, session_factory)
+            except Exception as exc:
+                # 增量已放回缓冲区，等下一轮重试
+                print(f"点赞计数写回失败: {exc}")
+
+
+# 全局单例
+like_buffer = LikeBuffer()
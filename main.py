@@ -1,7 +1,9 @@
 # main.py (最终修正版)
 
+import asyncio
 import os
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
@@ -9,7 +11,13 @@ from fastapi.responses import FileResponse
 # 导入所有模块
 from api import products, users, sellers, recommendations, ai, admin
 import models
-from database import engine
+from database import engine, SessionLocal, DB_MODE, get_async_engine
+from pagination import NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER
+from search import product_index
+from likes import like_buffer
+from recommender import item_similarity, personal_recommendations
+import monitoring
+import querylog
 
 # 创建数据库表
 models.Base.metadata.create_all(bind=engine)
@@ -28,10 +36,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 分页游标和总数通过响应头返回，跨域时需要显式暴露给前端脚本
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER],
 )
 
+# --- 请求指标中间件 ---
+# 最后添加的中间件在最外层，因此统计的耗时包括 CORS 处理；按路由模板记录，结果见 /metrics
+app.add_middleware(monitoring.MetricsMiddleware)
+monitoring.register_engine(engine)
+# 异步模式下请求走异步引擎的连接池（启动任务和后台批处理仍用同步引擎），两个池分别按 engine 标签导出
+if DB_MODE == "async":
+    monitoring.register_engine(get_async_engine().sync_engine, name="async")
+# 开发模式（DEV_MODE=1）下按请求报告慢查询和疑似 N+1 的重复语句
+if querylog.DEV_MODE:
+    app.add_middleware(querylog.QueryLogMiddleware)
+
 # --- 1. 挂载API路由 ---
 # (所有 /api/... 的请求都会被转发到这里)
+# DB_MODE=async 时挂载 api/aio 下基于 AsyncSession 的同名路由，接口完全一致
+if DB_MODE == "async":
+    from api.aio import products, users, sellers, recommendations, admin
+
 api_router = FastAPI()
 api_router.include_router(users.router)
 api_router.include_router(products.router)
@@ -77,6 +102,12 @@ async def serve_coupon_page():
 @app.get("/admin.html", response_class=FileResponse, tags=["Frontend Pages"])
 async def serve_admin_page():
     return "frontend/admin.html"
+
+# Prometheus 抓取入口，同样必须声明在静态文件挂载之前
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return monitoring.metrics_response()
+
 # --- 3. 挂载静态文件目录 ---
 # (这个必须放在所有精确的HTML页面路由之后)
 app.mount("/", StaticFiles(directory="frontend"), name="static")
@@ -85,9 +116,34 @@ app.mount("/", StaticFiles(directory="frontend"), name="static")
 # --- 4. 启动事件 ---
 # 错误修正：合并了两个重复的 startup 事件
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     # 这里可以放你的种子数据填充逻辑（如果需要的话）
+    # 从数据库构建一次商品搜索索引，之后由商品的增删接口增量维护
+    def build_search_index():
+        db = SessionLocal()
+        try:
+            product_index.rebuild(db)
+        finally:
+            db.close()
+    await run_in_threadpool(build_search_index)
+    print(f"商品搜索索引已构建，共 {len(product_index)} 件商品")
+    # 从收藏关系构建相似商品表，之后后台定时合并收藏变化
+    await run_in_threadpool(item_similarity.rebuild_with, SessionLocal)
+    app.state.similarity_refresher = asyncio.create_task(item_similarity.run())
+    # 后台定期为活跃用户重算个性化推荐
+    app.state.recommendation_batch = asyncio.create_task(personal_recommendations.run(SessionLocal))
+    # 后台定时把点赞计数的增量批量写回数据库
+    app.state.like_flusher = asyncio.create_task(like_buffer.run(SessionLocal))
     print("应用已启动!")
     print("访问 http://127.0.0.1:8000 进入登录页面")
     print("API文档位于 http://127.0.0.1:8000/api/docs")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 停止后台写回任务，并把缓冲区里剩余的点赞增量写回，避免丢失
+    app.state.like_flusher.cancel()
+    app.state.similarity_refresher.cancel()
+    app.state.recommendation_batch.cancel()
+    await run_in_threadpool(like_buffer.flush_with, SessionLocal)
+    # 释放 AI 客户端的连接池
+    await ai.close_client()
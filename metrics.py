@@ -0,0 +1,224 @@
+# metrics.py
+# 轻量的进程内指标：计数器、仪表和直方图，线程安全，不依赖第三方库。
+# 直方图按固定桶累计次数，分位数由桶边界线性插值估算，内存占用与观测次数无关。
+# MetricFamily 按标签值分组同名指标，Registry 把所有指标渲染成 Prometheus 文本格式。
+
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 默认桶边界（秒），覆盖 0.1ms ~ 10s，适合连接等待、请求耗时等延迟类指标
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Counter:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # 最后一个位置对应 +Inf 桶
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+            if value > self._max:
+                self._max = value
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """估算分位数：找到目标所在的桶，在桶的上下边界之间线性插值。"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            observed_max = self._max
+        if total == 0:
+            return None
+        target = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= target:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else observed_max
+                upper = min(upper, observed_max)
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+        return observed_max
+
+    def snapshot(self) -> Dict:
+        """返回累计桶计数（与 Prometheus 的 le 语义一致）及常用分位数。"""
+        with self._lock:
+            counts = list(self._counts)
+            total, total_sum, observed_max = self._count, self._sum, self._max
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else repr(bound)] = cumulative
+        return {
+            "count": total,
+            "sum": round(total_sum, 6),
+            "max": round(observed_max, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+# --- 带标签的指标族与 Prometheus 文本格式 ---
+
+_KINDS = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+
+class MetricFamily:
+    """
+    同名、不同标签值的一组指标。labels(*values) 返回对应的子指标，首次出现时创建。
+    子指标按标签值元组存在字典里，热路径上只有一次字典查找；标签值应取自有限集合（路由模板、状态码），
+    不能用原始路径或用户 id，否则子指标数量会无限增长。
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str] = (),
+                 buckets: Optional[Sequence[float]] = None):
+        if kind not in _KINDS:
+            raise ValueError(f"unknown metric kind: {kind}")
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._buckets = buckets
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        if self.kind == "histogram" and self._buckets is not None:
+            return Histogram(self._buckets)
+        return _KINDS[self.kind]()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(v) for v in values), self._new_child())
+        return child
+
+    def attach(self, values: Sequence[str], metric):
+        """把已有的指标对象（例如连接池自带的等待时间直方图）挂到一组标签值下。"""
+        with self._lock:
+            self._children[tuple(values)] = metric
+
+    def children(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return list(self._children.items())
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs)
+    return f"{{{body}}}" if body else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_family(family: MetricFamily) -> List[str]:
+    lines = [f"# HELP {family.name} {family.help}", f"# TYPE {family.name} {family.kind}"]
+    for values, child in sorted(family.children()):
+        pairs = list(zip(family.labelnames, values))
+        if family.kind != "histogram":
+            lines.append(f"{family.name}{_format_labels(pairs)} {_format_value(child.value)}")
+            continue
+        with child._lock:
+            counts = list(child._counts)
+            total, total_sum = child._count, child._sum
+        cumulative = 0
+        for bound, count in zip((*child.buckets, float("inf")), counts):
+            cumulative += count
+            lines.append(f"{family.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{family.name}_sum{_format_labels(pairs)} {_format_value(total_sum)}")
+        lines.append(f"{family.name}_count{_format_labels(pairs)} {total}")
+    return lines
+
+
+class Registry:
+    """
+    指标注册表。常驻指标用 register 登记；连接池状态这类只在抓取时才读取的值，
+    用 add_collector 登记一个返回 MetricFamily 列表的函数，抓取时现算。
+    """
+
+    def __init__(self):
+        self._families: List[MetricFamily] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def register(self, family: MetricFamily) -> MetricFamily:
+        self._families.append(family)
+        return family
+
+    def add_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in self._families:
+            lines.extend(render_family(family))
+        for collector in self._collectors:
+            for family in collector():
+                lines.extend(render_family(family))
+        return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlalchemy import (Column, Integer, String, Float, TIMESTAMP, ForeignKey, Table)
+from sqlalchemy import (Column, Integer, String, Float, TIMESTAMP, ForeignKey, Table, Index)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -6,7 +6,17 @@ from database import Base
 # 用户-商品 收藏关联表
 user_favorites = Table('user_favorites', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
-    Column('product_id', Integer, ForeignKey('products.id'), primary_key=True)
+    Column('product_id', Integer, ForeignKey('products.id'), primary_key=True),
+    # 主键以 user_id 开头，按商品统计收藏（重算 favorites_count 等）需要这个反向索引
+    Index('ix_user_favorites_product_id', 'product_id', 'user_id'),
+)
+
+# 用户-评论 点赞关联表，保证每个用户对每条评论只能点赞一次
+comment_likes = Table('comment_likes', Base.metadata,
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('comment_id', Integer, ForeignKey('comments.id'), primary_key=True),
+    # 同上：按评论统计点赞（seed.recompute_counters 重算 comments.likes）需要这个反向索引
+    Index('ix_comment_likes_comment_id', 'comment_id', 'user_id'),
 )
 
 class User(Base):
@@ -33,17 +43,42 @@ class Product(Base):
     description = Column(String(500))
     seller_id = Column(Integer, ForeignKey("sellers.id"))
     image_url = Column(String(255))
+    # 收藏数（冗余计数），由收藏/取消收藏接口维护，用于按热度排序
+    favorites_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # 评论数（冗余计数），发表评论时加一，评论列表的总数直接读它而不是 COUNT(*)
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # 最后修改时间，供增量导出（updated_since）使用。不用 onupdate：收藏数、评论数等计数的 UPDATE 不应改它，
+    # 否则每次收藏或评论都会让商品出现在增量导出里，热路径上还要多写一次 updated_at 索引；
+    # 修改商品信息（名称、价格、描述等）的路径需显式设置 updated_at=func.now()
+    updated_at = Column(TIMESTAMP, server_default=func.now(), index=True)
     seller = relationship("Seller", back_populates="products")
     favorited_by_users = relationship("User", secondary=user_favorites, back_populates="favorite_products")
 
+    # 商品列表的每种 "过滤 + 排序" 组合都对应一个联合索引，
+    # 使过滤和 keyset 分页都落在同一次索引范围扫描上，而不是全表排序
+    __table_args__ = (
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_popularity", "favorites_count", "id"),
+        Index("ix_products_seller_id_id", "seller_id", "id"),
+        Index("ix_products_seller_price", "seller_id", "price", "id"),
+        Index("ix_products_seller_popularity", "seller_id", "favorites_count", "id"),
+        Index("ix_products_name", "name"),
+    )
+
 class Comment(Base):
     __tablename__ = "comments"
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String(500), nullable=False)
-    likes = Column(Integer, default=0)
-    
+    likes = Column(Integer, nullable=False, default=0, server_default="0")
+
     user_id = Column(Integer, ForeignKey("users.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
     
     # --- 修复点：添加 user 关系，以便查询评论时能获取用户名 ---
-    user = relationship("User") 
+    user = relationship("User")
+
+    # 评论列表按商品过滤后按最新或点赞数排序，两种排序各有一个联合索引
+    __table_args__ = (
+        Index("ix_comments_product_id_id", "product_id", "id"),
+        Index("ix_comments_product_likes", "product_id", "likes", "id"),
+    )
@@ -0,0 +1,163 @@
+# monitoring.py
+# 请求级监控：纯 ASGI 中间件按路由记录延迟、响应大小、状态码和并发请求数，
+# SQLAlchemy 引擎事件统计每个请求执行的 SQL 条数和耗时，统一在 /metrics 以 Prometheus 文本格式输出。
+#
+# 热路径上每个请求只做几次 perf_counter、字典查找和直方图累加；分位数、文本渲染都只在抓取 /metrics 时进行。
+
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Mount
+
+from metrics import DEFAULT_LATENCY_BUCKETS, MetricFamily, Registry
+
+# 响应大小的桶边界（字节）：100B ~ 10MB
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+# 单个请求 SQL 条数的桶边界，N+1 查询会落在右侧的桶里
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# 没有匹配到任何路由（404）的请求统一记为一个标签值，避免扫描器的随机路径撑爆标签集合
+UNMATCHED_ROUTE = "unmatched"
+
+registry = Registry()
+
+REQUESTS = registry.register(MetricFamily(
+    "http_requests_total", "HTTP 请求数", "counter", ("method", "route", "status")))
+REQUEST_SECONDS = registry.register(MetricFamily(
+    "http_request_duration_seconds", "HTTP 请求处理耗时", "histogram", ("method", "route"), DEFAULT_LATENCY_BUCKETS))
+RESPONSE_BYTES = registry.register(MetricFamily(
+    "http_response_size_bytes", "HTTP 响应体大小", "histogram", ("method", "route"), SIZE_BUCKETS))
+IN_FLIGHT = registry.register(MetricFamily(
+    "http_requests_in_flight", "正在处理的 HTTP 请求数", "gauge")).labels()
+REQUEST_QUERIES = registry.register(MetricFamily(
+    "http_request_db_queries", "每个 HTTP 请求执行的 SQL 条数", "histogram", ("method", "route"), QUERY_COUNT_BUCKETS))
+REQUEST_DB_SECONDS = registry.register(MetricFamily(
+    "http_request_db_duration_seconds", "每个 HTTP 请求在数据库上花费的时间", "histogram", ("method", "route"),
+    DEFAULT_LATENCY_BUCKETS))
+DB_QUERY_SECONDS = registry.register(MetricFamily(
+    "db_query_duration_seconds", "单条 SQL 的执行耗时（包括请求之外的后台任务）", "histogram", (),
+    DEFAULT_LATENCY_BUCKETS)).labels()
+
+
+# --- 每个请求的数据库统计 ---
+# 中间件在请求开始时放入一个 [条数, 秒数] 列表；同步路由在线程池中执行时 contextvars 会被复制，
+# 列表对象本身是共享的，因此线程里执行的 SQL 也会累加到同一个请求上。
+
+_request_db: ContextVar[Optional[List]] = ContextVar("request_db", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = _request_db.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+def route_label(scope) -> str:
+    """
+    取匹配到的路由模板作为标签，例如 /api/products/{product_id}，而不是带具体 id 的原始路径。
+    路由匹配会把路由对象写进 scope（挂载的子应用也是同一个 scope），因此请求处理完后即可读取；
+    root_path 中带有挂载前缀（如 /api），因此 main.py 中以 app.mount 挂载的子应用能拿到完整模板；
+    路由对象的 path 不含 include_router(prefix=...) 传入的前缀，路由应在各自模块中声明 prefix。
+    只匹配到挂载点时（静态文件目录，或子应用里没有匹配的路由）scope 中只有挂载的 endpoint，
+    记为 "挂载前缀/{path}"。
+    """
+    prefix = scope.get("root_path", "")[len(scope.get("app_root_path", "")):]
+    route = scope.get("route")
+    if route is not None and not isinstance(route, Mount):
+        return prefix + getattr(route, "path", "")
+    if route is not None or "endpoint" in scope:
+        return f"{prefix}/{{path}}"
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件（不用 BaseHTTPMiddleware，避免为每个请求多建一层任务和响应流）。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        db_stats = [0, 0.0]
+        token = _request_db.set(db_stats)
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            _request_db.reset(token)
+            method = scope["method"]
+            route = route_label(scope)
+            REQUESTS.labels(method, route, str(status)).inc()
+            REQUEST_SECONDS.labels(method, route).observe(elapsed)
+            RESPONSE_BYTES.labels(method, route).observe(size)
+            REQUEST_QUERIES.labels(method, route).observe(db_stats[0])
+            REQUEST_DB_SECONDS.labels(method, route).observe(db_stats[1])
+
+
+# 名称 -> 引擎；抓取时由 _collect_pools 读取连接池状态，每个引擎是同一组指标中的一个 engine 标签值
+_engines: Dict[str, Engine] = {}
+
+
+def register_engine(engine, name: str = "default"):
+    """抓取时读取连接池状态（容量、借出、溢出、取连接等待时间）。异步引擎传入它的 sync_engine。"""
+    _engines[name] = engine
+
+
+def _collect_pools() -> List[MetricFamily]:
+    # 所有引擎共用一组 MetricFamily：同名指标在输出中只能出现一次 HELP/TYPE
+    from database import pool_status, _TimedPoolMixin
+
+    gauges = {key: MetricFamily(f"db_pool_{key}", f"连接池 {key}", "gauge", ("engine",))
+              for key in ("size", "checkedin", "checkedout", "overflow")}
+    timeouts = MetricFamily("db_pool_timeouts_total", "取连接超时次数", "counter", ("engine",))
+    wait = MetricFamily("db_pool_wait_seconds", "从连接池取连接的等待时间", "histogram", ("engine",))
+    for name, engine in list(_engines.items()):
+        status = pool_status(engine)
+        for key, family in gauges.items():
+            if key in status:
+                family.labels(name).set(status[key])
+        if isinstance(engine.pool, _TimedPoolMixin):
+            timeouts.labels(name).inc(engine.pool.timeouts.value)
+            wait.attach((name,), engine.pool.wait_histogram)
+    return [family for family in (*gauges.values(), timeouts, wait) if family.children()]
+
+
+registry.add_collector(_collect_pools)
+
+
+def metrics_response() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,86 @@
+# pagination.py
+# 基于游标（keyset）的分页工具。
+# 游标对客户端是不透明的字符串，内部保存上一页最后一行的排序键值，
+# 下一页直接用 "排序键 > 游标值" 做范围查询，因此翻到多深的页都只扫描 limit 行。
+
+import base64
+import json
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+# 响应头名称：列表接口的响应体保持为数组，下一页游标通过响应头返回
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# 总条数同样通过响应头返回
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values: Sequence) -> str:
+    """把排序键值编码成 URL 安全的不透明游标。"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List:
+    """解码游标，格式不合法时返回 400，而不是让异常冒泡成 500。"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (
+        not isinstance(values, list)
+        or len(values) != size
+        or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def keyset_filter(keys: Sequence[Tuple[object, bool]], values: Sequence):
+    """
+    根据排序键构造 "位于游标之后" 的过滤条件。
+    keys 为 [(列, 是否降序), ...]，最后一个键必须唯一（通常是主键）。
+    展开为 (a > x) OR (a = x AND b > y) ... 的形式，而不是行值比较，
+    这样 MySQL 也能走联合索引的范围扫描。
+    """
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        value = values[i]
+        step = column < value if descending else column > value
+        prefix = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*prefix, step) if prefix else step)
+    return or_(*clauses)
+
+
+def order_by_clauses(keys: Sequence[Tuple[object, bool]]):
+    return [column.desc() if descending else column.asc() for column, descending in keys]
+
+
+def page_query(query, keys: Sequence[Tuple[object, bool]], cursor: Optional[str], limit: int):
+    """
+    给 query 加上 "位于游标之后"、排序和 limit + 1。
+    ORM Query 与 select() 语句都有 filter/order_by/limit，同步和异步路由共用这一步。
+    多取一行用来判断是否还有下一页，避免额外的 COUNT 查询。
+    """
+    if cursor:
+        query = query.filter(keyset_filter(keys, decode_cursor(cursor, len(keys))))
+    return query.order_by(*order_by_clauses(keys)).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int, key_of):
+    """把多取一行的结果拆成 (本页行, 下一页游标或 None)。key_of(row) 返回该行的排序键值。"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key_of(rows[-1]))
+    return rows, next_cursor
+
+
+def paginate(query, keys: Sequence[Tuple[object, bool]], cursor: Optional[str], limit: int, key_of):
+    """对同步 ORM query 应用 keyset 分页，返回 (本页行, 下一页游标或 None)。"""
+    return split_page(page_query(query, keys, cursor, limit).all(), limit, key_of)
@@ -0,0 +1,106 @@
+# passwords.py
+# 密码哈希与校验。bcrypt 单次计算需要上百毫秒的 CPU，若在事件循环里直接调用，
+# 登录高峰时同一 worker 上的所有请求都会被卡住。这里把它放到专用的有界线程池中执行：
+# - 线程数固定，登录再多也不会挤占 Starlette 默认线程池，其他同步接口照常处理；
+# - 排队数有上限，超过上限直接返回 503，而不是让请求无限堆积直到超时；
+# - 排队深度、执行中数量、排队等待时间都有指标，便于判断是否需要扩容。
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+
+from metrics import Counter, Gauge, Histogram
+
+# bcrypt 成本因子（2 的幂次轮数），bcrypt 默认 12。调整后，用户下次登录时会自动按新成本重新哈希
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS))
+
+
+def check_password(password: str, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed)
+
+
+def hash_rounds(hashed: str) -> int:
+    """从 "$2b$12$..." 形式的哈希中取出成本因子，格式不对时返回 -1。"""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return -1
+
+
+def needs_rehash(hashed: str) -> bool:
+    return hash_rounds(hashed) != BCRYPT_ROUNDS
+
+
+class BoundedExecutor:
+    """固定线程数、有排队上限的线程池，队列满时拒绝新任务（503）。"""
+
+    def __init__(self, max_workers: int, max_queue: int, name: str = "password"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._pending = 0  # 已提交未完成的任务数（排队中 + 执行中）
+        self._lock = threading.Lock()
+        self.queue_depth = Gauge()
+        self.in_flight = Gauge()
+        self.rejected = Counter()
+        self.wait_seconds = Histogram()
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected.inc()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server busy, please retry later",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+        self.queue_depth.inc()
+        submitted = time.perf_counter()
+
+        def task():
+            self.queue_depth.dec()
+            self.wait_seconds.observe(time.perf_counter() - submitted)
+            self.in_flight.inc()
+            try:
+                return fn(*args)
+            finally:
+                self.in_flight.dec()
+
+        def done(fut):
+            # 在任务真正结束时才减计数：等待方被取消时线程里的任务仍在执行，仍然占着名额
+            if fut.cancelled():
+                self.queue_depth.dec()  # 还在排队就被取消，task 没有执行
+            with self._lock:
+                self._pending -= 1
+
+        fut = self._executor.submit(task)
+        fut.add_done_callback(done)
+        return await asyncio.wrap_future(fut)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": int(self.queue_depth.value),
+            "in_flight": int(self.in_flight.value),
+            "rejected": int(self.rejected.value),
+            "wait_seconds": self.wait_seconds.snapshot(),
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+        }
+
+
+# 全局单例：线程数默认取 CPU 核数（最多 4），bcrypt 是纯 CPU 计算且会释放 GIL
+password_executor = BoundedExecutor(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.getenv("PASSWORD_HASH_QUEUE", "100")),
+)
@@ -0,0 +1,199 @@
+# provisioning.py
+# 批量开通用户：供 /api/admin/users/bulk 接口和命令行使用。
+# - 重名检查：整批用户名一次 IN 查询查出已存在的，而不是每个用户名一次 SELECT；
+# - 密码哈希：bcrypt 是 CPU 密集计算，分发到按 CPU 核数创建的进程池并行执行；
+# - 写入：按批次多行 INSERT，每批一个事务。
+#
+# 命令行用法：
+#   python provisioning.py users.csv            # CSV 表头为 username,password[,role]
+#   python provisioning.py users.json           # JSON 数组 [{"username": ..., "password": ..., "role": ...}]
+
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+import passwords
+
+# 每个事务写入的用户数
+PROVISION_BATCH_SIZE = int(os.getenv("PROVISION_BATCH_SIZE", "500"))
+# 哈希进程数，默认等于 CPU 核数
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", str(os.cpu_count() or 1)))
+# 少于这个数量时直接在当前进程里哈希，省掉进程间传输的开销
+PROCESS_POOL_MIN_ITEMS = 8
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    进程池在第一次使用时创建并复用，避免每次请求都重新拉起子进程。
+    子进程用 spawn 启动：服务进程里已有事件循环、线程池和数据库连接，fork 会把这些状态
+    （包括其他线程持有的锁）复制进子进程，可能导致死锁或共用连接。
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PROVISION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _hash_one(item: Tuple[str, int]) -> str:
+    # 在子进程中执行：成本因子显式传入，不依赖子进程里的全局配置
+    password, rounds = item
+    return passwords.hash_password(password, rounds).decode("utf-8")
+
+
+def _chunksize(count: int) -> int:
+    return max(1, count // (PROVISION_WORKERS * 4))
+
+
+def hash_passwords(plain: Sequence[str]) -> List[str]:
+    items = [(password, passwords.BCRYPT_ROUNDS) for password in plain]
+    if len(items) < PROCESS_POOL_MIN_ITEMS:
+        return [_hash_one(item) for item in items]
+    return list(_get_pool().map(_hash_one, items, chunksize=_chunksize(len(items))))
+
+
+async def hash_passwords_async(plain: Sequence[str]) -> List[str]:
+    """异步路由使用：在线程里等待进程池的结果，不阻塞事件循环。"""
+    return await asyncio.get_running_loop().run_in_executor(None, hash_passwords, list(plain))
+
+
+def plan_provision(db: Session, users: Sequence[dict]) -> Tuple[List[dict], Dict[str, List[str]]]:
+    """
+    去掉批内重复，并用一次 IN 查询找出数据库中已存在的用户名。
+    返回 (待创建的用户, {"existing": [...], "duplicated_in_request": [...]})。
+    """
+    unique: Dict[str, dict] = {}
+    duplicated = []
+    for user in users:
+        if user["username"] in unique:
+            duplicated.append(user["username"])
+        else:
+            unique[user["username"]] = user
+    existing = set()
+    if unique:
+        existing = set(db.execute(
+            select(models.User.username).where(models.User.username.in_(list(unique)))
+        ).scalars())
+    to_create = [user for name, user in unique.items() if name not in existing]
+    return to_create, {
+        "existing": [name for name in unique if name in existing],
+        "duplicated_in_request": duplicated,
+    }
+
+
+def insert_users(db: Session, rows: List[dict], batch_size: int = None) -> Tuple[int, List[str]]:
+    """
+    分批写入已哈希好的用户，返回 (成功数, 失败的用户名)。
+    某批因唯一约束冲突失败时（并发创建了同名用户），回滚该批并逐条重试，只跳过冲突的那几个。
+    """
+    batch_size = batch_size or PROVISION_BATCH_SIZE
+    created = 0
+    failed = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        try:
+            db.execute(insert(models.User), batch)
+            db.commit()
+            created += len(batch)
+            continue
+        except IntegrityError:
+            db.rollback()
+        for row in batch:
+            try:
+                db.execute(insert(models.User), [row])
+                db.commit()
+                created += 1
+            except IntegrityError:
+                db.rollback()
+                failed.append(row["username"])
+    return created, failed
+
+
+def _rows(to_create: List[dict], hashes: List[str]) -> List[dict]:
+    return [
+        {"username": user["username"], "hashed_password": hashed, "role": user.get("role") or "customer"}
+        for user, hashed in zip(to_create, hashes)
+    ]
+
+
+def _report(requested: int, created: int, failed: List[str], skipped: dict, started: float) -> dict:
+    return {
+        "requested": requested,
+        "created": created,
+        "failed": failed,
+        **skipped,
+        "elapsed_seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+def provision_users(db: Session, users: Sequence[dict], batch_size: int = None) -> dict:
+    """同步版本的完整流程，返回与 schemas.UserProvisionReport 对应的报告。"""
+    started = time.perf_counter()
+    to_create, skipped = plan_provision(db, users)
+    hashes = hash_passwords([user["password"] for user in to_create])
+    created, failed = insert_users(db, _rows(to_create, hashes), batch_size)
+    return _report(len(users), created, failed, skipped, started)
+
+
+async def provision_users_async(db, users: Sequence[dict], batch_size: int = None) -> dict:
+    """异步版本：查重和写入通过 AsyncSession.run_sync 执行，哈希期间让出事件循环。"""
+    started = time.perf_counter()
+    to_create, skipped = await db.run_sync(plan_provision, users)
+    hashes = await hash_passwords_async([user["password"] for user in to_create])
+    created, failed = await db.run_sync(insert_users, _rows(to_create, hashes), batch_size)
+    return _report(len(users), created, failed, skipped, started)
+
+
+# --- 命令行 ---
+
+def _load_users(path: str) -> List[dict]:
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [
+            {"username": row["username"], "password": row["password"], "role": row.get("role") or "customer"}
+            for row in csv.DictReader(f)
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量开通用户")
+    parser.add_argument("path", help="用户列表文件：CSV（表头 username,password[,role]）或 JSON 数组")
+    parser.add_argument("--batch-size", type=int, default=PROVISION_BATCH_SIZE, help="每个事务写入的用户数")
+    args = parser.parse_args(argv)
+
+    import schemas
+    from database import SessionLocal
+
+    users = [schemas.UserProvision(**user).model_dump() for user in _load_users(args.path)]
+    db = SessionLocal()
+    try:
+        report = provision_users(db, users, args.batch_size)
+    finally:
+        db.close()
+        shutdown_pool()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
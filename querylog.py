@@ -0,0 +1,225 @@
+# querylog.py
+# SQL 记录与 N+1 检测。
+# - QueryRecorder：通过 before/after_cursor_execute 事件记录一段代码执行的全部 SQL（语句、参数、耗时）；
+# - assert_max_queries：测试用的查询预算，可作上下文管理器或装饰器，超出条数或出现 N+1 时断言失败；
+# - QueryLogMiddleware：开发模式（DEV_MODE=1）下按请求收集 SQL，请求结束时报告慢查询和重复语句，并带上路由。
+#
+# "语句形状" 指去掉参数值后的 SQL：同一形状在一次请求里执行多次，通常就是循环里触发了懒加载（N+1）。
+
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from monitoring import route_label
+
+logger = logging.getLogger("querylog")
+
+DEV_MODE = os.getenv("DEV_MODE", "").lower() in ("1", "true", "yes", "on")
+# 开发模式下超过该耗时（毫秒）的 SQL 记为慢查询
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# 同一形状的语句在一次请求/一次预算内执行到该次数即视为 N+1
+REPEATED_QUERY_THRESHOLD = int(os.getenv("REPEATED_QUERY_THRESHOLD", "3"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+# IN (?, ?, ?) 以及批量 VALUES 的占位符个数随参数变化，折叠成一个
+_PLACEHOLDER_LIST_RE = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """把 SQL 规范化成与参数值无关的形状。"""
+    shape = _STRING_RE.sub("?", statement)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _PLACEHOLDER_LIST_RE.sub("(?)", shape)
+    return _WHITESPACE_RE.sub(" ", shape).strip()
+
+
+class QueryRecord:
+    __slots__ = ("statement", "parameters", "duration", "shape")
+
+    def __init__(self, statement: str, parameters, duration: float):
+        self.statement = statement
+        self.parameters = parameters
+        self.duration = duration
+        self.shape = statement_shape(statement)
+
+
+def repeated_shapes(records: List[QueryRecord], threshold: int = REPEATED_QUERY_THRESHOLD) -> List[Tuple[str, int]]:
+    """返回执行次数达到 threshold 的语句形状 [(形状, 次数), ...]，次数多的在前。"""
+    counts = {}
+    for record in records:
+        counts[record.shape] = counts.get(record.shape, 0) + 1
+    return sorted(((shape, n) for shape, n in counts.items() if n >= threshold), key=lambda item: -item[1])
+
+
+def _describe(records: List[QueryRecord]) -> str:
+    return "\n".join(f"  {i}. [{r.duration * 1000:.2f}ms] {r.statement}" for i, r in enumerate(records, 1))
+
+
+class QueryRecorder:
+    """
+    记录在 engine 上执行的 SQL；engine 默认为 Engine 类本身，即所有引擎（包括异步引擎底层的同步引擎）。
+    事件在执行 SQL 的线程里触发，同步路由在线程池中执行，因此用锁保护记录列表。
+    """
+
+    def __init__(self, engine=Engine):
+        self.engine = engine
+        self.records: List[QueryRecord] = []
+        self._lock = threading.Lock()
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("querylog_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["querylog_started"].pop()
+        record = QueryRecord(statement, parameters, time.perf_counter() - started)
+        with self._lock:
+            self.records.append(record)
+
+    def _error(self, exception_context):
+        # 执行失败时没有 after 事件，丢弃对应的开始时间
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("querylog_started"):
+            conn.info["querylog_started"].pop()
+
+    def start(self):
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        event.listen(self.engine, "after_cursor_execute", self._after)
+        event.listen(self.engine, "handle_error", self._error)
+        return self
+
+    def stop(self):
+        event.remove(self.engine, "before_cursor_execute", self._before)
+        event.remove(self.engine, "after_cursor_execute", self._after)
+        event.remove(self.engine, "handle_error", self._error)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def count(self) -> int:
+        return len(self.records)
+
+    def repeated(self, threshold: int = REPEATED_QUERY_THRESHOLD) -> List[Tuple[str, int]]:
+        return repeated_shapes(self.records, threshold)
+
+    def report(self) -> str:
+        return _describe(self.records)
+
+
+class QueryBudget(ContextDecorator):
+    """
+    查询预算：代码块（或被装饰的函数）执行的 SQL 不得超过 max_queries 条，
+    且同一形状的语句不得执行 repeat_threshold 次及以上；allow_repeats=True 时只检查条数。
+    """
+
+    def __init__(self, max_queries: int, engine=Engine, repeat_threshold: int = REPEATED_QUERY_THRESHOLD,
+                 allow_repeats: bool = False):
+        self.max_queries = max_queries
+        self.engine = engine
+        self.repeat_threshold = repeat_threshold
+        self.allow_repeats = allow_repeats
+        self.recorder: Optional[QueryRecorder] = None
+
+    def __enter__(self):
+        self.recorder = QueryRecorder(self.engine).start()
+        return self.recorder
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.stop()
+        if exc_type is not None:
+            return False
+        recorder = self.recorder
+        if recorder.count > self.max_queries:
+            raise AssertionError(
+                f"执行了 {recorder.count} 条 SQL，超出预算 {self.max_queries} 条：\n{recorder.report()}"
+            )
+        repeats = [] if self.allow_repeats else recorder.repeated(self.repeat_threshold)
+        if repeats:
+            shape, n = repeats[0]
+            raise AssertionError(f"同一语句执行了 {n} 次，疑似 N+1：{shape}\n{recorder.report()}")
+        return False
+
+
+def assert_max_queries(max_queries: int, **kwargs) -> QueryBudget:
+    return QueryBudget(max_queries, **kwargs)
+
+
+# --- 开发模式：按请求收集 SQL，报告慢查询和重复语句 ---
+
+_request_queries: ContextVar[Optional[List[QueryRecord]]] = ContextVar("request_queries", default=None)
+_installed = False
+
+
+def _record_request_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("querylog_request_started")
+    if not started:
+        return
+    record = QueryRecord(statement, parameters, time.perf_counter() - started.pop())
+    records = _request_queries.get()
+    if records is not None:
+        records.append(record)
+    elif record.duration * 1000 >= SLOW_QUERY_MS:
+        # 请求之外（如点赞计数的后台写回）的慢查询直接报告
+        logger.warning("慢查询 %.1fms [后台任务] %s", record.duration * 1000, record.statement)
+
+
+def _start_request_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("querylog_request_started", []).append(time.perf_counter())
+
+
+def _discard_failed_query(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("querylog_request_started"):
+        conn.info["querylog_request_started"].pop()
+
+
+def install():
+    """注册全局的引擎事件，只需调用一次；main.py 在开发模式下随中间件一起调用。"""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _start_request_query)
+    event.listen(Engine, "after_cursor_execute", _record_request_query)
+    event.listen(Engine, "handle_error", _discard_failed_query)
+    _installed = True
+
+
+def report_request(method: str, route: str, records: List[QueryRecord]):
+    for record in records:
+        if record.duration * 1000 >= SLOW_QUERY_MS:
+            logger.warning("慢查询 %.1fms [%s %s] %s", record.duration * 1000, method, route, record.statement)
+    for shape, n in repeated_shapes(records):
+        logger.warning("疑似 N+1 [%s %s] 同一语句执行了 %d 次：%s", method, route, n, shape)
+
+
+class QueryLogMiddleware:
+    """开发模式下的纯 ASGI 中间件：请求结束后报告本次请求中的慢查询和重复语句。"""
+
+    def __init__(self, app):
+        self.app = app
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        records: List[QueryRecord] = []
+        token = _request_queries.set(records)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_queries.reset(token)
+            report_request(scope["method"], route_label(scope), records)
@@ -0,0 +1,422 @@
+# recommender.py
+# 基于收藏的物品协同过滤（"收藏了这件商品的人还收藏了"）。
+# 用户-商品收藏关系是一个 0/1 稀疏矩阵 X（行为用户 id，列为商品 id），
+# 商品两两的共同收藏数即 C = Xᵀ·X，余弦相似度 sim(i, j) = C[i, j] / sqrt(n_i · n_j)，n_i 为商品 i 的收藏数。
+# 每个商品只保留相似度最高的 SIMILAR_TOP_N 个邻居，存放在两个按商品 id 下标的定长数组里，读取是 O(1)。
+#
+# 收藏变化时不重算整个 Xᵀ·X：收藏接口提交后把 (用户, 商品, ±1) 记下来，后台任务定期合并成一个稀疏增量加到 X 上，
+# 只重算受影响的行——被收藏/取消收藏的商品（收藏数变了，它与所有共同收藏商品的相似度都变了），
+# 以及与它们有共同收藏的商品（邻居列表中它们的得分变了）。
+#
+# 个性化推荐（PersonalRecommender）在相似商品表之上计算：用户收藏和评论过的商品作为种子，
+# 候选商品的得分为它在各种子邻居列表中相似度的加权和，去掉已收藏的商品，不足的用热门商品补齐。
+# 每个用户的前 PERSONAL_TOP_N 个结果缓存起来，收藏变化时立即失效；后台批处理定期为活跃用户重算，
+# 请求路径上通常只是一次缓存读取，与用户收藏了多少商品无关。
+
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from scipy import sparse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+from cache import MemoryLRUBackend, MISSING
+
+# 每个商品保留的相似商品数
+SIMILAR_TOP_N = int(os.getenv("SIMILAR_TOP_N", "20"))
+# 后台合并收藏变化的间隔（毫秒）
+RECOMMENDER_REFRESH_INTERVAL_MS = int(os.getenv("RECOMMENDER_REFRESH_INTERVAL_MS", "1000"))
+# 一次稀疏矩阵乘法计算的商品行数，控制中间结果的内存
+_ROW_CHUNK = 512
+
+# 每个用户缓存的个性化推荐数
+PERSONAL_TOP_N = int(os.getenv("PERSONAL_TOP_N", "50"))
+# 评论过的商品作为种子时的权重（收藏为 1）
+COMMENT_WEIGHT = float(os.getenv("RECOMMEND_COMMENT_WEIGHT", "0.5"))
+# 最近这么多秒内请求过推荐的用户视为活跃用户，由后台批处理定期重算
+ACTIVE_USER_WINDOW = float(os.getenv("RECOMMEND_ACTIVE_WINDOW", "3600"))
+# 后台批处理的间隔（毫秒）
+RECOMMEND_BATCH_INTERVAL_MS = int(os.getenv("RECOMMEND_BATCH_INTERVAL_MS", "60000"))
+
+_favorites = models.user_favorites
+
+
+class ItemSimilarity:
+    """商品相似度表，线程安全：读取只加锁拷贝一行，重算在锁外进行，最后按行写回。"""
+
+    def __init__(self, top_n: int = SIMILAR_TOP_N):
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程在重算
+        self._refresh_lock = threading.Lock()
+        # 未构建时只有一个线程从数据库全量构建，其他等它完成
+        self._build_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """清空并标记为未构建，下次读取前会从数据库重建。"""
+        with self._lock:
+            self._matrix = sparse.csr_matrix((0, 0), dtype=np.int32)
+            # 第 i 行为商品 i 的邻居 id（不足 top_n 个时以 -1 补齐）和对应的相似度，按相似度降序
+            self._neighbors = np.full((0, self.top_n), -1, dtype=np.int64)
+            self._scores = np.zeros((0, self.top_n), dtype=np.float32)
+            self._pending: List[Tuple[int, int, int]] = []
+            self.refreshed_rows = 0
+            self.built = False
+
+    # --- 读取 ---
+
+    def similar(self, product_id: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """返回 [(商品id, 相似度), ...]，相似度降序、同分时 id 小的在前；没有共同收藏时返回空列表。"""
+        limit = min(limit or self.top_n, self.top_n)
+        with self._lock:
+            if product_id < 0 or product_id >= len(self._neighbors):
+                return []
+            ids = self._neighbors[product_id, :limit].copy()
+            scores = self._scores[product_id, :limit].copy()
+        keep = ids >= 0
+        return [(int(i), float(s)) for i, s in zip(ids[keep], scores[keep])]
+
+    def neighbours_of(self, product_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """一次取出多个商品的邻居行，返回 (邻居id矩阵, 相似度矩阵)，每个商品一行；不在表中的商品跳过。"""
+        with self._lock:
+            rows = product_ids[(product_ids >= 0) & (product_ids < len(self._neighbors))]
+            return self._neighbors[rows], self._scores[rows]
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            matrix = self._matrix
+            return {
+                "users": int(np.count_nonzero(np.diff(matrix.indptr))),
+                "products": int(np.count_nonzero((self._neighbors >= 0).any(axis=1))),
+                "favorites": int(matrix.nnz),
+                "pending_changes": len(self._pending),
+                "refreshed_rows": self.refreshed_rows,
+                "built": self.built,
+            }
+
+    # --- 构建与增量更新 ---
+
+    def record(self, user_id: int, product_ids: List[int], delta: int):
+        """收藏（delta=1）或取消收藏（delta=-1）提交后调用，变化在下次 refresh 时合并。"""
+        if not product_ids:
+            return
+        with self._lock:
+            self._pending.extend((user_id, product_id, delta) for product_id in product_ids)
+
+    def rebuild(self, db: Session):
+        """
+        从 user_favorites 全量构建。开始读库前已提交的变化都包含在读到的数据里，直接丢弃；
+        读库之后记录的变化保留在待合并列表中（可能已被读到，合并是幂等的）。
+        """
+        with self._lock:
+            self._pending = []
+        rows = np.array(db.execute(select(_favorites.c.user_id, _favorites.c.product_id)).all(), dtype=np.int64)
+        users, items = (rows[:, 0], rows[:, 1]) if len(rows) else (np.zeros(0, np.int64), np.zeros(0, np.int64))
+        shape = (int(users.max(initial=-1)) + 1, int(items.max(initial=-1)) + 1)
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (users, items)), shape=shape)
+        matrix.data[:] = 1  # 防御：重复行按一次收藏计
+        with self._refresh_lock:
+            neighbors = np.full((shape[1], self.top_n), -1, dtype=np.int64)
+            scores = np.zeros((shape[1], self.top_n), dtype=np.float32)
+            dirty = np.flatnonzero(matrix.getnnz(axis=0))
+            for item, ids, sims in self._compute_rows(matrix, dirty):
+                neighbors[item, :len(ids)] = ids
+                scores[item, :len(ids)] = sims
+            with self._lock:
+                self._matrix = matrix
+                self._neighbors = neighbors
+                self._scores = scores
+                self.refreshed_rows += len(dirty)
+                self.built = True
+
+    def ensure_built(self, db: Session):
+        if self.built:
+            return
+        with self._build_lock:
+            if not self.built:
+                self.rebuild(db)
+
+    def ensure_built_with(self, session_factory: Callable[[], Session]):
+        """与 ensure_built 相同，但自己创建同步会话：异步路由通过 run_in_threadpool 在线程中调用。"""
+        if self.built:
+            return
+        with self._build_lock:
+            if not self.built:
+                self.rebuild_with(session_factory)
+
+    def refresh(self) -> int:
+        """把待合并的收藏变化加到 X 上，只重算受影响的商品，返回重算的行数。"""
+        with self._refresh_lock:
+            with self._lock:
+                changes, self._pending = self._pending, []
+                old = self._matrix
+            if not changes:
+                return 0
+            try:
+                return self._apply(old, changes)
+            except Exception:
+                # 变化放回待合并列表，下一轮重试
+                with self._lock:
+                    self._pending = changes + self._pending
+                raise
+
+    def _apply(self, old: sparse.csr_matrix, changes: List[Tuple[int, int, int]]) -> int:
+        users, items, deltas = (np.array(column, dtype=np.int64) for column in zip(*changes))
+        shape = (max(old.shape[0], int(users.max()) + 1), max(old.shape[1], int(items.max()) + 1))
+        old = old.copy()
+        old.resize(shape)
+        delta = sparse.csr_matrix((deltas, (users, items)), shape=shape)
+        matrix = (old + delta).tocsr()
+        # 重复的收藏、取消一个本来没有的收藏（rebuild 已包含的变化再合并一次）都截断回 0/1
+        np.clip(matrix.data, 0, 1, out=matrix.data)
+        matrix.eliminate_zeros()
+
+        changed_items = np.unique(items)
+        changed_users = np.unique(users)
+        # 受影响的行：变化的商品、与它们现在有共同收藏的商品、以及变化前与它们有共同收藏的商品
+        # （后者一定在这些用户变化前的收藏里：共同收藏只可能因为这些用户而消失）
+        co_now = (matrix[:, changed_items].T @ matrix).tocsr().indices
+        co_before = old[changed_users].indices
+        dirty = np.union1d(changed_items, np.union1d(co_now, co_before))
+        rows = list(self._compute_rows(matrix, dirty))
+
+        with self._lock:
+            if len(self._neighbors) < shape[1]:
+                grow = shape[1] - len(self._neighbors)
+                self._neighbors = np.vstack([self._neighbors, np.full((grow, self.top_n), -1, dtype=np.int64)])
+                self._scores = np.vstack([self._scores, np.zeros((grow, self.top_n), dtype=np.float32)])
+            self._neighbors[dirty] = -1
+            self._scores[dirty] = 0
+            for item, ids, sims in rows:
+                self._neighbors[item, :len(ids)] = ids
+                self._scores[item, :len(ids)] = sims
+            self._matrix = matrix
+            self.refreshed_rows += len(dirty)
+        return len(dirty)
+
+    def _compute_rows(self, matrix: sparse.csr_matrix, items: np.ndarray):
+        """分块计算 items 各行的余弦相似度并取前 top_n，产出 (商品id, 邻居id数组, 相似度数组)。"""
+        counts = np.asarray(matrix.sum(axis=0)).ravel().astype(np.float64)
+        by_item = matrix.tocsc()
+        for start in range(0, len(items), _ROW_CHUNK):
+            chunk = items[start:start + _ROW_CHUNK]
+            # 共同收藏数：chunk 中每个商品一行，只涉及收藏过这些商品的用户
+            co = (by_item[:, chunk].T @ matrix).tocsr()
+            for k, item in enumerate(chunk):
+                cols = co.indices[co.indptr[k]:co.indptr[k + 1]]
+                shared = co.data[co.indptr[k]:co.indptr[k + 1]]
+                keep = cols != item
+                cols, shared = cols[keep], shared[keep]
+                if not len(cols):
+                    continue
+                sims = shared / np.sqrt(counts[item] * counts[cols])
+                if len(cols) > self.top_n:
+                    # 先线性时间找出第 top_n 大的得分，只对不低于它的候选排序；与它同分的全部保留，排序后按 id 取舍
+                    kth = np.partition(sims, len(sims) - self.top_n)[len(sims) - self.top_n]
+                    keep = sims >= kth
+                    cols, sims = cols[keep], sims[keep]
+                order = np.lexsort((cols, -sims))[:self.top_n]
+                yield int(item), cols[order], sims[order]
+
+    async def run(self, interval_ms: int = RECOMMENDER_REFRESH_INTERVAL_MS):
+        """后台合并循环，由 main.py 在启动时创建任务。"""
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            if not self._pending:
+                continue
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception as exc:
+                print(f"相似商品增量更新失败: {exc}")
+
+    def rebuild_with(self, session_factory: Callable[[], Session]):
+        db = session_factory()
+        try:
+            self.rebuild(db)
+        finally:
+            db.close()
+
+
+# 全局单例，由 main.py 在启动时构建
+item_similarity = ItemSimilarity()
+
+
+def score_candidates(similarity: ItemSimilarity, favorite_ids: List[int], commented_ids: List[int],
+                     limit: int) -> List[int]:
+    """
+    种子商品（收藏权重 1、评论权重 COMMENT_WEIGHT）的邻居按相似度加权求和，返回得分最高的 limit 个商品，
+    不含已收藏的。只涉及 种子数 × SIMILAR_TOP_N 个元素的数组运算，收藏上千件商品也只需几毫秒。
+    """
+    favorites_arr = np.asarray(favorite_ids, dtype=np.int64)
+    commented_arr = np.asarray(commented_ids, dtype=np.int64)
+    fav_ids, fav_scores = similarity.neighbours_of(favorites_arr)
+    com_ids, com_scores = similarity.neighbours_of(commented_arr)
+    ids = np.concatenate([fav_ids.ravel(), com_ids.ravel()])
+    scores = np.concatenate([fav_scores.ravel(), com_scores.ravel() * COMMENT_WEIGHT])
+    keep = (ids >= 0) & ~np.isin(ids, favorites_arr)
+    if not keep.any():
+        return []
+    candidates, inverse = np.unique(ids[keep], return_inverse=True)
+    totals = np.bincount(inverse, weights=scores[keep])
+    order = np.lexsort((candidates, -totals))[:limit]
+    return candidates[order].tolist()
+
+
+def _favorite_ids_statement(user_id: int):
+    return select(_favorites.c.product_id).where(_favorites.c.user_id == user_id)
+
+
+def _commented_ids_statement(user_id: int):
+    return select(models.Comment.product_id).where(models.Comment.user_id == user_id).distinct()
+
+
+def popular_products_statement(limit: int, exclude_user_id: Optional[int] = None):
+    """热门商品（收藏数降序），走 ix_products_popularity；给定用户时排除其已收藏的商品。"""
+    stmt = select(models.Product.id).order_by(models.Product.favorites_count.desc(), models.Product.id.desc())
+    if exclude_user_id is not None:
+        stmt = stmt.where(models.Product.id.not_in(_favorite_ids_statement(exclude_user_id)))
+    return stmt.limit(limit)
+
+
+class PersonalRecommender:
+    """每个用户的前 top_n 个推荐商品 id，带 TTL 的 LRU 缓存 + 收藏变化时失效 + 活跃用户的后台批量重算。"""
+
+    def __init__(self, similarity: ItemSimilarity, top_n: int = PERSONAL_TOP_N,
+                 maxsize: int = 100000, ttl: Optional[float] = 3600.0):
+        self.similarity = similarity
+        self.top_n = top_n
+        self.cache = MemoryLRUBackend(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # 用户 id -> 最近一次请求推荐的时间
+        self._active: Dict[int, float] = {}
+        # 用户 id -> 失效次数；计算前后不一致说明期间收藏又变了，结果不写缓存
+        self._versions: Dict[int, int] = {}
+        self.recomputed = 0
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            self._active.clear()
+            self._versions.clear()
+            self.recomputed = 0
+
+    def get(self, db: Session, user_id: int) -> List[int]:
+        """返回用户的推荐商品 id 列表；缓存未命中时当场计算并写入缓存。"""
+        cached = self.cached(user_id)
+        if cached is not MISSING:
+            return cached
+        return self.compute(db, user_id)
+
+    async def get_async(self, db: AsyncSession, user_id: int) -> List[int]:
+        """get 的异步版，供异步路由使用。"""
+        cached = self.cached(user_id)
+        if cached is not MISSING:
+            return cached
+        return await self.compute_async(db, user_id)
+
+    def cached(self, user_id: int):
+        """记下用户最近一次请求推荐的时间，返回缓存的结果；未命中返回 MISSING。"""
+        with self._lock:
+            self._active[user_id] = time.monotonic()
+        return self.cache.get(user_id)
+
+    def compute(self, db: Session, user_id: int) -> List[int]:
+        version = self._versions.get(user_id, 0)
+        favorite_ids = db.execute(_favorite_ids_statement(user_id)).scalars().all()
+        commented_ids = db.execute(_commented_ids_statement(user_id)).scalars().all()
+        ids = score_candidates(self.similarity, favorite_ids, commented_ids, self.top_n)
+        if len(ids) < self.top_n:
+            popular = db.execute(popular_products_statement(self.top_n, user_id)).scalars().all()
+            ids = self._fill(ids, popular)
+        return self._store(user_id, version, ids)
+
+    async def compute_async(self, db: AsyncSession, user_id: int) -> List[int]:
+        """与 compute 相同，查询走异步会话，numpy 打分放到线程池，不占用事件循环线程。"""
+        version = self._versions.get(user_id, 0)
+        favorite_ids = (await db.scalars(_favorite_ids_statement(user_id))).all()
+        commented_ids = (await db.scalars(_commented_ids_statement(user_id))).all()
+        ids = await run_in_threadpool(score_candidates, self.similarity, favorite_ids, commented_ids, self.top_n)
+        if len(ids) < self.top_n:
+            popular = (await db.scalars(popular_products_statement(self.top_n, user_id))).all()
+            ids = self._fill(ids, popular)
+        return self._store(user_id, version, ids)
+
+    def _fill(self, ids: List[int], popular: List[int]) -> List[int]:
+        # 新用户或收藏的商品还没有共同收藏：用热门商品补齐
+        seen = set(ids)
+        return ids + [pid for pid in popular if pid not in seen][:self.top_n - len(ids)]
+
+    def _store(self, user_id: int, version: int, ids: List[int]) -> List[int]:
+        with self._lock:
+            if self._versions.get(user_id, 0) == version:
+                self.cache.set(user_id, ids)
+            self.recomputed += 1
+        return ids
+
+    def invalidate(self, user_id: int):
+        """用户的收藏变化提交后调用：丢弃缓存的列表，下一轮批处理（或下一次请求）重算。"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self.cache.delete(user_id)
+
+    def active_users(self) -> List[int]:
+        """最近 ACTIVE_USER_WINDOW 秒内请求过推荐的用户，顺带清理不再活跃的。"""
+        cutoff = time.monotonic() - ACTIVE_USER_WINDOW
+        with self._lock:
+            for user_id in [u for u, seen in self._active.items() if seen < cutoff]:
+                del self._active[user_id]
+                self._versions.pop(user_id, None)
+            return list(self._active)
+
+    def refresh_active(self, db: Session) -> int:
+        """为所有活跃用户重算推荐列表（收藏变化和相似商品表的更新都会反映进来），返回重算的用户数。"""
+        users = self.active_users()
+        for user_id in users:
+            self.compute(db, user_id)
+        return len(users)
+
+    def refresh_active_with(self, session_factory: Callable[[], Session]) -> int:
+        db = session_factory()
+        try:
+            return self.refresh_active(db)
+        finally:
+            db.close()
+
+    async def run(self, session_factory: Callable[[], Session], interval_ms: int = RECOMMEND_BATCH_INTERVAL_MS):
+        """后台批处理循环，由 main.py 在启动时创建任务。"""
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            try:
+                await run_in_threadpool(self.refresh_active_with, session_factory)
+            except Exception as exc:
+                print(f"个性化推荐批量重算失败: {exc}")
+
+    def stats(self) -> dict:
+        return {"active_users": len(self._active), "recomputed": self.recomputed, "cache": self.cache.stats()}
+
+
+def favorites_changed(user_id: int, product_ids: List[int], delta: int):
+    """收藏（delta=1）或取消收藏（delta=-1）提交后由 favorites 模块调用。"""
+    if not product_ids:
+        return
+    item_similarity.record(user_id, product_ids, delta)
+    personal_recommendations.invalidate(user_id)
+
+
+# 全局单例
+personal_recommendations = PersonalRecommender(
+    item_similarity,
+    maxsize=int(os.getenv("PERSONAL_CACHE_SIZE", "100000")),
+    ttl=float(os.getenv("PERSONAL_CACHE_TTL", "3600")),
+)
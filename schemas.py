@@ -1,7 +1,7 @@
 # schemas.py
 
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 # --- User Schemas ---
@@ -18,6 +18,21 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+# --- 批量开通用户 Schemas ---
+class UserProvision(UserCreate):
+    role: Literal["customer", "admin"] = "customer"
+
+class UserProvisionBatch(BaseModel):
+    users: List[UserProvision] = Field(..., min_length=1, max_length=10000)
+
+class UserProvisionReport(BaseModel):
+    requested: int
+    created: int
+    existing: List[str]          # 数据库中已存在的用户名
+    duplicated_in_request: List[str]  # 同一批里重复出现的用户名（只创建第一次出现的）
+    failed: List[str]            # 写入时冲突（例如并发创建了同名用户）
+    elapsed_seconds: float
+
 # --- Seller Schemas ---
 class SellerBase(BaseModel):
     shop_name: str
@@ -49,6 +64,38 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+# --- 收藏 Schemas ---
+class FavoriteBatch(BaseModel):
+    # 单次批量操作的商品数上限与分页上限一致
+    product_ids: List[int] = Field(..., min_length=1, max_length=100)
+
+class FavoriteBatchAddResult(BaseModel):
+    added: List[int]
+    already_favorited: List[int]
+    not_found: List[int]
+
+class FavoriteBatchRemoveResult(BaseModel):
+    removed: List[int]
+    not_favorited: List[int]
+
+class FavoriteStatus(BaseModel):
+    product_id: int
+    favorited: bool
+
+# --- 批量导入 Schemas ---
+class ImportRowError(BaseModel):
+    row: int  # 数据行号，从 1 开始（CSV 不计表头）
+    error: str
+
+class ProductImportReport(BaseModel):
+    total_rows: int
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
+    errors_truncated: bool = False
+    elapsed_seconds: float
+    rows_per_second: float
+
 # --- Comment Schemas ---
 class CommentBase(BaseModel):
     content: str = Field(..., min_length=5, max_length=500)
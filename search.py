@@ -0,0 +1,307 @@
+# search.py
+# 进程内的商品全文检索：基于倒排索引 + BM25 排序。
+# 中文没有空格分词，这里对连续的中日韩字符做二元切分（bigram），
+# 例如 "降噪蓝牙耳机" -> 降噪/噪蓝/蓝牙/牙耳/耳机，因此搜 "蓝牙耳机" 或 "耳机" 都能命中；
+# 英文和数字按整词切分。索引在启动时从数据库构建一次，之后随商品增删增量更新。
+# 每个商品另存一份精简摘要（名称、价格、截断的描述），AI 导购检索商品时不必再查数据库。
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import models
+
+# 中日韩统一表意文字、扩展 A 区、日文假名、韩文音节
+_CJK_RANGES = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"[{_CJK_RANGES}]+|[a-z0-9]+")
+_CJK_RE = re.compile(f"[{_CJK_RANGES}]")
+
+# 商品名称比描述更能说明商品是什么，名称中的词频按此倍数计入
+NAME_WEIGHT = 2
+# 摘要中描述的最大字数，控制常驻内存和注入提示词的长度
+SUMMARY_DESCRIPTION_CHARS = 80
+
+
+def _normalize(text: str) -> str:
+    # NFKC 把全角字母数字折叠成半角，再统一小写
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: Optional[str], for_query: bool = False) -> List[str]:
+    """
+    切分文本。
+    建索引时中文连续串同时产出单字和二元组；查询时只用二元组（单字查询除外），
+    这样多字查询只扫描区分度高的二元组倒排表，速度快且结果更准。
+    """
+    if not text:
+        return []
+    tokens = []
+    for run in _TOKEN_RE.findall(_normalize(text)):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        if len(run) == 1 or not for_query:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class ProductSearchIndex:
+    """
+    商品名称与描述上的倒排索引，线程安全，支持增量增删。
+
+    查询不逐条累加整张倒排表，而是把每个词的倒排表按该词的 BM25 词频分量降序排好，
+    各词并行地从高到低取，用阈值算法（Fagin TA）在 "剩余文档不可能进入前 k 名" 时提前停止。
+    常见词的倒排表有上万条时，一次查询通常只需看前几百条。
+    排好序的倒排表按词懒加载缓存，商品增删只让涉及的词失效。
+    """
+
+    # 平均文档长度偏离快照超过该比例时，才重新计算所有词频分量
+    AVG_LEN_DRIFT = 0.2
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程从数据库全量构建，其他等待构建完成后直接使用
+        self._build_lock = threading.Lock()
+        # 全量构建期间发生的增删 [(商品id, 词频, 摘要) 或 (商品id, None, None)]，替换前补到新索引上；
+        # 不构建时为 None。否则构建查询之后才提交的商品会在替换时丢失
+        self._changes_during_build: Optional[list] = None
+        self.clear()
+
+    def clear(self):
+        """清空索引并标记为未构建，下次查询时会从数据库重建。"""
+        with self._lock:
+            self._postings: Dict[str, Dict[int, int]] = {}
+            self._doc_terms: Dict[int, Counter] = {}
+            self._doc_len: Dict[int, int] = {}
+            # 商品id -> (名称, 价格, 截断的描述)
+            self._summaries: Dict[int, Tuple[str, float, str]] = {}
+            self._total_len = 0
+            # 词 -> ([(-词频分量, 商品id), ...] 升序即分量降序, {商品id: 词频分量})
+            self._ranked: Dict[str, Tuple[List[Tuple[float, int]], Dict[int, float]]] = {}
+            self._avg_len = 0.0
+            self.built = False
+
+    # --- 构建与增量更新 ---
+
+    @staticmethod
+    def _terms_of(name: Optional[str], description: Optional[str]) -> Counter:
+        terms = Counter()
+        for token in tokenize(name):
+            terms[token] += NAME_WEIGHT
+        terms.update(tokenize(description))
+        return terms
+
+    @staticmethod
+    def _summary_of(name: Optional[str], price: Optional[float], description: Optional[str]) -> Tuple[str, float, str]:
+        return name or "", price or 0.0, (description or "")[:SUMMARY_DESCRIPTION_CHARS]
+
+    def _add_locked(self, doc_id: int, terms: Counter, summary: Tuple[str, float, str]):
+        self._remove_locked(doc_id)
+        self._doc_terms[doc_id] = terms
+        self._summaries[doc_id] = summary
+        self._doc_len[doc_id] = sum(terms.values())
+        self._total_len += self._doc_len[doc_id]
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+            self._ranked.pop(term, None)
+
+    def _remove_locked(self, doc_id: int):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(doc_id)
+        self._summaries.pop(doc_id, None)
+        for term in terms:
+            self._ranked.pop(term, None)
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+
+    def add(self, product: models.Product):
+        """新增或更新一个商品（publish_product、admin.create_product 调用）。"""
+        self.add_many([product])
+
+    def add_many(self, products: Iterable):
+        """
+        批量新增或更新，切词在锁外完成。products 中每项需有 id、name、price、description 属性，
+        可以是模型对象，也可以是只查了这几列的结果行（如批量导入 RETURNING 的行）。
+        """
+        entries = [
+            (p.id, self._terms_of(p.name, p.description), self._summary_of(p.name, p.price, p.description))
+            for p in products
+        ]
+        with self._lock:
+            for entry in entries:
+                self._add_locked(*entry)
+            if self._changes_during_build is not None:
+                self._changes_during_build.extend(entries)
+
+    def remove(self, product_id: int):
+        """从索引中删除一个商品（admin.delete_product 调用）。"""
+        with self._lock:
+            self._remove_locked(product_id)
+            if self._changes_during_build is not None:
+                self._changes_during_build.append((product_id, None, None))
+
+    def rebuild(self, db: Session):
+        """
+        从数据库全量构建索引。只查询需要的列，构建完成后再整体替换。
+        构建期间的增删先照常写入旧索引，同时记下来，替换前补到新索引上。
+        """
+        with self._build_lock:
+            self._rebuild_locked(db)
+
+    def _rebuild_locked(self, db: Session):
+        with self._lock:
+            self._changes_during_build = []
+        try:
+            rows = db.query(
+                models.Product.id, models.Product.name, models.Product.price, models.Product.description
+            ).yield_per(1000)
+            fresh = ProductSearchIndex(self.k1, self.b)
+            for product_id, name, price, description in rows:
+                fresh._add_locked(product_id, self._terms_of(name, description), self._summary_of(name, price, description))
+        except BaseException:
+            with self._lock:
+                self._changes_during_build = None
+            raise
+        with self._lock:
+            for product_id, terms, summary in self._changes_during_build:
+                if terms is None:
+                    fresh._remove_locked(product_id)
+                else:
+                    fresh._add_locked(product_id, terms, summary)
+            self._changes_during_build = None
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._doc_len = fresh._doc_len
+            self._summaries = fresh._summaries
+            self._total_len = fresh._total_len
+            self._ranked = {}
+            self._avg_len = 0.0
+            self.built = True
+
+    def ensure_built(self, db: Session):
+        """未构建时构建一次；并发调用只有一个线程查库，其余等它构建完成。"""
+        if self.built:
+            return
+        with self._build_lock:
+            if not self.built:
+                self._rebuild_locked(db)
+
+    def ensure_built_with(self, session_factory: Callable[[], Session]):
+        """与 ensure_built 相同，但自己创建同步会话：异步路由通过 run_in_threadpool 在线程中调用。"""
+        if self.built:
+            return
+        with self._build_lock:
+            if self.built:
+                return
+            db = session_factory()
+            try:
+                self._rebuild_locked(db)
+            finally:
+                db.close()
+
+    # --- 查询 ---
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def _tf_component(self, tf: int, doc_id: int) -> float:
+        k1 = self.k1
+        norm = k1 * (1 - self.b + self.b * self._doc_len[doc_id] / self._avg_len)
+        return tf * (k1 + 1) / (tf + norm)
+
+    def _ranked_locked(self, term: str) -> Tuple[List[Tuple[float, int]], Dict[int, float]]:
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            components = {doc_id: self._tf_component(tf, doc_id) for doc_id, tf in self._postings[term].items()}
+            ranked = (sorted((-c, doc_id) for doc_id, c in components.items()), components)
+            self._ranked[term] = ranked
+        return ranked
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[int, float]]:
+        """返回按 BM25 得分降序排列的 [(商品id, 得分), ...]。"""
+        terms = set(tokenize(query, for_query=True))
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if n_docs == 0:
+                return []
+            avg_len = self._total_len / n_docs
+            if not self._avg_len or abs(avg_len - self._avg_len) > self.AVG_LEN_DRIFT * self._avg_len:
+                # 词频分量依赖平均长度；漂移过大时整体失效重算，小幅漂移对排序影响可以忽略
+                self._avg_len = avg_len
+                self._ranked = {}
+
+            lists = []
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                lists.append((idf, *self._ranked_locked(term)))
+            if not lists:
+                return []
+
+            top: List[Tuple[float, int]] = []  # 小顶堆，元素为 (得分, -商品id)
+            seen = set()
+            depth = 0
+            while True:
+                bound = 0.0
+                advanced = False
+                for idf, ranked, _ in lists:
+                    if depth >= len(ranked):
+                        continue
+                    advanced = True
+                    neg_component, doc_id = ranked[depth]
+                    bound -= idf * neg_component
+                    if doc_id in seen:
+                        continue
+                    seen.add(doc_id)
+                    score = 0.0
+                    for other_idf, _, components in lists:
+                        component = components.get(doc_id)
+                        if component:
+                            score += other_idf * component
+                    entry = (score, -doc_id)
+                    if len(top) < limit:
+                        heapq.heappush(top, entry)
+                    elif entry > top[0]:
+                        heapq.heapreplace(top, entry)
+                if not advanced:
+                    break
+                # 尚未见过的文档在每个词上的分量都不超过当前这一层，得分上界即 bound
+                if len(top) >= limit and top[0][0] >= bound:
+                    break
+                depth += 1
+
+        # 同分时 id 小的在前，保证结果稳定
+        return [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
+
+    def summaries(self, product_ids: List[int]) -> List[dict]:
+        """按给定顺序返回商品摘要 [{"id", "name", "price", "description"}, ...]，已删除的商品跳过。"""
+        with self._lock:
+            found = [(i, self._summaries[i]) for i in product_ids if i in self._summaries]
+        return [
+            {"id": product_id, "name": name, "price": price, "description": description}
+            for product_id, (name, price, description) in found
+        ]
+
+
+# 全局单例，由 main.py 在启动时构建
+product_index = ProductSearchIndex()
@@ -1,105 +1,326 @@
-# seed.py (最终修复版)
+# seed.py
+# 测试数据生成器。
+#
+#   python seed.py
+#       只写入演示数据：管理员 admin/admin123、普通用户 testuser/user123、一个商家、三件商品和一条评论。
+#
+#   python seed.py --users 1e6 --products 5e5 --comments 1e7 --favorites-per-user 20
+#       在演示数据之外按参数批量生成接近生产规模的数据，用于压测和基准测试：
+#       商品的收藏、评论以及商家的商品数都服从 Zipf 分布（少数热门商品占大部分流量），评论的点赞数为长尾分布；
+#       批量生成的用户 userN 的密码为 passK（K = N % --distinct-passwords），每种密码只哈希一次。
+#
+#   python seed.py --recompute-counters
+#       不清空、不生成数据，只按关联表重算冗余计数（商品的收藏数、评论数，评论的点赞数）。
+#       点赞数的增量先缓冲在进程内存里（见 likes.py），进程崩溃时未写回的增量会丢失，用它校正；
+#       运行中的进程缓冲区里还有增量，会在写回时重复计入，因此要在应用停止后执行。
+#
+# 写入前会清空所有业务表。所有主键由生成器显式指定，SQLite 和 MySQL 行为一致；
+# 数据库由 DATABASE_URL 环境变量或 --database-url 指定。
+
+import argparse
+import bisect
+from array import array
+import itertools
+import random
+import time
+from typing import Callable, Iterable, Iterator, List, Sequence
+
+from sqlalchemy import func, select, text, update
 
-from database import SessionLocal, engine
 import models
-import bcrypt
-# 导入 sqlalchemy 的 delete 和 text 用于处理关联表
-from sqlalchemy import text
+import passwords
 
-# 绑定元数据
-models.Base.metadata.create_all(bind=engine)
+DEFAULT_BATCH_SIZE = 5000
 
-db = SessionLocal()
+_ADJECTIVES = ["智能", "轻薄", "无线", "降噪", "便携", "专业", "经典", "旗舰", "高清", "静音", "Pro", "Max", "mini"]
+_CATEGORIES = ["手机", "耳机", "键盘", "鼠标", "显示器", "笔记本", "充电器", "音箱", "手表", "相机", "背包", "台灯", "水杯"]
+_COMMENT_TEMPLATES = [
+    "质量很好，物流也很快，推荐购买！",
+    "和描述一致，性价比很高。",
+    "用了一周，整体还不错，就是包装有点简陋。",
+    "第二次回购了，一如既往的好。",
+    "客服态度很好，发货速度快。",
+    "一般般吧，价格有点贵。",
+    "Great product, works as expected.",
+]
 
-def seed_data():
-    print("开始清洗并填充数据...")
 
-    # --- 1. 清空旧数据 (顺序非常重要！) ---
-    
-    # 方法 A: 简单粗暴法 (推荐开发环境使用)
-    # 暂时关闭外键检查，清空所有表，再重新开启。
-    # 这样可以忽略删除顺序，彻底解决 IntegrityError。
-    try:
-        db.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
-        
-        # 清空所有相关表
-        db.execute(models.user_favorites.delete()) # 清空关联表
-        db.query(models.Comment).delete()
-        db.query(models.Product).delete()
-        db.query(models.Seller).delete()
-        db.query(models.User).delete()
-        
-        db.commit() # 提交删除操作
-        print("旧数据已清空。")
-        
-    except Exception as e:
-        db.rollback()
-        print(f"清空数据时出错: {e}")
-        return
-    finally:
-        # 无论如何都要把外键检查开回来，保证以后数据的完整性
-        db.execute(text("SET FOREIGN_KEY_CHECKS = 1"))
-        db.commit()
-
-    # --- 2. 创建商家 ---
-    seller1 = models.Seller(shop_name="京西旗舰店", contact_info="support@jd.com")
-    # 如果为了防止外键报错，也可以先创建一个自营兜底
-    # seller_self = models.Seller(shop_name="京西自营", contact_info="admin@jd.com")
-    
-    db.add(seller1)
-    db.commit()
-    db.refresh(seller1)
-    
-    print(f"创建了商家 ID: {seller1.id}")
-
-    # --- 3. 创建管理员和用户 ---
-    salt = bcrypt.gensalt()
-    
-    # 管理员
-    admin_pwd = bcrypt.hashpw(b"admin123", salt).decode('utf-8')
-    admin_user = models.User(username="admin", hashed_password=admin_pwd, role="admin")
-    
-    # 普通用户
-    user_pwd = bcrypt.hashpw(b"user123", salt).decode('utf-8')
-    normal_user = models.User(username="testuser", hashed_password=user_pwd, role="customer")
-    
-    db.add(admin_user)
-    db.add(normal_user)
-    db.commit()
-    db.refresh(normal_user) # 获取 ID 用于后面的评论
-
-    print("创建了管理员账号: admin / admin123")
-    print("创建了普通用户: testuser / user123")
-
-    # --- 4. 创建商品 ---
-    # 注意：seller_id 使用上面刚刚创建的 seller1.id
-    products_to_add = [
-        models.Product(name="智能手机 Pro Max", price=5999.0, description="性能怪兽", seller_id=seller1.id, image_url=""),
-        models.Product(name="降噪蓝牙耳机", price=799.0, description="静享音乐", seller_id=seller1.id, image_url=""),
-        models.Product(name="机械键盘", price=399.0, description="手感极佳", seller_id=seller1.id, image_url=""),
-    ]
-    
-    db.add_all(products_to_add)
-    db.commit()
-    
-    # 重新获取商品ID以便添加评论
-    p1 = db.query(models.Product).filter(models.Product.name == "智能手机 Pro Max").first()
-
-    # --- 5. 创建初始评论 ---
-    if p1:
-        c1 = models.Comment(
-            content="手机运行速度很快，物流也很给力！", 
-            likes=10, 
-            user_id=normal_user.id, 
-            product_id=p1.id
+def _count(value: str) -> int:
+    """接受 1e6、500000 这样的写法。"""
+    return int(float(value))
+
+
+class ZipfSampler:
+    """
+    在 [0, n) 上按 Zipf 分布抽样：排名 k（从 1 开始）的概率与 1 / k^s 成正比。
+    预先算好累积权重，每次抽样是一次二分查找；排名再经过一次随机打乱映射到 id，热门 id 不会扎堆在最前面。
+    """
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+        self.total = self.cum_weights[-1]
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+
+    def sample(self) -> int:
+        index = bisect.bisect_left(self.cum_weights, self.rng.random() * self.total)
+        return self.ids[min(index, len(self.ids) - 1)]
+
+
+def _batched(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Loader:
+    """按批多行 INSERT，每批一个事务，并统计每张表的写入速度。"""
+
+    def __init__(self, engine, batch_size: int):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.report = []
+
+    def load(self, table, rows: Iterable[dict]) -> int:
+        started = time.perf_counter()
+        count = 0
+        for batch in _batched(rows, self.batch_size):
+            with self.engine.begin() as conn:
+                conn.execute(table.insert(), batch)
+            count += len(batch)
+        elapsed = time.perf_counter() - started
+        self.report.append((table.name, count, elapsed))
+        if count:
+            print(f"  {table.name:<16} {count:>10} 行  {elapsed:8.2f} 秒  {count / max(elapsed, 1e-9):>10.0f} 行/秒")
+        return count
+
+
+def clear_tables(engine):
+    """按外键依赖顺序清空所有业务表。MySQL 用 TRUNCATE（同时重置自增计数），其他数据库用 DELETE。"""
+    tables = [models.comment_likes, models.user_favorites, models.Comment.__table__,
+              models.Product.__table__, models.Seller.__table__, models.User.__table__]
+    with engine.begin() as conn:
+        if engine.dialect.name == "mysql":
+            conn.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+            for table in tables:
+                conn.execute(text(f"TRUNCATE TABLE {table.name}"))
+            conn.execute(text("SET FOREIGN_KEY_CHECKS = 1"))
+        else:
+            for table in tables:
+                conn.execute(table.delete())
+
+
+def recompute_counters(engine, comment_likes: bool = True):
+    """
+    用集合式 UPDATE 重新计算冗余计数：商品的收藏数、评论数，以及评论的点赞数（comment_likes 为准），而不是逐行维护。
+    comment_likes=False 时不动点赞数：comment_likes 表出现之前的老数据没有点赞关系，按它重算会清零（见 migrate.py）。
+    """
+    favorites = (
+        select(func.count()).select_from(models.user_favorites)
+        .where(models.user_favorites.c.product_id == models.Product.id).scalar_subquery()
+    )
+    comments = (
+        select(func.count()).select_from(models.Comment)
+        .where(models.Comment.product_id == models.Product.id).scalar_subquery()
+    )
+    with engine.begin() as conn:
+        conn.execute(update(models.Product.__table__).values(favorites_count=favorites, comment_count=comments))
+    if comment_likes:
+        likes = (
+            select(func.count()).select_from(models.comment_likes)
+            .where(models.comment_likes.c.comment_id == models.Comment.id).scalar_subquery()
         )
-        db.add(c1)
-        db.commit()
+        with engine.begin() as conn:
+            conn.execute(update(models.Comment.__table__).values(likes=likes))
 
-    print("数据填充完成！")
 
-if __name__ == "__main__":
+def demo_rows(first_ids: dict) -> dict:
+    """原 seed.py 的演示数据，id 紧接在批量数据之后。"""
+    seller_id = first_ids["sellers"]
+    user_id = first_ids["users"]
+    product_id = first_ids["products"]
+    return {
+        "sellers": [{"id": seller_id, "shop_name": "京西旗舰店", "contact_info": "support@jd.com"}],
+        "users": [
+            {"id": user_id, "username": "admin", "hashed_password": passwords.hash_password("admin123").decode("utf-8"), "role": "admin"},
+            {"id": user_id + 1, "username": "testuser", "hashed_password": passwords.hash_password("user123").decode("utf-8"), "role": "customer"},
+        ],
+        "products": [
+            {"id": product_id, "name": "智能手机 Pro Max", "price": 5999.0, "description": "性能怪兽", "seller_id": seller_id, "image_url": ""},
+            {"id": product_id + 1, "name": "降噪蓝牙耳机", "price": 799.0, "description": "静享音乐", "seller_id": seller_id, "image_url": ""},
+            {"id": product_id + 2, "name": "机械键盘", "price": 399.0, "description": "手感极佳", "seller_id": seller_id, "image_url": ""},
+        ],
+        "comments": [
+            {"id": first_ids["comments"], "content": "手机运行速度很快，物流也很给力！", "likes": 1,
+             "user_id": user_id + 1, "product_id": product_id},
+        ],
+        "comment_likes": [{"user_id": user_id, "comment_id": first_ids["comments"]}],
+    }
+
+
+def generate(engine, users: int = 0, products: int = 0, comments: int = 0, favorites_per_user: float = 0,
+             sellers: int = None, distinct_passwords: int = 10, zipf_s: float = 1.1,
+             seed: int = 42, batch_size: int = DEFAULT_BATCH_SIZE,
+             log: Callable[[str], None] = print) -> list:
+    """清空并生成数据，返回 [(表名, 行数, 秒数), ...]。"""
+    rng = random.Random(seed)
+    sellers = sellers if sellers is not None else (max(1, products // 500) if products else 0)
+    loader = Loader(engine, batch_size)
+    started = time.perf_counter()
+
+    models.Base.metadata.create_all(bind=engine)
+    clear_tables(engine)
+    log("旧数据已清空，开始写入：")
+
+    # 每种密码只哈希一次，所有使用该密码的用户共用同一个哈希值
+    password_hashes = [passwords.hash_password(f"pass{k}").decode("utf-8") for k in range(distinct_passwords)] if users else []
+
+    loader.load(models.Seller.__table__, (
+        {"id": i, "shop_name": f"店铺{i}", "contact_info": f"seller{i}@example.com"} for i in range(1, sellers + 1)
+    ))
+    loader.load(models.User.__table__, (
+        {"id": i, "username": f"user{i}", "hashed_password": password_hashes[i % distinct_passwords], "role": "customer"}
+        for i in range(1, users + 1)
+    ))
+
+    seller_sampler = ZipfSampler(sellers, zipf_s, rng) if sellers else None
+
+    def product_rows():
+        for i in range(1, products + 1):
+            adjective, category = rng.choice(_ADJECTIVES), rng.choice(_CATEGORIES)
+            yield {
+                "id": i,
+                "name": f"{adjective}{category} {i}",
+                "price": round(rng.lognormvariate(5, 1.2), 2),
+                "description": f"{adjective}{category}，{rng.choice(_COMMENT_TEMPLATES)}",
+                "seller_id": seller_sampler.sample(),
+                "image_url": "",
+            }
+    loader.load(models.Product.__table__, product_rows())
+
+    product_sampler = ZipfSampler(products, zipf_s, rng) if products else None
+
+    def favorite_rows():
+        if not product_sampler:
+            return
+        limit = min(products, max(0, round(favorites_per_user * 2)))
+        for user_id in range(1, users + 1):
+            # 每个用户的收藏数在 [0, 2 * 平均值] 内均匀分布，收藏哪些商品按 Zipf 抽取
+            target = rng.randint(0, limit) if limit else 0
+            chosen = set()
+            for _ in range(target * 3):
+                if len(chosen) >= target:
+                    break
+                chosen.add(product_sampler.sample())
+            for product_id in sorted(chosen):
+                yield {"user_id": user_id, "product_id": product_id}
+    loader.load(models.user_favorites, favorite_rows())
+
+    like_counts = array("l")
+
+    def comment_rows():
+        if not product_sampler or not users:
+            return
+        for i in range(1, comments + 1):
+            # 点赞数长尾分布：大部分评论 0~1 个赞，少数评论很多；不超过用户数
+            likes = min(int(rng.paretovariate(1.5)) - 1, users)
+            like_counts.append(likes)
+            yield {
+                "id": i,
+                "content": rng.choice(_COMMENT_TEMPLATES),
+                "likes": likes,
+                "user_id": rng.randint(1, users),
+                "product_id": product_sampler.sample(),
+            }
+    loader.load(models.Comment.__table__, comment_rows())
+
+    def comment_like_rows():
+        # 点赞关系与 likes 列一致；单独的随机数序列，不影响前面各表生成的数据
+        like_rng = random.Random(seed + 1)
+        for comment_id, likes in enumerate(like_counts, start=1):
+            for user_id in sorted(like_rng.sample(range(1, users + 1), likes)):
+                yield {"user_id": user_id, "comment_id": comment_id}
+    loader.load(models.comment_likes, comment_like_rows())
+
+    demo = demo_rows({"sellers": sellers + 1, "users": users + 1, "products": products + 1, "comments": comments + 1})
+    for table, key in ((models.Seller.__table__, "sellers"), (models.User.__table__, "users"),
+                       (models.Product.__table__, "products"), (models.Comment.__table__, "comments"),
+                       (models.comment_likes, "comment_likes")):
+        with engine.begin() as conn:
+            conn.execute(table.insert(), demo[key])
+
+    counters_started = time.perf_counter()
+    recompute_counters(engine)
+    log(f"  冗余计数重算完成  {time.perf_counter() - counters_started:.2f} 秒")
+
+    total_rows = sum(count for _, count, _ in loader.report) + sum(len(rows) for rows in demo.values())
+    elapsed = time.perf_counter() - started
+    log(f"共写入 {total_rows} 行，用时 {elapsed:.2f} 秒，平均 {total_rows / max(elapsed, 1e-9):.0f} 行/秒")
+    log("管理员账号: admin / admin123；普通用户: testuser / user123")
+    if users:
+        log(f"批量用户: user1 ~ user{users}，userN 的密码为 pass(N % {distinct_passwords})")
+    return loader.report
+
+
+def _tune_sqlite(engine):
+    # 批量写入时关闭同步刷盘，写入速度可提升一个数量级；生成数据丢了可以重来
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.close()
+
+
+def main(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="生成测试数据（会先清空数据库中的业务表）")
+    parser.add_argument("--users", type=_count, default=0, help="批量生成的用户数，例如 1e6")
+    parser.add_argument("--products", type=_count, default=0, help="批量生成的商品数，例如 5e5")
+    parser.add_argument("--comments", type=_count, default=0, help="批量生成的评论数，例如 1e7")
+    parser.add_argument("--favorites-per-user", type=float, default=0, help="每个用户平均收藏的商品数")
+    parser.add_argument("--sellers", type=_count, default=None, help="商家数，默认每 500 件商品一个商家")
+    parser.add_argument("--distinct-passwords", type=int, default=10, help="批量用户使用的不同密码数")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf 分布的指数 s，越大越集中在热门商品")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，相同参数生成相同数据")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每个 INSERT 事务的行数")
+    parser.add_argument("--database-url", default=None, help="数据库连接 URL，默认取 DATABASE_URL 环境变量")
+    parser.add_argument("--recompute-counters", action="store_true",
+                        help="不清空、不生成数据，只按关联表重算收藏数、评论数和点赞数（在应用停止后执行）")
+    args = parser.parse_args(argv)
+
+    from database import create_db_engine
+    engine = create_db_engine(args.database_url)
+    if args.recompute_counters:
+        try:
+            recompute_counters(engine)
+        finally:
+            engine.dispose()
+        print("冗余计数已重算")
+        return
+    if engine.dialect.name == "sqlite":
+        _tune_sqlite(engine)
     try:
-        seed_data()
+        generate(
+            engine,
+            users=args.users,
+            products=args.products,
+            comments=args.comments,
+            favorites_per_user=args.favorites_per_user,
+            sellers=args.sellers,
+            distinct_passwords=max(1, args.distinct_passwords),
+            zipf_s=args.zipf,
+            seed=args.seed,
+            batch_size=args.batch_size,
+        )
     finally:
-        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,38 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 # 在内存 DB 中创建所有表
 models.Base.metadata.create_all(bind=engine)
 
+# AI 回答缓存默认落盘到工作目录，测试中只用内存（需要磁盘的测试自行指向临时目录）
+from cache import configure_ai_cache_path
+configure_ai_cache_path(None)
+
+@pytest.fixture(autouse=True)
+def reset_process_state():
+    """进程内的索引、缓存等全局状态在测试之间不共享（每个测试的数据库都是新建的，id 会复用）"""
+    from search import product_index
+    from cache import product_cache, principal_cache, ai_response_cache
+    from likes import like_buffer
+    from recommender import item_similarity, personal_recommendations
+    product_index.clear()
+    product_cache.clear()
+    principal_cache.clear()
+    ai_response_cache.clear()
+    like_buffer.clear()
+    item_similarity.clear()
+    personal_recommendations.clear()
+    yield
+
+@pytest.fixture
+def query_budget():
+    """
+    查询预算：with query_budget(2): client.get(...)
+    代码块中执行的 SQL 超过给定条数，或同一语句重复执行（N+1）时断言失败；也可用作装饰器。
+    """
+    from querylog import assert_max_queries
+
+    def budget(max_queries, **kwargs):
+        return assert_max_queries(max_queries, engine=engine, **kwargs)
+    return budget
+
 @pytest.fixture(scope="function")
 def db_session():
     """为每个测试函数提供一个新的 DB 会话，并在会话开始前确保表已创建"""
@@ -0,0 +1,90 @@
+# tests/fake_openai.py
+# 本地的假 OpenAI 兼容服务，只实现 /v1/chat/completions（普通与流式两种返回）。
+# 回答内容为 "收到：" 加上用户的问题，流式返回时每个字一段、段间间隔 CHUNK_DELAY 秒，便于测量首字节时间。
+# 问题为 "boom" 时返回 500，问题以 "slow" 开头时普通返回也会等待 SLOW_DELAY 秒。
+#
+# 也可以单独运行，让开发环境的 AI 助手不依赖外部服务：
+#   uvicorn tests.fake_openai:app --port 9100
+#   DEEPSEEK_API_KEY=fake DEEPSEEK_BASE_URL=http://127.0.0.1:9100/v1 uvicorn main:app
+
+import asyncio
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CHUNK_DELAY = 0.05
+SLOW_DELAY = 1.0
+
+app = FastAPI()
+# 收到的请求体，测试中用来检查模型名和消息
+app.state.requests = []
+
+
+def _reply_for(messages) -> str:
+    return "收到：" + messages[-1]["content"]
+
+
+def _chunk(content: str = None, finish_reason: str = None) -> str:
+    delta = {"content": content} if content is not None else {}
+    payload = {
+        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.requests.append(body)
+    query = body["messages"][-1]["content"]
+    if query == "boom":
+        return JSONResponse({"error": {"message": "upstream failure", "type": "server_error"}}, status_code=500)
+    reply = _reply_for(body["messages"])
+
+    if body.get("stream"):
+        async def events():
+            yield _chunk("")
+            for char in reply:
+                await asyncio.sleep(CHUNK_DELAY)
+                yield _chunk(char)
+            yield _chunk(finish_reason="stop")
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if query.startswith("slow"):
+        await asyncio.sleep(SLOW_DELAY)
+    return {
+        "id": "chatcmpl-fake", "object": "chat.completion", "created": 0, "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": len(reply), "total_tokens": 1 + len(reply)},
+    }
+
+
+@contextmanager
+def serve(asgi_app):
+    """在后台线程中用 uvicorn 运行 asgi_app，产出 http://127.0.0.1:端口。"""
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("fake server did not start")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        sock.close()
@@ -0,0 +1,258 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+pytest.importorskip("openai")
+uvicorn = pytest.importorskip("uvicorn")
+
+import models
+from api import ai
+from database import get_db
+from search import product_index
+from tests import fake_openai
+
+
+@pytest.fixture(scope="module")
+def ai_app():
+    """同一个 uvicorn 进程里同时运行假的 OpenAI 服务（/fake/v1）和被测的 AI 路由（/api）。"""
+    app = FastAPI()
+    app.include_router(ai.router, prefix="/api")
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    app.mount("/fake", fake_openai.app)
+    with fake_openai.serve(app) as base_url:
+        ai.configure_client("fake-key", f"{base_url}/fake/v1")
+        yield app, base_url
+    ai.configure_client(None)
+
+
+@pytest.fixture
+def server(ai_app, db_session):
+    """AI 路由检索商品时使用测试数据库（商品索引在每个测试开始时清空，第一次提问时从测试数据库重建）。"""
+    app, base_url = ai_app
+
+    def _get_test_db():
+        yield db_session
+    app.dependency_overrides[get_db] = _get_test_db
+    yield base_url
+    app.dependency_overrides.clear()
+
+
+def _events(lines):
+    event = None
+    for line in lines:
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+            event = None
+
+
+def test_chat_returns_full_reply(server):
+    r = httpx.post(f"{server}/api/ai/chat", json={"query": "蓝牙耳机推荐"})
+    assert r.status_code == 200
+    assert r.json() == {"reply": "收到：蓝牙耳机推荐"}
+    sent = fake_openai.app.state.requests[-1]
+    assert sent["model"] == ai.DEEPSEEK_MODEL and sent["messages"][0]["role"] == "system"
+
+
+def test_chat_stream_forwards_chunks_as_they_arrive(server):
+    query = "有什么适合送人的礼物吗"
+    started = time.perf_counter()
+    with httpx.stream("POST", f"{server}/api/ai/chat", json={"query": query, "stream": True}) as r:
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/event-stream")
+        events = []
+        for event in _events(r.iter_lines()):
+            if not events:
+                first_byte = time.perf_counter() - started
+            events.append(event)
+    total = time.perf_counter() - started
+
+    assert "".join(data["content"] for name, data in events if name is None) == "收到：" + query
+    assert events[-1] == ("done", {})
+    # 逐段转发：第一段到达时，整段回答还远没有生成完
+    assert first_byte < total / 3
+
+
+def test_slow_answer_does_not_block_other_requests(server):
+    with ThreadPoolExecutor(2) as pool:
+        slow = pool.submit(httpx.post, f"{server}/api/ai/chat", json={"query": "slow question"}, timeout=10)
+        time.sleep(0.2)
+        started = time.perf_counter()
+        assert httpx.get(f"{server}/ping").status_code == 200
+        assert time.perf_counter() - started < fake_openai.SLOW_DELAY / 2
+        assert slow.result().json() == {"reply": "收到：slow question"}
+
+
+def test_upstream_errors_are_mapped(server, monkeypatch):
+    monkeypatch.setattr(ai, "AI_MAX_RETRIES", 0)
+    ai.configure_client("fake-key", f"{server}/fake/v1")
+    assert httpx.post(f"{server}/api/ai/chat", json={"query": "boom"}).status_code == 500
+    # 流式请求在开始推送前出错，同样返回错误状态码而不是 200 的空流
+    assert httpx.post(f"{server}/api/ai/chat", json={"query": "boom", "stream": True}).status_code == 500
+
+    ai.configure_client("fake-key", "http://127.0.0.1:9/v1")
+    try:
+        assert httpx.post(f"{server}/api/ai/chat", json={"query": "hi"}, timeout=10).status_code == 503
+    finally:
+        ai.configure_client("fake-key", f"{server}/fake/v1")
+
+
+def test_missing_api_key_returns_500(server):
+    ai.configure_client(None)
+    try:
+        r = httpx.post(f"{server}/api/ai/chat", json={"query": "hi"})
+        assert r.status_code == 500 and "未配置" in r.json()["detail"]
+    finally:
+        ai.configure_client("fake-key", f"{server}/fake/v1")
+
+
+def test_normalize_query_folds_width_case_punctuation_and_spaces():
+    same = ["有什么耳机推荐", "有什么耳机推荐？", " 有什么 耳机推荐!! ", "有什么耳机推荐😀"]
+    assert {ai.normalize_query(q) for q in same} == {"有什么耳机推荐"}
+    assert ai.normalize_query("ＡｉｒＰｏｄｓ　Ｐｒｏ 多少钱？") == ai.normalize_query("airpods pro多少钱") == "airpods pro多少钱"
+    # 英文单词之间的空格有意义，保留
+    assert ai.normalize_query("air pods") != ai.normalize_query("airpods")
+    assert ai.cache_key("？？ ") is None
+
+
+def test_repeat_questions_are_served_from_cache(server, monkeypatch):
+    from cache import ai_response_cache
+
+    upstream = fake_openai.app.state.requests
+    calls = len(upstream)
+    r = httpx.post(f"{server}/api/ai/chat", json={"query": "手机多少钱？"})
+    assert r.headers[ai.CACHE_HEADER] == "miss" and len(upstream) == calls + 1
+
+    r = httpx.post(f"{server}/api/ai/chat", json={"query": "手机 多少钱"})
+    assert r.headers[ai.CACHE_HEADER] == "hit"
+    assert r.json() == {"reply": "收到：手机多少钱？"}
+    # 流式请求同样命中缓存，整段回答一次发出
+    with httpx.stream("POST", f"{server}/api/ai/chat", json={"query": "手机多少钱", "stream": True}) as s:
+        assert s.headers[ai.CACHE_HEADER] == "hit"
+        assert list(_events(s.iter_lines())) == [(None, {"content": "收到：手机多少钱？"}), ("done", {})]
+    assert len(upstream) == calls + 1
+
+    # 流式回答完整收到后也会写入缓存
+    with httpx.stream("POST", f"{server}/api/ai/chat", json={"query": "耳机推荐", "stream": True}) as s:
+        list(s.iter_lines())
+    assert httpx.post(f"{server}/api/ai/chat", json={"query": "耳机推荐"}).headers[ai.CACHE_HEADER] == "hit"
+    # 出错的回答不缓存
+    monkeypatch.setattr(ai, "AI_MAX_RETRIES", 0)
+    ai.configure_client("fake-key", f"{server}/fake/v1")
+    httpx.post(f"{server}/api/ai/chat", json={"query": "boom"})
+    assert httpx.post(f"{server}/api/ai/chat", json={"query": "boom"}).status_code == 500
+
+    # 系统提示词变化后旧回答不再命中
+    monkeypatch.setattr(ai, "PROMPT_VERSION", "changed")
+    assert httpx.post(f"{server}/api/ai/chat", json={"query": "手机多少钱"}).headers[ai.CACHE_HEADER] == "miss"
+    assert ai_response_cache.stats()["hits"] == 3
+
+
+def test_sqlite_backend_survives_restart_with_ttl_and_lru(tmp_path, monkeypatch):
+    from cache import MISSING, SQLiteBackend
+
+    path = str(tmp_path / "ai_cache.sqlite3")
+    backend = SQLiteBackend(path, maxsize=2, ttl=60)
+    backend.set("a", "回答A")
+    backend.set("b", "回答B")
+    assert backend.get("a") == "回答A"  # a 成为最近访问
+    backend.set("c", "回答C")  # 超出容量，淘汰最久未访问的 b
+    backend.close()
+
+    reopened = SQLiteBackend(path, maxsize=2, ttl=60)
+    assert len(reopened) == 2
+    assert reopened.get("b") is MISSING
+    assert reopened.get("a") == "回答A" and reopened.get("c") == "回答C"
+    reopened.set("short", "x", ttl=0.01)
+    time.sleep(0.02)
+    assert reopened.get("short") is MISSING
+    assert reopened.stats()["expirations"] == 1 and reopened.stats()["hits"] == 2
+    # 条目数随写入、淘汰和过期维护，不必每次全表计数
+    assert len(reopened) == 1 and reopened.get("c") == "回答C"
+    reopened.close()
+
+
+def test_concurrent_identical_questions_share_one_upstream_call(server):
+    upstream = fake_openai.app.state.requests
+    calls = len(upstream)
+    variants = ["slow 限时秒杀", "slow 限时秒杀？", "SLOW 限时秒杀", "slow  限时 秒杀!"]
+    with ThreadPoolExecutor(len(variants) + 1) as pool:
+        leader = pool.submit(httpx.post, f"{server}/api/ai/chat", json={"query": variants[0]}, timeout=10)
+        time.sleep(0.2)
+        followers = [pool.submit(httpx.post, f"{server}/api/ai/chat", json={"query": q}, timeout=10)
+                     for q in variants[1:]]
+
+        # 中途加入的流式请求同样跟随这次调用
+        def stream_follower():
+            with httpx.stream("POST", f"{server}/api/ai/chat", json={"query": "slow 限时秒杀", "stream": True},
+                              timeout=10) as s:
+                return s.headers[ai.CACHE_HEADER], list(_events(s.iter_lines()))
+
+        streamed = pool.submit(stream_follower)
+        responses = [leader.result()] + [f.result() for f in followers]
+
+    assert len(upstream) == calls + 1
+    assert {r.json()["reply"] for r in responses} == {"收到：slow 限时秒杀"}
+    assert [r.headers[ai.CACHE_HEADER] for r in responses] == ["miss"] + ["coalesced"] * 3
+    assert streamed.result() == ("coalesced", [(None, {"content": "收到：slow 限时秒杀"}), ("done", {})])
+    assert ai.upstream_stats()["pending_questions"] == 0
+
+
+def test_limiter_rejects_when_queue_is_full_and_times_out_waiters(server, monkeypatch):
+    limiter = ai.UpstreamLimiter(max_concurrent=1, max_queue=1, timeout=0.3)
+    monkeypatch.setattr(ai, "upstream_limiter", limiter)
+    with ThreadPoolExecutor(3) as pool:
+        running = pool.submit(httpx.post, f"{server}/api/ai/chat", json={"query": "slow 第一个"}, timeout=10)
+        time.sleep(0.1)
+        queued = pool.submit(httpx.post, f"{server}/api/ai/chat", json={"query": "slow 第二个"}, timeout=10)
+        time.sleep(0.1)
+        # 一个在途、一个排队，第三个问题直接被拒，不再等待
+        rejected = httpx.post(f"{server}/api/ai/chat", json={"query": "slow 第三个", "stream": True}, timeout=10)
+        assert rejected.status_code == 429 and rejected.headers["Retry-After"] == "1"
+
+        timed_out = queued.result()
+        assert timed_out.status_code == 503 and "Retry-After" in timed_out.headers
+        assert running.result().json() == {"reply": "收到：slow 第一个"}
+
+    stats = limiter.stats()
+    assert (stats["rejected"], stats["timeouts"], stats["in_flight"], stats["queue_depth"]) == (1, 1, 0, 0)
+
+
+def test_prompt_carries_only_the_most_relevant_products(server, db_session, monkeypatch):
+    monkeypatch.setattr(ai, "AI_CONTEXT_PRODUCTS", 3)
+    db_session.add_all(
+        [models.Product(name=f"降噪蓝牙耳机{i}代", price=199 + i, description="主动降噪，续航30小时") for i in range(6)]
+        + [models.Product(name="机械键盘", price=299, description="青轴")]
+    )
+    db_session.commit()
+    upstream = fake_openai.app.state.requests
+
+    r = httpx.post(f"{server}/api/ai/chat", json={"query": "蓝牙耳机多少钱"})
+    assert r.json() == {"reply": "收到：蓝牙耳机多少钱"}
+    system, context, user = upstream[-1]["messages"]
+    assert context["role"] == "system" and context["content"].startswith(ai.CONTEXT_PROMPT)
+    lines = context["content"].splitlines()[1:]
+    assert len(lines) == 3 and all("蓝牙耳机" in line for line in lines)
+    assert "¥199.00" in lines[0] and "主动降噪" in lines[0]
+    # 与商品无关的问题不注入上下文
+    httpx.post(f"{server}/api/ai/chat", json={"query": "你好"})
+    assert [m["role"] for m in upstream[-1]["messages"]] == ["system", "user"]
+
+    assert httpx.post(f"{server}/api/ai/chat", json={"query": "蓝牙耳机多少钱？"}).headers[ai.CACHE_HEADER] == "hit"
+    # 新上架的商品增量进入索引；上下文变了，同一个问题不再命中旧回答
+    product = models.Product(name="蓝牙耳机", price=99, description="入门款")
+    db_session.add(product)
+    db_session.commit()
+    product_index.add(product)
+    r = httpx.post(f"{server}/api/ai/chat", json={"query": "蓝牙耳机多少钱"})
+    assert r.headers[ai.CACHE_HEADER] == "miss"
+    assert f"#{product.id} 蓝牙耳机，¥99.00" in upstream[-1]["messages"][1]["content"]
@@ -0,0 +1,157 @@
+# 异步数据库栈（api/aio + AsyncSession）的接口测试。
+# 测试库使用临时 SQLite 文件：同步会话负责建表和准备数据，被测接口通过 aiosqlite 异步访问同一个文件。
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import models
+import recommender
+from database import get_async_db, get_sync_session_factory
+from api.users import get_password_hash
+from api.aio import products, users, sellers, recommendations, admin
+
+app = FastAPI()
+for module in (users, products, sellers, recommendations, admin):
+    app.include_router(module.router, prefix="/api")
+
+
+@pytest.fixture(scope="function")
+def db_path(tmp_path):
+    path = tmp_path / "async_test.db"
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    seller = models.Seller(shop_name="异步商家", contact_info="async@seller.local")
+    session.add(seller)
+    session.commit()
+    session.add_all([
+        models.Product(name=f"商品{i}", price=float(i * 10), description=f"描述{i}", seller_id=seller.id)
+        for i in range(1, 6)
+    ])
+    session.add(models.User(username="alice", hashed_password=get_password_hash("password123").decode("utf-8")))
+    session.add(models.User(username="root", hashed_password=get_password_hash("root123").decode("utf-8"), role="admin"))
+    session.commit()
+    session.close()
+    engine.dispose()
+    return path
+
+
+@pytest.fixture(scope="function")
+def client(db_path):
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    AsyncTestingSession = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def _get_test_db():
+        async with AsyncTestingSession() as db:
+            yield db
+
+    # 线程池中重建索引、相似度表时使用的同步会话，指向同一个文件
+    sync_engine = create_engine(f"sqlite:///{db_path}")
+    app.dependency_overrides[get_async_db] = _get_test_db
+    app.dependency_overrides[get_sync_session_factory] = lambda: sessionmaker(bind=sync_engine)
+    with TestClient(app) as c:
+        yield c
+        c.portal.call(async_engine.dispose)
+    app.dependency_overrides.clear()
+    sync_engine.dispose()
+
+
+def _login(client, username, password):
+    r = client.post("/api/users/login", json={"username": username, "password": password})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def test_async_product_list_pagination_and_detail(client):
+    r = client.get("/api/products/", params={"sort_by": "price_desc", "limit": 2})
+    assert r.status_code == 200
+    assert [p["price"] for p in r.json()] == [50.0, 40.0]
+    cursor = r.headers["X-Next-Cursor"]
+
+    r = client.get("/api/products/", params={"sort_by": "price_desc", "limit": 2, "cursor": cursor})
+    assert [p["price"] for p in r.json()] == [30.0, 20.0]
+
+    first_id = r.json()[0]["id"]
+    r = client.get(f"/api/products/{first_id}")
+    assert r.status_code == 200 and r.json()["price"] == 30.0
+    assert client.get("/api/products/9999").status_code == 404
+
+
+def test_async_register_login_favorites_and_comments(client):
+    r = client.post("/api/users/register", json={"username": "bob", "password": "secret123"})
+    assert r.status_code == 201
+    headers = _login(client, "bob", "secret123")
+
+    assert client.post("/api/users/favorites/1", headers=headers).status_code == 201
+    assert client.post("/api/users/favorites/1", headers=headers).status_code == 400
+    favorites = client.get("/api/users/favorites", headers=headers).json()
+    assert [p["id"] for p in favorites] == [1]
+    assert client.get("/api/products/", params={"sort_by": "popularity", "limit": 1}).json()[0]["id"] == 1
+    assert client.delete("/api/users/favorites/1", headers=headers).status_code == 204
+    assert client.get("/api/users/favorites", headers=headers).json() == []
+
+    r = client.post("/api/products/1/comments", json={"content": "异步评论内容"}, headers=headers)
+    assert r.status_code == 201 and r.json()["username"] == "bob"
+    comments = client.get("/api/products/1/comments").json()
+    assert [(c["content"], c["username"]) for c in comments] == [("异步评论内容", "bob")]
+
+
+def test_async_search_and_admin_endpoints(client):
+    headers = _login(client, "root", "root123")
+    assert client.get("/api/admin/cache/stats").status_code == 401
+
+    r = client.post("/api/admin/products", json={"name": "降噪蓝牙耳机", "price": 299.0, "description": "异步"}, headers=headers)
+    assert r.status_code == 201
+    new_id = r.json()["id"]
+    assert [p["id"] for p in client.get("/api/products/search", params={"q": "蓝牙"}).json()] == [new_id]
+
+    assert client.delete(f"/api/admin/products/{new_id}", headers=headers).status_code == 204
+    assert client.get("/api/products/search", params={"q": "蓝牙"}).json() == []
+
+    r = client.get("/api/admin/products/export", params={"format": "ndjson"}, headers=headers)
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["id"] for row in rows] == [1, 2, 3, 4, 5]
+
+    body = '{"name": "导入商品", "price": 9.9}\n{"name": "坏数据", "price": "abc"}\n'
+    r = client.post("/api/admin/products/import", content=body.encode("utf-8"), headers=headers)
+    report = r.json()
+    assert (report["imported"], report["failed"]) == (1, 1)
+    assert len(client.get("/api/products/", params={"limit": 100}).json()) == 6
+    assert [p["name"] for p in client.get("/api/products/search", params={"q": "导入"}).json()] == ["导入商品"]
+
+    assert client.get("/api/recommendations/").status_code == 200
+    assert client.get("/api/recommendations/similar/1").json() == []
+    assert client.get("/api/recommendations/similar/9999").status_code == 404
+    assert client.post("/api/sellers/", json={"shop_name": "新店", "contact_info": "x"}).status_code == 201
+
+
+def test_async_personal_recommendations_score_off_the_event_loop(client, monkeypatch):
+    threads = []
+    score_candidates = recommender.score_candidates
+
+    def recording_score_candidates(*args):
+        try:
+            asyncio.get_running_loop()
+            threads.append("event-loop")
+        except RuntimeError:
+            threads.append("worker")
+        return score_candidates(*args)
+
+    monkeypatch.setattr(recommender, "score_candidates", recording_score_candidates)
+    headers = _login(client, "alice", "password123")
+    assert client.post("/api/users/favorites/1", headers=headers).status_code == 201
+
+    r = client.get("/api/recommendations/", params={"limit": 3}, headers=headers)
+    assert r.status_code == 200
+    # 只收藏了一件、没有共同收藏：用热门商品补齐，已收藏的商品不出现
+    assert len(r.json()) == 3 and 1 not in [p["id"] for p in r.json()]
+    assert threads == ["worker"]
+    # 第二次命中缓存，不再打分
+    assert client.get("/api/recommendations/", params={"limit": 3}, headers=headers).json() == r.json()
+    assert threads == ["worker"]
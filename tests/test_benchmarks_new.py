@@ -0,0 +1,46 @@
+import asyncio
+
+from sqlalchemy import create_engine
+
+import passwords
+import seed
+from benchmarks import bench
+
+
+def test_compare_flags_latency_throughput_and_query_regressions():
+    base = {"p95_ms": 10.0, "throughput_rps": 100.0, "queries_per_request": 2.0, "error_rate": 0.0}
+    assert bench.compare({"s": dict(base, p95_ms=12.0, throughput_rps=90.0)}, {"s": base}, threshold=0.25) == []
+    regressions = bench.compare(
+        {"s": {"p95_ms": 20.0, "throughput_rps": 50.0, "queries_per_request": 3.0, "error_rate": 0.5}},
+        {"s": base}, threshold=0.25,
+    )
+    assert len(regressions) == 4
+    # 几毫秒的接口慢了 1ms 以内是机器抖动，不算退化
+    fast = {"p95_ms": 2.0, "throughput_rps": 500.0, "queries_per_request": 1.0, "error_rate": 0.0}
+    assert bench.compare({"s": dict(fast, p95_ms=3.0, throughput_rps=350.0)}, {"s": fast}, floor_ms=3.0) == []
+    assert len(bench.compare({"s": dict(fast, p95_ms=6.0, throughput_rps=150.0)}, {"s": fast}, floor_ms=3.0)) == 2
+    # 高并发下只比较 SQL 条数和错误率
+    assert len(bench.compare(
+        {"s": {"p95_ms": 20.0, "throughput_rps": 50.0, "queries_per_request": 3.0, "error_rate": 0.5}},
+        {"s": base}, threshold=0.25, latency=False,
+    )) == 2
+    # 基线中没有的场景不参与比较
+    assert bench.compare({"new": base}, {"s": base}) == []
+
+
+def test_run_benchmarks_reports_percentiles_and_queries(tmp_path, monkeypatch):
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+    engine = create_engine(f"sqlite:///{tmp_path / 'bench.db'}", connect_args={"check_same_thread": False})
+    seed.generate(engine, users=30, products=20, comments=100, favorites_per_user=2, log=lambda message: None)
+    scenarios = [s for s in bench.SCENARIOS if s.name in ("product_detail", "comments_newest", "favorites_add")]
+
+    results = asyncio.run(bench.run_benchmarks(engine, scenarios, [1, 4], requests=20, warmup=2, repeat=2,
+                                               log=lambda m: None))
+
+    assert set(results) == {1, 4}
+    for stats in results[4].values():
+        assert stats["requests"] == 20 and stats["errors"] == 0 and stats["repeat"] == 2
+        assert 0 < stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        assert stats["throughput_rps"] > 0
+    # 评论分页固定是一条分页查询加一条计数查询
+    assert results[1]["comments_newest"]["queries_per_request"] == 2.0
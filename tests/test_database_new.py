@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import database
+from metrics import Histogram
+
+
+def test_engine_factory_applies_pool_settings_and_records_waits(tmp_path):
+    engine = database.create_db_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+    assert isinstance(engine.pool, database.TimedQueuePool)
+
+    held = engine.connect()
+    held.execute(text("SELECT 1"))
+    status = database.pool_status(engine)
+    assert (status["size"], status["checkedout"]) == (1, 1)
+
+    # 连接池已满，第二个连接等待 pool_timeout 后超时，并计入超时次数和等待时间
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    held.close()
+
+    status = database.pool_status(engine)
+    assert status["checkedout"] == 0
+    assert status["timeouts"] == 1
+    assert status["wait_seconds"]["count"] == 2
+    assert status["wait_seconds"]["max"] >= 0.05
+    engine.dispose()
+
+
+def test_engine_factory_uses_static_pool_for_sqlite_memory():
+    engine = database.create_db_engine("sqlite://")
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+    assert database.pool_status(engine)["pool_class"] == "StaticPool"
+
+
+def test_engine_factory_falls_back_to_sqlite_only_when_opted_in(monkeypatch, tmp_path):
+    try:
+        import MySQLdb  # noqa: F401
+        pytest.skip("mysqlclient 已安装，无法模拟驱动缺失")
+    except ImportError:
+        pass
+    # 默认不退回：驱动缺失直接报错
+    monkeypatch.setattr(database, "SQLITE_FALLBACK_URL", "")
+    with pytest.raises(ImportError):
+        database.create_db_engine("mysql+mysqldb://u:p@localhost/db")
+
+    fallback = f"sqlite:///{tmp_path / 'fallback.db'}"
+    monkeypatch.setattr(database, "SQLITE_FALLBACK_URL", fallback)
+    with pytest.warns(UserWarning):
+        engine = database.create_db_engine("mysql+mysqldb://u:p@localhost/db")
+    assert str(engine.url) == fallback
+
+
+def test_async_engine_derives_driver_from_backend(tmp_path):
+    assert database.async_database_url("mysql+pymysql://u:p@localhost/db").drivername == "mysql+aiomysql"
+    assert database.async_database_url("sqlite+aiosqlite://").drivername == "sqlite+aiosqlite"
+    with pytest.raises(ValueError):
+        database.async_database_url("postgresql://u:p@localhost/db")
+
+    # sync 模式的 SQLite URL 直接用于 DB_MODE=async，不再因连接池类型不匹配而失败
+    engine = database.create_async_db_engine(f"sqlite:///{tmp_path / 'async.db'}")
+    assert engine.url.drivername == "sqlite+aiosqlite"
+    assert isinstance(engine.pool, database.TimedAsyncAdaptedQueuePool)
+
+    async def _select_one():
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT 1"))).scalar()
+
+    assert asyncio.run(_select_one()) == 1
+    asyncio.run(engine.dispose())
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["buckets"] == {"1": 1, "2": 3, "4": 4, "+Inf": 5}
+    assert 1 <= snapshot["p50"] <= 2
+    assert snapshot["p99"] <= 10
@@ -150,3 +150,190 @@ def test_recommendations_returns_created_products(client):
     
     rec_ids = {p['id'] for p in recs}
     assert any(p['id'] in rec_ids for p in created)
+
+
+def test_search_index_follows_admin_create_and_delete(client, db_session):
+    hashed_pwd = bcrypt.hashpw(b"admin_pass", bcrypt.gensalt()).decode('utf-8')
+    db_session.add(models.User(username="admin_search", hashed_password=hashed_pwd, role="admin"))
+    db_session.commit()
+    login = client.post("/api/users/login", json={"username": "admin_search", "password": "admin_pass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    payload = {"name": "扫地机器人", "price": 1999.0, "description": "自动回充"}
+    r = client.post("/api/admin/products", json=payload, headers=headers)
+    assert r.status_code == 201
+    product_id = r.json()["id"]
+
+    r = client.get("/api/products/search", params={"q": "机器人"})
+    assert [p["id"] for p in r.json()] == [product_id]
+
+    assert client.delete(f"/api/admin/products/{product_id}", headers=headers).status_code == 204
+    assert client.get("/api/products/search", params={"q": "机器人"}).json() == []
+
+
+def test_admin_delete_invalidates_product_cache(client, db_session):
+    hashed_pwd = bcrypt.hashpw(b"admin_pass", bcrypt.gensalt()).decode('utf-8')
+    db_session.add(models.User(username="admin_cache", hashed_password=hashed_pwd, role="admin"))
+    db_session.commit()
+    login = client.post("/api/users/login", json={"username": "admin_cache", "password": "admin_pass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    r = client.post("/api/admin/products", json={"name": "缓存商品", "price": 1.0}, headers=headers)
+    product_id = r.json()["id"]
+    assert client.get(f"/api/products/{product_id}").status_code == 200
+    assert any(p["id"] == product_id for p in client.get("/api/products/").json())
+
+    assert client.delete(f"/api/admin/products/{product_id}", headers=headers).status_code == 204
+    assert client.get(f"/api/products/{product_id}").status_code == 404
+    assert not any(p["id"] == product_id for p in client.get("/api/products/").json())
+
+    stats = client.get("/api/admin/cache/stats", headers=headers)
+    assert stats.status_code == 200
+    assert {"hits", "misses", "evictions", "size"} <= stats.json().keys()
+
+    pool = client.get("/api/admin/db/pool", headers=headers)
+    assert pool.status_code == 200
+    assert {"url", "pool_class"} <= pool.json().keys()
+
+
+def test_admin_export_products_streams_ndjson_and_csv(client, db_session):
+    import csv
+    import io
+    import json
+
+    hashed_pwd = bcrypt.hashpw(b"admin_pass", bcrypt.gensalt()).decode('utf-8')
+    db_session.add(models.User(username="admin_export", hashed_password=hashed_pwd, role="admin"))
+    s1 = models.Seller(shop_name="导出商家1")
+    s2 = models.Seller(shop_name="导出商家2")
+    db_session.add_all([s1, s2])
+    db_session.commit()
+    db_session.add_all(
+        [models.Product(name=f"商品{i}", price=float(i), description="含,逗号", seller_id=s1.id) for i in range(5)]
+        + [models.Product(name="别家商品", price=9.9, seller_id=s2.id)]
+    )
+    db_session.commit()
+    login = client.post("/api/users/login", json={"username": "admin_export", "password": "admin_pass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    r = client.get("/api/admin/products/export", headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in r.text.splitlines()]
+    assert len(records) == 6
+    assert [rec["id"] for rec in records] == sorted(rec["id"] for rec in records)
+    assert records[0]["description"] == "含,逗号"
+
+    r = client.get("/api/admin/products/export", params={"format": "csv", "seller_id": s2.id}, headers=headers)
+    assert r.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row["name"] for row in rows] == ["别家商品"]
+
+    r = client.get("/api/admin/products/export", params={"updated_since": "2999-01-01T00:00:00"}, headers=headers)
+    assert r.text == ""
+
+    # 收藏、评论只改计数，不算修改商品，不会出现在增量导出里
+    import favorites
+    from datetime import datetime
+    from api.products import increment_comment_count
+    product = db_session.query(models.Product).filter(models.Product.seller_id == s2.id).one()
+    db_session.query(models.Product).update({"updated_at": datetime(2000, 1, 1)})
+    db_session.commit()
+    admin_id = db_session.query(models.User.id).filter(models.User.username == "admin_export").scalar()
+    favorites.add_favorite(db_session, admin_id, product.id)
+    db_session.execute(increment_comment_count(product.id))
+    db_session.commit()
+    r = client.get("/api/admin/products/export", params={"updated_since": "2001-01-01T00:00:00"}, headers=headers)
+    assert r.text == ""
+
+    # 非管理员不能导出
+    assert client.get("/api/admin/products/export").status_code == 401
+
+
+def test_admin_bulk_import_ndjson_and_csv(client, db_session, monkeypatch):
+    import json
+    from api import admin
+
+    hashed_pwd = bcrypt.hashpw(b"admin_pass", bcrypt.gensalt()).decode('utf-8')
+    db_session.add(models.User(username="admin_import", hashed_password=hashed_pwd, role="admin"))
+    db_session.commit()
+    login = client.post("/api/users/login", json={"username": "admin_import", "password": "admin_pass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    # 分块调小，覆盖多块写入
+    monkeypatch.setattr(admin, "IMPORT_CHUNK_SIZE", 3)
+    lines = [json.dumps({"name": f"导入商品{i}", "price": i + 0.5}, ensure_ascii=False) for i in range(7)]
+    lines.insert(2, '{"name": "缺价格"}')
+    lines.insert(5, "not json")
+    lines.insert(6, "")
+    body = "\n".join(lines).encode("utf-8")
+
+    # 先构建索引；导入后增量加入新商品，不会清空索引、在下一次搜索时全量重建
+    from search import product_index
+    assert client.get("/api/products/search", params={"q": "导入商品"}).json() == []
+    monkeypatch.setattr(product_index, "_rebuild_locked", None)
+
+    r = client.post("/api/admin/products/import", content=body, headers=headers)
+    assert r.status_code == 200
+    report = r.json()
+    assert report["total_rows"] == 9
+    assert report["imported"] == 7
+    assert report["failed"] == 2
+    assert [e["row"] for e in report["errors"]] == [3, 6]
+    assert "price" in report["errors"][0]["error"]
+    assert report["rows_per_second"] > 0
+    assert db_session.query(models.Product).count() == 7
+
+    r = client.get("/api/products/search", params={"q": "导入商品"})
+    assert len(r.json()) == 7
+
+    # 不支持 executemany RETURNING 的数据库（MySQL）按写入前的最大 id 取回新商品
+    monkeypatch.setattr(db_session.get_bind().dialect, "insert_executemany_returning", False)
+    csv_body = 'name,price,description\n"带""引号""的商品",12.5,"多行\n描述"\n空价格,,x\n'
+    r = client.post("/api/admin/products/import?format=csv", content=csv_body.encode("utf-8"), headers=headers)
+    report = r.json()
+    assert report["imported"] == 1
+    assert report["failed"] == 1
+    assert report["errors"][0]["row"] == 2
+    product = db_session.query(models.Product).filter(models.Product.price == 12.5).one()
+    assert product.name == '带"引号"的商品'
+    assert product.description == "多行\n描述"
+    assert [p["name"] for p in client.get("/api/products/search", params={"q": "引号"}).json()] == ['带"引号"的商品']
+
+    r = client.post("/api/admin/products/import?seller_id=9999", content=b"", headers=headers)
+    assert r.status_code == 404
+
+
+def test_admin_bulk_user_provisioning(client, db_session, monkeypatch):
+    import passwords
+    import provisioning
+
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+    monkeypatch.setattr(provisioning, "PROVISION_WORKERS", 2)
+    hashed_pwd = bcrypt.hashpw(b"admin_pass", bcrypt.gensalt()).decode('utf-8')
+    db_session.add(models.User(username="admin_bulk", hashed_password=hashed_pwd, role="admin"))
+    db_session.add(models.User(username="taken", hashed_password=hashed_pwd))
+    db_session.commit()
+    login = client.post("/api/users/login", json={"username": "admin_bulk", "password": "admin_pass"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    users = [{"username": f"corp{i}", "password": f"pass{i}word"} for i in range(12)]
+    users += [{"username": "taken", "password": "x"}, {"username": "corp0", "password": "again"}]
+    users.append({"username": "corp_admin", "password": "adminpw1", "role": "admin"})
+    try:
+        r = client.post("/api/admin/users/bulk", json={"users": users}, headers=headers)
+    finally:
+        provisioning.shutdown_pool()
+    assert r.status_code == 200, r.text
+    report = r.json()
+    assert (report["requested"], report["created"]) == (15, 13)
+    assert report["existing"] == ["taken"]
+    assert report["duplicated_in_request"] == ["corp0"]
+    assert report["failed"] == []
+
+    # 新用户可以直接登录，角色按请求设置
+    r = client.post("/api/users/login", json={"username": "corp7", "password": "pass7word"})
+    assert r.status_code == 200 and r.json()["role"] == "customer"
+    assert client.post("/api/users/login", json={"username": "corp_admin", "password": "adminpw1"}).json()["role"] == "admin"
+
+    r = client.post("/api/admin/users/bulk", json={"users": [{"username": "x", "password": "y", "role": "root"}]}, headers=headers)
+    assert r.status_code == 422
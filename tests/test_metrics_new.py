@@ -0,0 +1,80 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+import monitoring
+from api.products import router as products_router
+from database import get_db
+
+
+@pytest.fixture
+def metrics_client(db_session, seed_data):
+    # 与 main.py 相同：API 路由挂在 /api 子应用上，指标中间件和 /metrics 在外层应用
+    api = FastAPI()
+    api.include_router(products_router)
+    api.dependency_overrides[get_db] = lambda: db_session
+    app = FastAPI()
+    app.add_middleware(monitoring.MetricsMiddleware)
+    app.add_api_route("/metrics", monitoring.metrics_response, include_in_schema=False)
+    app.mount("/api", api)
+    with TestClient(app) as c:
+        yield c
+
+
+def _sample(text: str, prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_are_labelled_by_route_template(metrics_client, seed_data):
+    route = '{method="GET",route="/api/products/{product_id}"'
+    before = metrics_client.get("/metrics").text
+    product_id = seed_data["products"][0].id
+    assert metrics_client.get(f"/api/products/{product_id}").status_code == 200
+    assert metrics_client.get("/api/products/999999").status_code == 404
+    text = metrics_client.get("/metrics").text
+
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    ok = 'http_requests_total{method="GET",route="/api/products/{product_id}",status="200"}'
+    missing = 'http_requests_total{method="GET",route="/api/products/{product_id}",status="404"}'
+    assert _sample(text, ok) - _sample(before, ok) == 1
+    assert _sample(text, missing) - _sample(before, missing) == 1
+    # 原始路径不会成为标签
+    assert f"/api/products/{product_id}\"" not in text
+    # 每个请求的 SQL 条数：详情页未命中缓存时各查一次
+    queries = _sample(text, f"http_request_db_queries_sum{route}}}") - _sample(before, f"http_request_db_queries_sum{route}}}")
+    assert queries == 2
+    assert _sample(text, f"http_response_size_bytes_count{route}}}") - _sample(before, f"http_response_size_bytes_count{route}}}") == 2
+    assert _sample(text, "http_requests_in_flight") == 1  # 正在处理的就是这次 /metrics 请求
+
+
+def test_prometheus_rendering_escapes_labels_and_accumulates_buckets():
+    family = metrics.MetricFamily("demo_seconds", "demo", "histogram", ("route",), buckets=(0.1, 1.0))
+    family.labels('a"b').observe(0.05)
+    family.labels('a"b').observe(0.5)
+    registry = metrics.Registry()
+    registry.register(family)
+    text = registry.render()
+    assert 'demo_seconds_bucket{route="a\\"b",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{route="a\\"b",le="1"} 2' in text
+    assert 'demo_seconds_bucket{route="a\\"b",le="+Inf"} 2' in text
+    assert 'demo_seconds_count{route="a\\"b"} 2' in text
+
+
+def test_pool_metrics_cover_every_registered_engine(monkeypatch, tmp_path):
+    from database import create_async_db_engine, create_db_engine
+
+    monkeypatch.setattr(monitoring, "_engines", {})
+    sync_engine = create_db_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    async_engine = create_async_db_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    monitoring.register_engine(sync_engine)
+    monitoring.register_engine(async_engine.sync_engine, name="async")
+    text = monitoring.registry.render()
+    # 两个引擎是同一组指标的不同标签值，HELP/TYPE 只输出一次
+    assert text.count("# TYPE db_pool_wait_seconds histogram") == 1
+    assert 'db_pool_wait_seconds_count{engine="default"}' in text
+    assert 'db_pool_wait_seconds_count{engine="async"}' in text
+    sync_engine.dispose()
@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.orm import Session
+
+import migrate
+import models
+
+# 加计数列和联合索引之前的表结构（对应 create_all 在老版本上建出的库）
+_OLD_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, "
+    "hashed_password VARCHAR(255) NOT NULL, role VARCHAR(20) NOT NULL DEFAULT 'customer', created_at TIMESTAMP)",
+    "CREATE TABLE sellers (id INTEGER PRIMARY KEY, shop_name VARCHAR(100) NOT NULL, contact_info VARCHAR(100))",
+    "CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, price FLOAT NOT NULL, "
+    "description VARCHAR(500), seller_id INTEGER REFERENCES sellers (id), image_url VARCHAR(255))",
+    "CREATE TABLE comments (id INTEGER PRIMARY KEY, content VARCHAR(500) NOT NULL, likes INTEGER, "
+    "user_id INTEGER REFERENCES users (id), product_id INTEGER REFERENCES products (id))",
+    "CREATE TABLE user_favorites (user_id INTEGER NOT NULL REFERENCES users (id), "
+    "product_id INTEGER NOT NULL REFERENCES products (id), PRIMARY KEY (user_id, product_id))",
+]
+
+
+def test_upgrade_adds_columns_indexes_and_backfills_counters(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for ddl in _OLD_SCHEMA:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("INSERT INTO users (id, username, hashed_password) VALUES (1, 'u1', 'x'), (2, 'u2', 'x')")
+        conn.exec_driver_sql("INSERT INTO sellers (id, shop_name) VALUES (1, '老店铺')")
+        conn.exec_driver_sql("INSERT INTO products (id, name, price, seller_id) VALUES (1, '老商品A', 10, 1), (2, '老商品B', 20, 1)")
+        conn.exec_driver_sql("INSERT INTO user_favorites VALUES (1, 1), (2, 1), (2, 2)")
+        conn.exec_driver_sql("INSERT INTO comments (id, content, likes, user_id, product_id) VALUES (1, '不错', 7, 1, 1)")
+
+    result = migrate.upgrade(engine, log=lambda message: None)
+    assert result["tables"] == ["comment_likes"]
+    assert set(result["columns"]) == {"products.favorites_count", "products.comment_count", "products.updated_at"}
+    assert {"ix_products_popularity", "ix_products_updated_at", "ix_comments_product_likes"} <= set(result["indexes"])
+
+    # 老商品的计数按关联表回填，而不是全部为 0；ORM 查询不再报缺列
+    with Session(engine) as db:
+        rows = db.execute(select(models.Product.id, models.Product.favorites_count, models.Product.comment_count,
+                                 models.Product.updated_at).order_by(models.Product.id)).all()
+        # 老版本没有点赞关系表，已有的点赞数不能按空表清零
+        assert db.scalar(select(models.Comment.likes)) == 7
+    assert [(r.id, r.favorites_count, r.comment_count) for r in rows] == [(1, 2, 1), (2, 1, 0)]
+    assert all(r.updated_at is not None for r in rows)
+
+    # 再执行一次什么都不用补
+    assert migrate.upgrade(engine, log=lambda message: None) == {"tables": [], "columns": [], "indexes": []}
+    assert not migrate.missing_columns(engine)
+    with Session(engine) as db:
+        assert db.scalar(select(models.Comment.likes)) == 7
+    present = {index["name"] for index in inspect(engine).get_indexes("products")}
+    assert {index.name for index in models.Product.__table__.indexes} <= present
+    engine.dispose()
@@ -1,5 +1,7 @@
 import pytest
 
+import models
+
 def test_get_products_basic_and_sorting(client, seed_data):
     # 不带排序
     r = client.get("/api/products/")
@@ -79,3 +81,351 @@ def test_comments_basic_flow(client, seed_data):
     # 3. 添加到不存在商品 (即使有 Auth 也应该 404)
     r3 = client.post(f"/api/products/9999/comments", json=payload, headers=headers)
     assert r3.status_code == 404
+
+
+def test_get_products_cursor_pagination(client, seed_data, db_session):
+    seller = seed_data["seller"]
+    # 再加几件同价商品，验证 (price, id) 游标在价格相同时也不会漏行或重复
+    db_session.add_all([
+        models.Product(name=f"同价商品{i}", price=150.0, seller_id=seller.id) for i in range(5)
+    ])
+    db_session.commit()
+    total = db_session.query(models.Product).count()
+
+    for sort_by in ("", "price_asc", "price_desc"):
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if sort_by:
+                params["sort_by"] = sort_by
+            if cursor:
+                params["cursor"] = cursor
+            r = client.get("/api/products/", params=params)
+            assert r.status_code == 200
+            page = r.json()
+            assert len(page) <= 2
+            seen.extend(page)
+            cursor = r.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        ids = [p["id"] for p in seen]
+        assert len(ids) == total
+        assert len(set(ids)) == total
+        if sort_by == "price_asc":
+            assert seen == sorted(seen, key=lambda p: (p["price"], p["id"]))
+        elif sort_by == "price_desc":
+            assert seen == sorted(seen, key=lambda p: (p["price"], p["id"]), reverse=True)
+        else:
+            assert ids == sorted(ids)
+
+
+def test_get_products_invalid_cursor_and_sort(client, seed_data):
+    r = client.get("/api/products/?cursor=not-a-cursor")
+    assert r.status_code == 400
+
+    r2 = client.get("/api/products/?sort_by=unknown")
+    assert r2.status_code == 400
+
+    r3 = client.get("/api/products/?limit=0")
+    assert r3.status_code == 422
+
+
+def test_get_products_filters_and_sort_modes(client, seed_data, db_session):
+    seller = seed_data["seller"]
+    other = models.Seller(shop_name="另一家店")
+    db_session.add(other)
+    db_session.commit()
+    db_session.add_all([
+        models.Product(name="蓝牙耳机", price=300.0, seller_id=other.id, favorites_count=5),
+        models.Product(name="蓝牙音箱", price=500.0, seller_id=other.id, favorites_count=9),
+        models.Product(name="100%纯棉", price=50.0, seller_id=seller.id, favorites_count=1),
+    ])
+    db_session.commit()
+
+    r = client.get("/api/products/", params={"min_price": 100, "max_price": 300, "sort_by": "price,id"})
+    assert r.status_code == 200
+    assert [p["price"] for p in r.json()] == [100.0, 200.0, 300.0]
+
+    r = client.get("/api/products/", params={"seller_id": other.id})
+    assert {p["name"] for p in r.json()} == {"蓝牙耳机", "蓝牙音箱"}
+
+    r = client.get("/api/products/", params={"name_prefix": "蓝牙"})
+    assert {p["name"] for p in r.json()} == {"蓝牙耳机", "蓝牙音箱"}
+
+    # 前缀中的 % 按字面匹配，而不是通配符
+    r = client.get("/api/products/", params={"name_prefix": "100%"})
+    assert [p["name"] for p in r.json()] == ["100%纯棉"]
+    r = client.get("/api/products/", params={"name_prefix": "%"})
+    assert r.json() == []
+
+    r = client.get("/api/products/", params={"sort_by": "newest"})
+    ids = [p["id"] for p in r.json()]
+    assert ids == sorted(ids, reverse=True)
+
+    # 按热度排序并翻页，收藏数相同的商品按 id 倒序
+    names = []
+    cursor = None
+    while True:
+        params = {"sort_by": "popularity", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/api/products/", params=params)
+        names.extend(p["name"] for p in r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert names == ["蓝牙音箱", "蓝牙耳机", "100%纯棉", "商品B", "商品A"]
+
+
+def test_favorite_updates_popularity_count(client, seed_data, db_session):
+    user = seed_data["user"]
+    p1 = seed_data["products"][0]
+    login_resp = client.post("/api/users/login", json={"username": user.username, "password": "password123"})
+    headers = {"Authorization": f"Bearer {login_resp.json()['access_token']}"}
+
+    assert client.post(f"/api/users/favorites/{p1.id}", headers=headers).status_code == 201
+    db_session.refresh(p1)
+    assert p1.favorites_count == 1
+
+    r = client.get("/api/products/", params={"sort_by": "popularity"})
+    assert r.json()[0]["id"] == p1.id
+
+    assert client.delete(f"/api/users/favorites/{p1.id}", headers=headers).status_code == 204
+    db_session.refresh(p1)
+    assert p1.favorites_count == 0
+
+
+def test_search_products_cjk_partial_match(client, seed_data, db_session):
+    seller = seed_data["seller"]
+    db_session.add_all([
+        models.Product(name="降噪蓝牙耳机", price=799.0, description="静享音乐", seller_id=seller.id),
+        models.Product(name="有线耳机", price=99.0, description="入门款", seller_id=seller.id),
+        models.Product(name="机械键盘", price=399.0, description="手感极佳，蓝牙双模", seller_id=seller.id),
+    ])
+    db_session.commit()
+
+    r = client.get("/api/products/search", params={"q": "蓝牙耳机"})
+    assert r.status_code == 200
+    names = [p["name"] for p in r.json()]
+    # 名称完全覆盖查询的排在最前，只命中部分词的也会返回
+    assert names[0] == "降噪蓝牙耳机"
+    assert set(names) == {"降噪蓝牙耳机", "有线耳机", "机械键盘"}
+
+    r = client.get("/api/products/search", params={"q": "降噪"})
+    assert [p["name"] for p in r.json()] == ["降噪蓝牙耳机"]
+
+    r = client.get("/api/products/search", params={"q": "不存在的东西"})
+    assert r.json() == []
+
+    r = client.get("/api/products/search", params={"q": ""})
+    assert r.status_code == 422
+
+
+def test_search_index_follows_publish(client, seed_data):
+    seller = seed_data["seller"]
+    # 先触发一次索引构建，再发布新商品，验证增量更新
+    assert client.get("/api/products/search", params={"q": "手表"}).json() == []
+
+    payload = {"name": "新款智能手表", "price": 1299.0, "description": "续航持久", "image_url": "img"}
+    r = client.post(f"/api/products/?seller_id={seller.id}", json=payload)
+    assert r.status_code == 201
+
+    r = client.get("/api/products/search", params={"q": "智能手表"})
+    assert [p["name"] for p in r.json()] == ["新款智能手表"]
+
+
+def test_search_index_keeps_products_added_during_rebuild(db_session, seed_data):
+    from types import SimpleNamespace
+    from search import ProductSearchIndex
+
+    index = ProductSearchIndex()
+    added = SimpleNamespace(id=9001, name="构建中新增的手表", price=1.0, description="")
+    real_query = db_session.query
+
+    def query_then_add(*columns):
+        # 构建已读到数据库快照之后，才有商品提交并加入索引
+        rows = list(real_query(*columns))
+        index.add(added)
+        return SimpleNamespace(yield_per=lambda n: rows)
+
+    db_session.query = query_then_add
+    index.rebuild(db_session)
+    del db_session.query
+    assert [pid for pid, _ in index.search("手表")] == [9001]
+    assert len(index) == len(seed_data["products"]) + 1
+
+
+def test_product_cache_read_through_and_invalidation(client, seed_data, db_session):
+    from cache import product_cache
+    p1 = seed_data["products"][0]
+    seller = seed_data["seller"]
+
+    assert client.get(f"/api/products/{p1.id}").json()["name"] == "商品A"
+    assert client.get("/api/products/").status_code == 200
+    before = product_cache.stats()
+
+    # 绕过接口直接改库：缓存命中时仍返回旧快照，说明读请求没有打到数据库
+    db_session.query(models.Product).filter(models.Product.id == p1.id).update({"name": "改名后的商品A"})
+    db_session.commit()
+    assert client.get(f"/api/products/{p1.id}").json()["name"] == "商品A"
+    assert len(client.get("/api/products/").json()) == 2
+    after = product_cache.stats()
+    assert after["hits"] == before["hits"] + 2
+
+    # 通过接口发布商品后，列表快照失效
+    payload = {"name": "新商品", "price": 10.0, "description": "d", "image_url": "img"}
+    assert client.post(f"/api/products/?seller_id={seller.id}", json=payload).status_code == 201
+    assert len(client.get("/api/products/").json()) == 3
+
+
+def test_memory_lru_backend_eviction_and_ttl():
+    from cache import MemoryLRUBackend, MISSING
+    backend = MemoryLRUBackend(maxsize=2, ttl=60)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    assert backend.get("a") == 1      # a 变为最近使用
+    backend.set("c", 3)               # 淘汰最久未使用的 b
+    assert backend.get("b") is MISSING
+    assert backend.get("c") == 3
+
+    backend.set("short", 1, ttl=0.001)
+    import time
+    time.sleep(0.01)
+    assert backend.get("short") is MISSING
+
+    stats = backend.stats()
+    assert stats["evictions"] >= 1
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 2
+
+
+def test_etag_conditional_requests(client, seed_data):
+    p1 = seed_data["products"][0]
+    seller = seed_data["seller"]
+
+    for url in ("/api/products/", f"/api/products/{p1.id}", f"/api/products/{p1.id}/comments"):
+        r = client.get(url)
+        assert r.status_code == 200
+        etag = r.headers["ETag"]
+        r2 = client.get(url, headers={"If-None-Match": etag})
+        assert r2.status_code == 304
+        assert r2.headers["ETag"] == etag
+        assert r2.content == b""
+        # 弱比较与多值列表
+        r3 = client.get(url, headers={"If-None-Match": f'"other", W/{etag}'})
+        assert r3.status_code == 304
+
+    list_etag = client.get("/api/products/").headers["ETag"]
+    comments_etag = client.get(f"/api/products/{p1.id}/comments").headers["ETag"]
+
+    # 写商品表后，商品列表的 ETag 失效，评论的不受影响
+    payload = {"name": "新商品", "price": 10.0, "description": "d", "image_url": "img"}
+    assert client.post(f"/api/products/?seller_id={seller.id}", json=payload).status_code == 201
+    r = client.get("/api/products/", headers={"If-None-Match": list_etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != list_etag
+    assert len(r.json()) == 3
+    assert client.get(f"/api/products/{p1.id}/comments", headers={"If-None-Match": comments_etag}).status_code == 304
+
+    # 发表评论后评论列表的 ETag 失效
+    login = client.post("/api/users/login", json={"username": "alice", "password": "password123"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    assert client.post(f"/api/products/{p1.id}/comments", json={"content": "很不错的商品"}, headers=headers).status_code == 201
+    r = client.get(f"/api/products/{p1.id}/comments", headers={"If-None-Match": comments_etag})
+    assert r.status_code == 200
+    assert len(r.json()) == 1
+
+
+def test_comments_pagination_sorting_and_total(client, seed_data, db_session):
+    p1 = seed_data["products"][0]
+    login = client.post("/api/users/login", json={"username": "alice", "password": "password123"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    ids = []
+    for i in range(5):
+        r = client.post(f"/api/products/{p1.id}/comments", json={"content": f"第{i}条评论内容"}, headers=headers)
+        assert r.status_code == 201
+        ids.append(r.json()["id"])
+    # 直接改点赞数，验证按点赞排序
+    for comment_id, likes in zip(ids, [3, 9, 3, 0, 5]):
+        db_session.query(models.Comment).filter(models.Comment.id == comment_id).update({"likes": likes})
+    db_session.commit()
+
+    r = client.get(f"/api/products/{p1.id}/comments", params={"limit": 2})
+    assert r.headers["X-Total-Count"] == "5"
+    assert [c["id"] for c in r.json()] == ids[::-1][:2]
+    assert all(c["username"] == "alice" for c in r.json())
+    r2 = client.get(f"/api/products/{p1.id}/comments", params={"limit": 2, "cursor": r.headers["X-Next-Cursor"]})
+    assert [c["id"] for c in r2.json()] == ids[::-1][2:4]
+
+    collected, cursor = [], None
+    while True:
+        params = {"sort_by": "likes", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get(f"/api/products/{p1.id}/comments", params=params)
+        collected += [c["likes"] for c in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert collected == [9, 5, 3, 3, 0]
+
+    assert client.get(f"/api/products/{p1.id}/comments", params={"sort_by": "oldest"}).status_code == 400
+    assert client.get("/api/products/9999/comments").headers["X-Total-Count"] == "0"
+
+
+def test_comment_likes_are_buffered_and_flushed(client, seed_data, db_session):
+    from likes import like_buffer
+
+    p1 = seed_data["products"][0]
+    login = client.post("/api/users/login", json={"username": "alice", "password": "password123"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    comment_id = client.post(f"/api/products/{p1.id}/comments", json={"content": "值得点赞的评论"}, headers=headers).json()["id"]
+    etag = client.get(f"/api/products/{p1.id}/comments").headers["ETag"]
+
+    r = client.post(f"/api/products/{p1.id}/comments/{comment_id}/like", headers=headers)
+    assert r.status_code == 201 and r.json()["likes"] == 1
+    assert client.post(f"/api/products/{p1.id}/comments/{comment_id}/like", headers=headers).status_code == 400
+    assert client.post(f"/api/products/{p1.id}/comments/9999/like", headers=headers).status_code == 404
+
+    # 增量尚未写回数据库，但评论列表已经能看到，且 ETag 已变化
+    assert db_session.query(models.Comment.likes).filter(models.Comment.id == comment_id).scalar() == 0
+    r = client.get(f"/api/products/{p1.id}/comments", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.json()[0]["likes"] == 1
+
+    assert like_buffer.flush(db_session) == 1
+    db_session.expire_all()
+    assert db_session.query(models.Comment.likes).filter(models.Comment.id == comment_id).scalar() == 1
+    assert client.get(f"/api/products/{p1.id}/comments").json()[0]["likes"] == 1
+
+    r = client.delete(f"/api/products/{p1.id}/comments/{comment_id}/like", headers=headers)
+    assert r.status_code == 200 and r.json()["likes"] == 0
+    assert client.get(f"/api/products/{p1.id}/comments").json()[0]["likes"] == 0
+    # 重复取消不会再减
+    assert client.delete(f"/api/products/{p1.id}/comments/{comment_id}/like", headers=headers).json()["likes"] == 0
+    like_buffer.flush(db_session)
+    db_session.expire_all()
+    assert db_session.query(models.Comment.likes).filter(models.Comment.id == comment_id).scalar() == 0
+
+
+def test_like_buffer_coalesces_and_restores_on_failure():
+    from likes import LikeBuffer
+
+    buffer = LikeBuffer()
+    for _ in range(3):
+        buffer.add(1, 1)
+    buffer.add(2, 1)
+    buffer.add(2, -1)
+    assert (buffer.pending(1), buffer.pending(2), len(buffer)) == (3, 0, 1)
+
+    class BrokenSession:
+        def execute(self, *args, **kwargs):
+            raise RuntimeError("db down")
+
+        def rollback(self):
+            pass
+
+    with pytest.raises(RuntimeError):
+        buffer.flush(BrokenSession())
+    assert buffer.pending(1) == 3
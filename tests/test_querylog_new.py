@@ -0,0 +1,101 @@
+import logging
+
+import pytest
+
+import models
+import querylog
+from api.users import get_password_hash
+
+
+def _login(client, username="alice", password="password123"):
+    r = client.post("/api/users/login", json={"username": username, "password": password})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _many_commenters(db_session, product_id, n=6):
+    hashed = get_password_hash("pw").decode()
+    users = [models.User(username=f"commenter{i}", hashed_password=hashed) for i in range(n)]
+    db_session.add_all(users)
+    db_session.flush()
+    db_session.add_all(models.Comment(content=f"第{i}条评论内容", user_id=u.id, product_id=product_id) for i, u in enumerate(users))
+    db_session.commit()
+
+
+def test_endpoint_query_budgets(client, seed_data, db_session, query_budget):
+    p1_id, p2_id = (p.id for p in seed_data["products"])
+    _many_commenters(db_session, p1_id)
+    headers = _login(client)
+    client.post("/api/users/favorites/batch", json={"product_ids": [p1_id, p2_id]}, headers=headers)
+
+    # 评论列表：一条分页查询（连带用户名）加一条总数查询，与评论者人数无关
+    with query_budget(2):
+        r = client.get(f"/api/products/{p1_id}/comments")
+    assert len(r.json()) == 6
+    # 收藏列表：鉴权已缓存，一条查询取出整页商品
+    with query_budget(1):
+        r = client.get("/api/users/favorites", headers=headers)
+    assert len(r.json()) == 2
+    with query_budget(1):
+        client.get(f"/api/products/{p1_id}")
+    with query_budget(1):
+        client.get("/api/products/", params={"sort_by": "popularity"})
+
+
+def test_budget_flags_n_plus_one_and_overruns(db_session, seed_data, query_budget):
+    p1 = seed_data["products"][0]
+    _many_commenters(db_session, p1.id)
+    comment_ids = [c.id for c in db_session.query(models.Comment.id)]
+    db_session.expire_all()
+
+    # 逐条懒加载评论的作者：条数在预算内，但同一语句重复执行，判为 N+1
+    with pytest.raises(AssertionError, match="N\\+1"):
+        with query_budget(20):
+            for comment in db_session.query(models.Comment).all():
+                comment.user.username
+    with pytest.raises(AssertionError, match="超出预算"):
+        with query_budget(1, allow_repeats=True):
+            for comment_id in comment_ids[:2]:
+                db_session.get(models.Comment, comment_id)
+    db_session.expire_all()
+
+    @query_budget(1)
+    def load_in_one_query():
+        return db_session.query(models.Comment).all()
+    assert len(load_in_one_query()) == 6
+
+
+def test_statement_shape_ignores_values_and_in_list_length():
+    a = querylog.statement_shape("SELECT * FROM products WHERE id IN (?, ?, ?) AND name = 'x' LIMIT 20")
+    b = querylog.statement_shape("SELECT *\n FROM products WHERE id IN (?) AND name = 'it''s' LIMIT 5")
+    assert a == b == "SELECT * FROM products WHERE id IN (?) AND name = ? LIMIT ?"
+    assert querylog.statement_shape("SELECT t1.id FROM t1") == "SELECT t1.id FROM t1"
+
+
+def test_dev_middleware_reports_slow_queries_with_route(db_session, seed_data, monkeypatch, caplog):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from api.products import router as products_router
+    from database import get_db
+
+    api = FastAPI()
+    api.include_router(products_router)
+    api.dependency_overrides[get_db] = lambda: db_session
+    app = FastAPI()
+    app.mount("/api", api)
+    monkeypatch.setattr(querylog, "SLOW_QUERY_MS", 0.0)
+    product_id = seed_data["products"][0].id
+
+    with caplog.at_level(logging.WARNING, logger="querylog"):
+        TestClient(querylog.QueryLogMiddleware(app)).get(f"/api/products/{product_id}/comments")
+    messages = [r.getMessage() for r in caplog.records]
+    assert any("慢查询" in m and "GET /api/products/{product_id}/comments" in m and "comments" in m for m in messages)
+
+    # 同一语句重复执行时报告 N+1
+    caplog.clear()
+    records = [querylog.QueryRecord("SELECT * FROM users WHERE id = ?", (i,), 0.0) for i in range(3)]
+    monkeypatch.setattr(querylog, "SLOW_QUERY_MS", 100.0)
+    with caplog.at_level(logging.WARNING, logger="querylog"):
+        querylog.report_request("GET", "/api/users/favorites", records)
+    assert [r.getMessage() for r in caplog.records] == [
+        "疑似 N+1 [GET /api/users/favorites] 同一语句执行了 3 次：SELECT * FROM users WHERE id = ?"
+    ]
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import favorites
+import models
+from api.recommendations import router as recommendations_router
+from api.users import create_access_token
+from cache import MISSING
+from database import get_db
+from recommender import ItemSimilarity, item_similarity, personal_recommendations
+
+app = FastAPI()
+app.include_router(recommendations_router, prefix="/api")
+
+
+@pytest.fixture
+def client(db_session):
+    def _get_test_db():
+        yield db_session
+    app.dependency_overrides[get_db] = _get_test_db
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def _brute_force(edges, n_users, n_items, top_n):
+    """稠密矩阵直接算出的余弦相似度前 top_n，用作对照。"""
+    x = np.zeros((n_users, n_items))
+    for user, item in edges:
+        x[user, item] = 1
+    co = x.T @ x
+    counts = np.diag(co).copy()
+    expected = {}
+    for item in range(n_items):
+        ranked = []
+        for other in range(n_items):
+            if other != item and co[item, other]:
+                ranked.append((-(co[item, other] / np.sqrt(counts[item] * counts[other])), other))
+        expected[item] = [(other, -neg) for neg, other in sorted(ranked)[:top_n]]
+    return expected
+
+
+def _assert_matches(index, expected):
+    for item, neighbours in expected.items():
+        got = index.similar(item)
+        assert [i for i, _ in got] == [i for i, _ in neighbours], item
+        assert np.allclose([s for _, s in got], [s for _, s in neighbours])
+
+
+def test_incremental_refresh_matches_full_computation():
+    rng = np.random.default_rng(7)
+    n_users, n_items = 40, 60
+    edges = {(int(u), int(i)) for u, i in zip(rng.integers(0, n_users, 150), rng.integers(0, n_items, 150))}
+    index = ItemSimilarity(top_n=5)
+    for user, item in edges:
+        index.record(user, [item], 1)
+    index.refresh()
+    _assert_matches(index, _brute_force(edges, n_users, n_items, 5))
+
+    # 随机收藏/取消收藏几轮，每轮只重算受影响的行，结果应与全量重算一致
+    for _ in range(15):
+        for _ in range(2):
+            edge = (int(rng.integers(0, n_users)), int(rng.integers(0, n_items)))
+            if edge in edges:
+                edges.remove(edge)
+                index.record(edge[0], [edge[1]], -1)
+            else:
+                edges.add(edge)
+                index.record(edge[0], [edge[1]], 1)
+        assert index.refresh() < n_items
+        _assert_matches(index, _brute_force(edges, n_users, n_items, 5))
+
+
+def test_similar_endpoint_follows_favorite_changes(client, db_session):
+    seller = models.Seller(shop_name="推荐测试商家")
+    db_session.add(seller)
+    db_session.flush()
+    products = [models.Product(name=f"商品{i}", price=10 + i, seller_id=seller.id) for i in range(4)]
+    users = [models.User(username=f"rec_user{i}", hashed_password="x") for i in range(3)]
+    db_session.add_all(products + users)
+    db_session.commit()
+    p0, p1, p2, p3 = (p.id for p in products)
+    u0, u1, u2 = (u.id for u in users)
+    favorites.add_favorites(db_session, u0, [p0, p1, p2])
+    favorites.add_favorites(db_session, u1, [p0, p1])
+    favorites.add_favorites(db_session, u2, [p3])
+
+    r = client.get(f"/api/recommendations/similar/{p0}")
+    assert r.status_code == 200
+    assert [p["id"] for p in r.json()] == [p1, p2]
+    assert client.get(f"/api/recommendations/similar/{p3}").json() == []
+    assert client.get("/api/recommendations/similar/9999").status_code == 404
+
+    # 收藏变化提交后记入待合并列表，后台任务（这里直接调用 refresh）合并后生效
+    favorites.remove_favorite(db_session, u1, p1)
+    favorites.add_favorite(db_session, u2, p0)
+    assert item_similarity.pending() == 2
+    item_similarity.refresh()
+    # p0 与 p1、p2、p3 各有一个共同收藏，p3 的收藏数为 1 → 三者相似度相同，按 id 排序
+    assert [p["id"] for p in client.get(f"/api/recommendations/similar/{p0}").json()] == [p1, p2, p3]
+    assert [p["id"] for p in client.get(f"/api/recommendations/similar/{p0}", params={"limit": 1}).json()] == [p1]
+
+
+def test_personal_recommendations_are_cached_and_invalidated(client, db_session, query_budget):
+    seller = models.Seller(shop_name="个性化推荐商家")
+    db_session.add(seller)
+    db_session.flush()
+    products = [models.Product(name=f"商品{i}", price=10 + i, seller_id=seller.id) for i in range(6)]
+    users = [models.User(username=f"personal_user{i}", hashed_password="x") for i in range(4)]
+    db_session.add_all(products + users)
+    db_session.flush()
+    p0, p1, p2, p3, p4, p5 = (p.id for p in products)
+    u0, u1, u2, u3 = (u.id for u in users)
+    db_session.add(models.Comment(content="评论过的商品", user_id=u0, product_id=p4))
+    db_session.commit()
+    favorites.add_favorites(db_session, u0, [p0])
+    favorites.add_favorites(db_session, u1, [p0, p1, p2])
+    favorites.add_favorites(db_session, u2, [p0, p3])
+    favorites.add_favorites(db_session, u3, [p4, p5])
+
+    # 未登录：按收藏数排序的热门商品，一条 SQL 直接取出商品行
+    with query_budget(1):
+        assert [p["id"] for p in client.get("/api/recommendations/").json()] == [p0, p5, p4, p3, p2, p1]
+
+    # 登录：p1/p2/p3 与收藏的 p0 相似度 1/√3，p5 与评论过的 p4 相似度 1（评论权重 0.5），剩下的用热门商品补齐；
+    # 已收藏的 p0 不出现
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(u0)})}"}
+    r = client.get("/api/recommendations/", headers=headers)
+    assert [p["id"] for p in r.json()] == [p1, p2, p3, p5, p4]
+    # 之后的请求只读缓存，唯一的 SQL 是按 id 取商品
+    with query_budget(1):
+        assert [p["id"] for p in client.get("/api/recommendations/", headers=headers, params={"limit": 2}).json()] == [p1, p2]
+
+    # 收藏变化立即让缓存失效；后台批处理为活跃用户重算后，请求又只需读缓存
+    favorites.add_favorite(db_session, u0, p1)
+    item_similarity.refresh()
+    assert personal_recommendations.cache.get(u0) is MISSING
+    assert personal_recommendations.refresh_active(db_session) == 1
+    with query_budget(1):
+        ids = [p["id"] for p in client.get("/api/recommendations/", headers=headers).json()]
+    assert p1 not in ids and ids[:2] == [p2, p3]
+
+    assert client.get("/api/recommendations/", headers={"Authorization": "Bearer bad"}).status_code == 401
@@ -0,0 +1,72 @@
+from sqlalchemy import create_engine, func, select, update
+
+import models
+import passwords
+import seed
+
+
+def test_generate_skewed_data_with_consistent_counters(tmp_path, monkeypatch):
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    report = seed.generate(engine, users=200, products=100, comments=2000, favorites_per_user=5,
+                           distinct_passwords=3, batch_size=97, log=lambda message: None)
+    assert {name: count for name, count, _ in report}["comments"] == 2000
+
+    with engine.connect() as conn:
+        # 批量数据加上演示数据
+        assert conn.scalar(select(func.count()).select_from(models.User)) == 202
+        assert conn.scalar(select(func.count()).select_from(models.Product)) == 103
+        # 每种密码只哈希一次
+        assert conn.scalar(select(func.count(func.distinct(models.User.hashed_password))).where(models.User.username.like("user%"))) == 3
+        admin = conn.execute(select(models.User.hashed_password, models.User.role).where(models.User.username == "admin")).one()
+        assert admin.role == "admin" and passwords.check_password("admin123", admin.hashed_password.encode())
+
+        # 冗余计数与实际行数一致
+        favorites = dict(conn.execute(
+            select(models.user_favorites.c.product_id, func.count()).group_by(models.user_favorites.c.product_id)
+        ).all())
+        comments = dict(conn.execute(
+            select(models.Comment.product_id, func.count()).group_by(models.Comment.product_id)
+        ).all())
+        for product_id, favorites_count, comment_count in conn.execute(
+            select(models.Product.id, models.Product.favorites_count, models.Product.comment_count)
+        ):
+            assert favorites_count == favorites.get(product_id, 0)
+            assert comment_count == comments.get(product_id, 0)
+
+        # 点赞数与点赞关系一致，并且是长尾分布
+        likes = dict(conn.execute(
+            select(models.comment_likes.c.comment_id, func.count()).group_by(models.comment_likes.c.comment_id)
+        ).all())
+        stored_likes = dict(conn.execute(select(models.Comment.id, models.Comment.likes)).all())
+        assert stored_likes == {comment_id: likes.get(comment_id, 0) for comment_id in stored_likes}
+        assert max(stored_likes.values()) > 10 * sum(stored_likes.values()) / len(stored_likes)
+
+    # Zipf 分布：最热门的商品拿到的评论远多于平均值
+    assert max(comments.values()) > 5 * (2000 / 100)
+
+    # 重复运行会先清空，相同种子生成相同数据
+    seed.generate(engine, users=200, products=100, comments=2000, favorites_per_user=5,
+                  distinct_passwords=3, log=lambda message: None)
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(models.Comment)) == 2001
+        assert dict(conn.execute(
+            select(models.Comment.product_id, func.count()).group_by(models.Comment.product_id)
+        ).all()) == comments
+    engine.dispose()
+
+
+def test_recompute_counters_repairs_lost_like_deltas(tmp_path, monkeypatch):
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    seed.generate(engine, users=20, products=10, comments=50, log=lambda message: None)
+    with engine.begin() as conn:
+        expected = dict(conn.execute(select(models.Comment.id, models.Comment.likes)).all())
+        # 模拟进程崩溃：点赞关系已提交，缓冲的增量没有写回
+        conn.execute(update(models.Comment.__table__).values(likes=0))
+
+    seed.main(["--recompute-counters", "--database-url", f"sqlite:///{tmp_path / 'seed.db'}"])
+    with engine.connect() as conn:
+        assert dict(conn.execute(select(models.Comment.id, models.Comment.likes)).all()) == expected
+        assert conn.scalar(select(func.count()).select_from(models.Comment)) == 51
+    engine.dispose()
@@ -104,3 +104,167 @@ def test_access_favorites_without_token(client):
     # 测试未登录访问收藏
     r = client.get("/api/users/favorites")
     assert r.status_code == 401
+
+
+def test_favorites_probe_pagination_and_batch(client, seed_data, db_session):
+    import models
+
+    seller = seed_data["seller"]
+    extra = [models.Product(name=f"批量{i}", price=1.0 + i, seller_id=seller.id) for i in range(5)]
+    db_session.add_all(extra)
+    db_session.commit()
+    ids = [p.id for p in seed_data["products"]] + [p.id for p in extra]
+
+    login_resp = client.post("/api/users/login", json={"username": "alice", "password": "password123"})
+    headers = {"Authorization": f"Bearer {login_resp.json()['access_token']}"}
+
+    assert client.get(f"/api/users/favorites/{ids[0]}", headers=headers).json() == {"product_id": ids[0], "favorited": False}
+    assert client.post(f"/api/users/favorites/{ids[0]}", headers=headers).status_code == 201
+    assert client.get(f"/api/users/favorites/{ids[0]}", headers=headers).json()["favorited"] is True
+
+    r = client.post("/api/users/favorites/batch", json={"product_ids": ids + [9999, ids[1]]}, headers=headers)
+    assert r.status_code == 200
+    assert r.json() == {"added": ids[1:], "already_favorited": [ids[0]], "not_found": [9999]}
+
+    # 分页：按商品 id 倒序，id 大的在前
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        r = client.get("/api/users/favorites", params=params, headers=headers)
+        seen += [p["id"] for p in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == sorted(ids, reverse=True)
+
+    counts = dict(db_session.query(models.Product.id, models.Product.favorites_count).all())
+    assert all(counts[pid] == 1 for pid in ids)
+
+    r = client.post("/api/users/favorites/batch/remove", json={"product_ids": [ids[0], ids[2], 9999]}, headers=headers)
+    assert r.json() == {"removed": [ids[0], ids[2]], "not_favorited": [9999]}
+    db_session.expire_all()
+    counts = dict(db_session.query(models.Product.id, models.Product.favorites_count).all())
+    assert (counts[ids[0]], counts[ids[1]], counts[ids[2]]) == (0, 1, 0)
+
+    assert client.post("/api/users/favorites/batch", json={"product_ids": []}, headers=headers).status_code == 422
+    assert client.delete("/api/users/favorites/9999", headers=headers).status_code == 404
+
+
+def test_favorite_insert_rejects_unsupported_dialect(db_session, monkeypatch):
+    import favorites
+
+    # 没有 "忽略重复" 语法的方言直接报错，而不是退回普通 INSERT、遇到重复收藏时抛 IntegrityError
+    monkeypatch.setattr(db_session.get_bind().dialect, "name", "oracle")
+    with pytest.raises(NotImplementedError):
+        favorites.add_favorite(db_session, 1, 1)
+
+
+def test_principal_cache_skips_user_lookup_and_invalidates_on_change(client, seed_data, db_session):
+    import models
+    from cache import principal_cache
+
+    user = seed_data["user"]
+    login_resp = client.post("/api/users/login", json={"username": "alice", "password": "password123"})
+    headers = {"Authorization": f"Bearer {login_resp.json()['access_token']}"}
+
+    assert client.get("/api/users/favorites", headers=headers).status_code == 200
+    misses = principal_cache.users.misses
+    assert client.get("/api/users/favorites", headers=headers).status_code == 200
+    assert principal_cache.users.misses == misses
+    assert principal_cache.users.hits >= 1 and principal_cache.tokens.hits >= 1
+
+    # 修改用户后提交，缓存立即失效
+    db_session.query(models.User).filter(models.User.id == user.id).update({"username": "alice2"})
+    db_session.commit()
+    r = client.post(f"/api/products/{seed_data['products'][0].id}/comments", json={"content": "改名后的评论"}, headers=headers)
+    assert r.json()["username"] == "alice2"
+
+    # 删除用户后，原令牌不再有效
+    db_session.query(models.User).filter(models.User.id == user.id).delete()
+    db_session.commit()
+    assert client.get("/api/users/favorites", headers=headers).status_code == 401
+
+
+def test_login_rehashes_when_bcrypt_cost_changes(client, db_session, monkeypatch):
+    import bcrypt
+    import models
+    import passwords
+
+    legacy = bcrypt.hashpw(b"pw123456", bcrypt.gensalt(rounds=4)).decode("utf-8")
+    db_session.add(models.User(username="legacy", hashed_password=legacy))
+    db_session.commit()
+
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 5)
+    r = client.post("/api/users/login", json={"username": "legacy", "password": "pw123456"})
+    assert r.status_code == 200
+    db_session.expire_all()
+    stored = db_session.query(models.User).filter(models.User.username == "legacy").one().hashed_password
+    assert passwords.hash_rounds(stored) == 5
+    assert stored != legacy
+
+    # 成本未变化时不再重新哈希；旧密码依然可以登录
+    assert client.post("/api/users/login", json={"username": "legacy", "password": "pw123456"}).status_code == 200
+    db_session.expire_all()
+    assert db_session.query(models.User.hashed_password).filter(models.User.username == "legacy").scalar() == stored
+    assert client.post("/api/users/login", json={"username": "legacy", "password": "wrong"}).status_code == 401
+
+
+def test_bounded_executor_rejects_when_full():
+    import asyncio
+    import threading
+    from fastapi import HTTPException
+    from passwords import BoundedExecutor
+
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        second = asyncio.ensure_future(executor.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        stats = executor.stats()
+        assert (stats["in_flight"], stats["queue_depth"]) == (1, 1)
+        with pytest.raises(HTTPException) as exc:
+            await executor.run(lambda: None)
+        assert exc.value.status_code == 503
+        release.set()
+        assert await first is True
+        assert await second == "queued"
+
+    asyncio.run(scenario())
+    stats = executor.stats()
+    assert (stats["rejected"], stats["queue_depth"], stats["in_flight"]) == (1, 0, 0)
+
+
+def test_bounded_executor_counts_tasks_until_they_finish():
+    import asyncio
+    import threading
+    from fastapi import HTTPException
+    from passwords import BoundedExecutor
+
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        # 等待方被取消：排队中的任务随之取消，名额立即归还；执行中的任务仍占着名额直到线程结束
+        running.cancel()
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        assert executor.stats()["queue_depth"] == 0
+        third = asyncio.ensure_future(executor.run(lambda: "third"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException):
+            await asyncio.wait_for(executor.run(lambda: None), 1)
+        release.set()
+        assert await third == "third"
+        assert await executor.run(lambda: "free") == "free"
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+    stats = executor.stats()
+    assert (stats["rejected"], stats["queue_depth"], stats["in_flight"]) == (1, 0, 0)